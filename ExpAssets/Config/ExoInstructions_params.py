@@ -67,3 +67,19 @@ append_hostname = False
 #########################################
 # PROJECT-SPECIFIC VARS
 #########################################
+poll_rate = 1000 # rate (in Hz) of gaze/key checks while waiting for the cue & target
+poll_spin_ms = None # how long before the cue/target to stop sleeping between checks (None to use the OS sleep granularity)
+text_cache_size = 2500 # max number of rendered strings to keep cached for reuse
+trial_dump_format = 'text' # format of trial_dump file ('text' for a readable table, 'tsv' for analysis)
+trial_commit_mode = 'idle' # when to commit queued trial data ('idle' for during feedback/ITI, 'feedback' for right after each feedback flip, or 'block')
+iti_idle_time = 10 # max time (in ms) to spend on deferred work before each drift correct
+adaptive_drift_correct = False # only drift correct when estimated drift/time since last is too large
+drift_threshold = 0.5 # estimated gaze drift (in degrees) at which to drift correct
+drift_max_interval = 300 # max time (in seconds) between drift corrections
+edf_stand_in = None # path of a local EDF to 'receive' instead of the tracker's (for testing transfers)
+edf_stand_in_rate = None # max transfer rate (in bytes/sec) for the stand-in EDF
+session_monitor = 'file' # where to publish live session metrics ('file', 'udp', 'both', or None)
+monitor_port = 47470 # local UDP port to publish live session metrics to
+fixation_dwell = 20 # min time (in ms) gaze must stay outside the fixation boundary to count as looking away
+blink_sample_loss = 50 # min time (in ms) of consecutive missing gaze samples to count as a blink
+session_slot_minutes = 60 # length (in minutes) of the booked session slot, for flagging sessions predicted to overrun (None to disable)
@@ -62,8 +62,64 @@ CREATE TABLE trials (
     target_loc text not null,
     cue_loc text not null,
     cue_validity boolean not null,
+    cue_onset integer not null,
+    block_seed integer not null,
     rt text not null,
+    rt_poll text not null,
     response text not null,
     accuracy text not null,
-    err text not null
+    err text not null,
+    target_refreshes text not null,
+    target_timing text not null,
+    poll_rate real not null,
+    poll_max_gap real not null,
+    drift_est text not null,
+    drift_correct text not null
+);
+
+CREATE TABLE frame_timing (
+    id integer primary key autoincrement not null,
+    participant_id integer not null references participants(id),
+    block_num integer not null,
+    trial_num integer not null,
+    recycled boolean not null,
+    frame text not null,
+    scheduled text not null,
+    flipped real not null,
+    lag text not null
+);
+
+CREATE TABLE eye_events (
+    id integer primary key autoincrement not null,
+    participant_id integer not null references participants(id),
+    block_num integer not null,
+    trial_num integer not null,
+    trial_time real not null,
+    tracker_time integer not null,
+    event text not null,
+    label text not null
+);
+
+CREATE TABLE block_summary (
+    id integer primary key autoincrement not null,
+    participant_id integer not null references participants(id),
+    block_num integer not null,
+    instructions text not null,
+    practice boolean not null,
+    trials integer not null,
+    recycled integer not null,
+    recycle_rate text not null,
+    recycle_reasons text not null,
+    duration real not null,
+    predicted_total text not null,
+    overrun boolean not null
+);
+
+CREATE TABLE startup_timing (
+    id integer primary key autoincrement not null,
+    participant_id integer not null references participants(id),
+    phase text not null,
+    thread text not null,
+    start real not null,
+    duration real not null
 );
@@ -0,0 +1,179 @@
+import os
+import json
+
+
+class SessionCheckpoint(object):
+    """Saves a session's compiled trial structure and progress to disk.
+
+    The compiled structure is written once at the start of the session, along
+    with a small progress file listing the completed trials of the current
+    block. Progress is updated in memory after every trial, and is meant to be
+    journaled with the trial's data (see :meth:`state`) and saved to the
+    progress file whenever that data is committed (see :meth:`save`). If the
+    experiment crashes partway through, the two files (updated from the journal
+    with :meth:`restore`) are enough to rebuild the remaining trials of the
+    session exactly.
+
+    Args:
+        dirpath (str): The folder in which to save the checkpoint files.
+        participant_id (int): The database ID of the session's participant.
+
+    """
+    def __init__(self, dirpath, participant_id):
+        self.participant_id = participant_id
+        prefix = os.path.join(dirpath, "p{0}".format(participant_id))
+        self._structure_path = prefix + "_structure.json"
+        self._progress_path = prefix + "_progress.json"
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        self.structure = None
+        self.progress = {'complete': False, 'block': 0, 'done': []}
+        self._dirty = False
+
+    @classmethod
+    def load(cls, dirpath, participant_id):
+        """Loads a previously-saved checkpoint for a given participant."""
+        ckpt = cls(dirpath, participant_id)
+        with open(ckpt._structure_path, 'r', encoding='utf-8') as f:
+            ckpt.structure = json.load(f)
+        if os.path.exists(ckpt._progress_path):
+            with open(ckpt._progress_path, 'r', encoding='utf-8') as f:
+                ckpt.progress = json.load(f)
+        return ckpt
+
+    @classmethod
+    def find_incomplete(cls, dirpath, condition):
+        """Finds the most recent incomplete session for a given condition.
+
+        Only the small progress file of each session is read, so the full
+        structure is only loaded for the session that's found.
+
+        Returns:
+            :obj:`SessionCheckpoint` or None: The checkpoint of the most recently
+            updated incomplete session, or None if there are none.
+
+        """
+        if not os.path.isdir(dirpath):
+            return None
+        found = []
+        for f in os.listdir(dirpath):
+            if not (f.startswith("p") and f.endswith("_progress.json")):
+                continue
+            path = os.path.join(dirpath, f)
+            with open(path, 'r', encoding='utf-8') as fp:
+                progress = json.load(fp)
+            if progress['complete'] or progress.get('abandoned'):
+                continue
+            if progress.get('condition') != condition:
+                continue
+            found.append((os.path.getmtime(path), int(f[1:-len("_progress.json")])))
+        if not found:
+            return None
+        return cls.load(dirpath, sorted(found)[-1][1])
+
+    @classmethod
+    def restore(cls, dirpath, state):
+        """Saves the progress from a journaled state to its session's checkpoint.
+
+        Args:
+            dirpath (str): The folder the checkpoint files are saved in.
+            state (dict): A state returned by :meth:`state`, as recovered from
+                the journal of a crashed session.
+
+        """
+        ckpt = cls(dirpath, state['participant_id'])
+        if not os.path.exists(ckpt._structure_path):
+            return
+        if os.path.exists(ckpt._progress_path):
+            # Don't undo a session being marked as finished or abandoned
+            ckpt = cls.load(dirpath, state['participant_id'])
+            if ckpt.progress['complete'] or ckpt.progress.get('abandoned'):
+                return
+        ckpt.progress = state['progress']
+        ckpt._write(ckpt._progress_path, ckpt.progress)
+
+    def save_structure(self, condition, random_seed, blocks):
+        """Saves the compiled trial structure for the session.
+
+        Args:
+            condition (str): The experimental condition of the session.
+            random_seed (int): The random seed of the session.
+            blocks (list): A (label, practice, trials) tuple for each block of the
+                session.
+
+        """
+        self.progress['condition'] = condition
+        self.structure = {
+            'condition': condition,
+            'random_seed': random_seed,
+            'blocks': [
+                {'label': label, 'practice': practice, 'trials': trials}
+                for label, practice, trials in blocks
+            ],
+        }
+        self._write(self._structure_path, self.structure)
+        self._write(self._progress_path, self.progress)
+
+    def trial_done(self, block_num, trial_idx):
+        """Marks a trial of a given block as completed (in memory only)."""
+        if block_num != self.progress['block']:
+            self.progress['block'] = block_num
+            self.progress['done'] = []
+        self.progress['done'].append(trial_idx)
+        self._dirty = True
+
+    def state(self):
+        """dict: The session's current progress, for journaling with trial data."""
+        return {'participant_id': self.participant_id, 'progress': self.progress}
+
+    def save(self):
+        """Saves the session's progress to disk, if it's changed since last saved."""
+        if self._dirty:
+            self._write(self._progress_path, self.progress)
+            self._dirty = False
+
+    def session_done(self):
+        """Marks the session as completed, so it can no longer be resumed."""
+        self.progress['complete'] = True
+        self._write(self._progress_path, self.progress)
+
+    def abandon(self):
+        """Marks the session as abandoned, so it's no longer offered for resuming."""
+        self.progress['abandoned'] = True
+        self._write(self._progress_path, self.progress)
+
+    def remaining(self):
+        """Gets the trials remaining in the session.
+
+        Returns:
+            tuple: The number of fully-completed blocks, the number of completed
+            trials in the first remaining block, and a (label, practice, trials)
+            tuple for each block with trials remaining.
+
+        """
+        blocks = self.structure['blocks']
+        block_num = self.progress['block']
+        done = set(self.progress['done'])
+        if block_num == 0:
+            first = 0
+        else:
+            first = block_num - 1
+            if len(done) >= len(blocks[first]['trials']):
+                first, done = (block_num, set())
+
+        remaining = []
+        for i, b in enumerate(blocks[first:]):
+            trials = b['trials']
+            if i == 0:
+                trials = [t for t in trials if not t['trial_idx'] in done]
+            remaining.append((b['label'], b['practice'], trials))
+        return (first, len(done), remaining)
+
+    def _write(self, path, data):
+        # Writes to a temporary file first so a crash mid-write can't corrupt it
+        tmp = path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
@@ -0,0 +1,210 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import deque
+
+
+def insert_rows(db, rows):
+    """Inserts a list of (table, row) tuples into a database in one transaction.
+
+    Args:
+        db (:obj:`sqlite3.Connection`): The database connection to write to.
+        rows (list): A (table, row) tuple for each row to write, where each row is
+            a dict with column names as keys.
+
+    """
+    # Group rows by table and columns so each group can be written at once
+    batches = {}
+    for table, row in rows:
+        cols = tuple(row.keys())
+        batches.setdefault((table, cols), []).append(tuple(row.values()))
+    with db:
+        for (table, cols), values in batches.items():
+            names = ", ".join(['"{0}"'.format(col) for col in cols])
+            q = "INSERT INTO {0} ({1}) VALUES ({2})".format(
+                table, names, ", ".join(["?"] * len(cols))
+            )
+            db.executemany(q, values)
+
+
+class BatchWriter(object):
+    """Writes rows to the project database in batches from a background thread.
+
+    Rows are added to a bounded in-memory ring buffer, which is periodically
+    drained by a worker thread that writes everything in it to the database in
+    a single transaction. This keeps database I/O out of timing-critical loops:
+    adding a row is just an append to the buffer.
+
+    If the buffer fills up before the worker can drain it, the oldest rows are
+    discarded and counted in :attr:`dropped`.
+
+    Args:
+        db_path (str): The path of the SQLite database to write to.
+        maxlen (int, optional): The maximum number of rows to buffer.
+        interval (float, optional): How often (in seconds) to drain the buffer.
+
+    """
+    def __init__(self, db_path, maxlen=20000, interval=0.5):
+        self.db_path = db_path
+        self.interval = interval
+        self.dropped = 0
+        self.written = 0
+        self._buffer = deque(maxlen=maxlen)
+        self._wake = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="BatchWriter")
+        self._thread.daemon = True
+
+    def start(self):
+        """Starts the background writer thread."""
+        self._thread.start()
+
+    def put(self, table, row):
+        """Adds a row to be written to a given table of the database.
+
+        Args:
+            table (str): The name of the table to write the row to.
+            row (dict): The row to write, with column names as keys.
+
+        """
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append((table, row))
+
+    def close(self):
+        """Writes any remaining rows and stops the writer thread."""
+        self._done.set()
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self):
+        db = sqlite3.connect(self.db_path)
+        try:
+            while not self._done.is_set():
+                self._wake.wait(self.interval)
+                self._wake.clear()
+                self._drain(db)
+            self._drain(db)
+        finally:
+            db.close()
+
+    def _drain(self, db):
+        rows = []
+        while self._buffer:
+            rows.append(self._buffer.popleft())
+        if rows:
+            insert_rows(db, rows)
+            self.written += len(rows)
+
+
+class JournaledWriter(object):
+    """Queues rows for the project database and commits them in batches.
+
+    Queued rows are appended to a journal file on disk each time :meth:`sync`
+    is called (e.g. once at the end of each trial), so that rows which haven't
+    been committed yet can be recovered if the experiment crashes. Syncing
+    writes all rows queued since the last sync at once, so each trial's data
+    costs a single journal write. The database is switched to write-ahead
+    logging (WAL) so that batched commits are cheap and don't block readers,
+    with full syncing so that a committed row is on disk before it's cleared
+    from the journal.
+
+    A small record of the session's progress (e.g. its checkpoint) can also be
+    journaled with each sync, so that it becomes durable in the same write as
+    the data it describes.
+
+    Any rows left in the journal from a previous crash are written to the
+    database when the writer is created, and the last progress record left in
+    it is kept in :attr:`recovered_state`.
+
+    Args:
+        db_path (str): The path of the SQLite database to write to.
+        journal_path (str): The path of the journal file.
+        fsync (bool, optional): Whether to force each journal write to disk.
+            Without this, queued rows survive a crash of the experiment but not
+            a crash of the OS or a power loss. Defaults to True.
+
+    """
+    def __init__(self, db_path, journal_path, fsync=True):
+        self.fsync = fsync
+        self._db = sqlite3.connect(db_path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._staged = []
+        self._pending = []
+        self._journal_path = journal_path
+        self.recovered_state = None
+        self.recovered = self._recover()
+        self._journal = open(journal_path, "a")
+
+    def add(self, table, row):
+        """Queues a row to be written to a given table of the database.
+
+        The row isn't written to the journal until the next call to
+        :meth:`sync` (or :meth:`commit`).
+
+        Args:
+            table (str): The name of the table to write the row to.
+            row (dict): The row to write, with column names as keys.
+
+        """
+        self._staged.append((table, row))
+
+    def sync(self, state=None):
+        """Writes all rows queued since the last sync to the journal at once.
+
+        Args:
+            state (dict, optional): A record of the session's progress to
+                journal along with the rows.
+
+        """
+        lines = [json.dumps([table, row]) + "\n" for table, row in self._staged]
+        if state is not None:
+            lines.append(json.dumps([None, state]) + "\n")
+        if not lines:
+            return
+        self._journal.write("".join(lines))
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._pending += self._staged
+        self._staged = []
+
+    def commit(self):
+        """Writes all queued rows to the database and clears the journal."""
+        self.sync()
+        if not self._pending:
+            return
+        insert_rows(self._db, self._pending)
+        self._pending = []
+        self._journal.seek(0)
+        self._journal.truncate()
+
+    def close(self):
+        """Commits any remaining rows and closes the database and journal."""
+        self.commit()
+        self._journal.close()
+        os.remove(self._journal_path)
+        self._db.close()
+
+    def _recover(self):
+        # Writes any rows left in the journal by a crashed session to the database
+        if not os.path.exists(self._journal_path):
+            return 0
+        rows = []
+        with open(self._journal_path, "r") as f:
+            for line in f:
+                try:
+                    table, row = json.loads(line)
+                except ValueError:
+                    # If the crash happened mid-write, the last line may be partial
+                    continue
+                if table is None:
+                    self.recovered_state = row
+                else:
+                    rows.append((table, row))
+        if rows:
+            insert_rows(self._db, rows)
+        os.remove(self._journal_path)
+        return len(rows)
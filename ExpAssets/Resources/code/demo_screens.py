@@ -0,0 +1,170 @@
+import time
+import threading
+
+from klibs import P
+from klibs.KLTime import precise_time
+from klibs.KLUtilities import deg_to_px
+from klibs.KLGraphics import NumpySurface, fill, blit, flip
+from klibs.KLUserInterface import any_key, ui_request
+
+from polling import SLEEP_GRANULARITY
+from text_cache import cached_message
+
+# Instruction and demo screens are described up front and rendered into complete
+# frames on a background thread a few screens ahead of the participant, so that
+# moving to the next screen only takes a single blit + flip.
+
+
+class DemoScreen(object):
+    """A screen of task instructions, with optional example stimuli.
+
+    Args:
+        msgs (str or list): The line(s) of text to show on the screen.
+        stim_set (list, optional): A list of (stimulus, location) tuples to draw on
+            the screen, where location can also be a list of locations.
+        duration (float, optional): The time (in seconds) the screen stays up
+            before continuing or waiting for a keypress. Defaults to 1.0.
+        wait (bool, optional): Whether to wait for a keypress before continuing
+            to the next screen. Defaults to True.
+        msg_y (int, optional): The y coordinate of the first line of text.
+            Defaults to the middle of the screen.
+
+    """
+    def __init__(self, msgs, stim_set=None, duration=1.0, wait=True, msg_y=None):
+        self.msgs = msgs if isinstance(msgs, list) else [msgs]
+        self.stim_set = stim_set if stim_set else []
+        self.duration = duration
+        self.wait = wait
+        self.msg_y = msg_y
+
+
+def render_screen(screen):
+    """Renders a :obj:`DemoScreen` into a single full-screen surface.
+
+    Returns:
+        :obj:`~klibs.KLGraphics.NumpySurface`: The rendered screen.
+
+    """
+    frame = NumpySurface(width=P.screen_x, height=P.screen_y)
+    msg_x = int(P.screen_x / 2)
+    msg_y = int(P.screen_y * 0.5) if screen.msg_y is None else screen.msg_y
+    half_space = deg_to_px(0.5)
+    for msg in screen.msgs:
+        txt = cached_message(msg, align="center")
+        frame.blit(txt, 5, (msg_x, msg_y))
+        msg_y += txt.height + half_space
+    for stim, locs in screen.stim_set:
+        if not isinstance(locs, list):
+            locs = [locs]
+        for loc in locs:
+            frame.blit(stim, 5, loc)
+    frame.render()
+    return frame
+
+
+class ScreenRenderer(object):
+    """Renders a sequence of screens on a background thread.
+
+    The renderer stays a fixed number of screens ahead of the last one
+    retrieved, so only a few rendered frames are held in memory at once.
+
+    Args:
+        screens (list): The :obj:`DemoScreen` objects to render, in order.
+        ahead (int, optional): The number of screens to render ahead of the one
+            currently being shown (at least 1). Defaults to 2.
+
+    """
+    def __init__(self, screens, ahead=2):
+        self.screens = screens
+        self.ahead = max(1, ahead)
+        self._frames = {}
+        self._shown = -1
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        try:
+            for i, screen in enumerate(self.screens):
+                with self._cond:
+                    while i > self._shown + self.ahead:
+                        self._cond.wait()
+                frame = render_screen(screen)
+                with self._cond:
+                    self._frames[i] = frame
+                    self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self._error = e
+                self._cond.notify_all()
+
+    def get(self, i):
+        """Gets the rendered frame for a screen, waiting for it if needed.
+
+        Getting a frame lets the renderer move on to the screens after it.
+
+        """
+        with self._cond:
+            while not i in self._frames:
+                if self._error:
+                    raise self._error
+                self._cond.wait()
+            frame = self._frames.pop(i)
+            self._shown = i
+            self._cond.notify_all()
+        return frame
+
+
+def _wait_until(t):
+    # Sleeps in short steps (checking for quit/pause requests between them) until
+    # close to the given time, then spins for the rest so it isn't overslept
+    spin = SLEEP_GRANULARITY / 1000.0
+    while True:
+        ui_request()
+        remaining = t - precise_time()
+        if remaining <= spin:
+            break
+        time.sleep(min(remaining - spin, 0.01))
+    while precise_time() < t:
+        pass
+
+
+def show_screens(screens, ahead=2, on_first_flip=None):
+    """Shows a sequence of instruction/demo screens, rendering them ahead of time
+    in the background.
+
+    Screens that don't wait for a keypress are shown for their exact duration:
+    the next screen is drawn while the current one is up, and flipped to the
+    display once the duration has elapsed.
+
+    Args:
+        screens (list): The :obj:`DemoScreen` objects to show, in order.
+        ahead (int, optional): The number of screens to render ahead of the one
+            currently being shown. Defaults to 2.
+        on_first_flip (callable, optional): A function to call once the first
+            screen is on the display.
+
+    """
+    renderer = ScreenRenderer(screens, ahead)
+    renderer.start()
+    # Flip half a refresh early, since the flip itself waits for the next refresh
+    flip_margin = P.refresh_time / 2000.0
+    next_flip = None
+    for i, screen in enumerate(screens):
+        fill()
+        blit(renderer.get(i), 5, P.screen_c)
+        if next_flip:
+            _wait_until(next_flip)
+        flip()
+        if i == 0 and on_first_flip:
+            on_first_flip()
+        next_flip = precise_time() + screen.duration - flip_margin
+        if screen.wait:
+            _wait_until(next_flip)
+            any_key()
+            next_flip = None
+    if next_flip:
+        _wait_until(next_flip)
@@ -0,0 +1,92 @@
+import math
+from klibs.KLTime import precise_time
+
+from gaze import MISSING_DATA
+
+
+class DriftEstimator(object):
+    """Keeps a running estimate of eye tracker drift from fixation samples.
+
+    Gaze samples collected while the participant is known to be fixating are
+    averaged within each trial, and the mean offset of each trial from the
+    fixation point is then folded into an exponentially-weighted running
+    estimate across trials.
+
+    Args:
+        center (tuple): The (x, y) pixel coordinates of the fixation point.
+        weight (float, optional): The weight given to the most recent trial when
+            updating the running estimate (between 0 and 1).
+
+    """
+    def __init__(self, center, weight=0.5):
+        self.center = center
+        self.weight = weight
+        self.reset()
+
+    def reset(self):
+        """Resets the drift estimate (e.g. after a drift correction)."""
+        self.offset = None
+        self.last_correction = precise_time()
+        self._sum_x, self._sum_y, self._n = (0.0, 0.0, 0)
+
+    def add_sample(self, gaze):
+        """Adds a gaze sample collected during fixation for the current trial.
+
+        Missing samples (e.g. during a blink) are ignored.
+
+        """
+        if gaze is None or any(
+            v is None or math.isnan(v) or v == MISSING_DATA for v in gaze[:2]
+        ):
+            return
+        self._sum_x += gaze[0] - self.center[0]
+        self._sum_y += gaze[1] - self.center[1]
+        self._n += 1
+
+    def discard(self):
+        """Discards the samples from the current trial (e.g. if it's recycled)."""
+        self._sum_x, self._sum_y, self._n = (0.0, 0.0, 0)
+
+    def update(self):
+        """Folds the samples from the last trial into the running estimate."""
+        if self._n == 0:
+            return
+        trial_offset = (self._sum_x / self._n, self._sum_y / self._n)
+        if self.offset is None:
+            self.offset = trial_offset
+        else:
+            w = self.weight
+            self.offset = (
+                w * trial_offset[0] + (1 - w) * self.offset[0],
+                w * trial_offset[1] + (1 - w) * self.offset[1],
+            )
+        self._sum_x, self._sum_y, self._n = (0.0, 0.0, 0)
+
+    @property
+    def distance(self):
+        """float or None: The estimated size of the drift (in pixels)."""
+        if self.offset is None:
+            return None
+        return math.sqrt(self.offset[0] ** 2 + self.offset[1] ** 2)
+
+    def check(self, threshold, max_interval):
+        """Checks whether a drift correction is needed.
+
+        Args:
+            threshold (float): The estimated drift (in pixels) at which to
+                perform a drift correction.
+            max_interval (float): The maximum time (in seconds) to go between
+                drift corrections.
+
+        Returns:
+            str or None: The reason a drift correction is needed ('no_estimate',
+            'drift', or 'interval'), or None if it isn't.
+
+        """
+        if self.offset is None:
+            return "no_estimate"
+        elif self.distance >= threshold:
+            return "drift"
+        elif (precise_time() - self.last_correction) >= max_interval:
+            return "interval"
+        return None
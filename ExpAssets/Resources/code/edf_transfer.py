@@ -0,0 +1,331 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+class TrackerEDFSource(object):
+    """Receives an EDF file from a connected EyeLink tracker.
+
+    Args:
+        el: The experiment's EyeLink object.
+        edf_name (str): The name of the EDF file on the tracker.
+
+    """
+    def __init__(self, el, edf_name):
+        self.el = el
+        self.edf_name = edf_name
+
+    def fetch(self, local_path):
+        """Closes the EDF on the tracker and copies it to the given local path."""
+        self.el.setOfflineMode()
+        self.el.closeDataFile()
+        # Use the tracker's own receive method, even if it's been wrapped by
+        # skip_shutdown_receive()
+        receive = getattr(self.el.receiveDataFile, 'original', self.el.receiveDataFile)
+        receive(self.edf_name, local_path)
+
+
+class LocalEDFSource(object):
+    """A stand-in tracker that 'receives' an EDF by copying a local file.
+
+    Used for testing the EDF transfer without an eye tracker attached. The copy
+    can be throttled to approximate the speed of a real tracker link.
+
+    Args:
+        path (str): The path of the EDF to copy.
+        rate (float, optional): The max transfer rate (in bytes per second).
+
+    """
+    def __init__(self, path, rate=None):
+        self.path = path
+        self.rate = rate
+        self.edf_name = os.path.basename(path)
+
+    def fetch(self, local_path):
+        with open(self.path, "rb") as src, open(local_path, "wb") as dst:
+            while True:
+                chunk = src.read(CHUNK_SIZE // 8)
+                if not chunk:
+                    break
+                dst.write(chunk)
+                dst.flush()
+                if self.rate:
+                    time.sleep(len(chunk) / float(self.rate))
+
+
+def _sha256(path, size=None):
+    # Gets the checksum of a file (or of the first 'size' bytes of it)
+    h = hashlib.sha256()
+    remaining = os.path.getsize(path) if size is None else size
+    with open(path, "rb") as f:
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            h.update(chunk)
+            remaining -= len(chunk)
+    return h
+
+
+class EDFTransfer(object):
+    """Transfers an EDF file from the eye tracker.
+
+    The transfer happens in two stages: first, the EDF is received from the
+    tracker into a temporary folder. Then, it is copied in chunks next to its
+    final location, checked against the received file's checksum, and renamed
+    into place. An existing file at the destination is never overwritten.
+
+    The state of each transfer is kept in a small manifest file in the temporary
+    folder, so that if a transfer is interrupted (while receiving or copying),
+    it can be picked up where it left off the next time (see
+    :func:`pending_transfers`). Transfers are run in the background with a
+    :obj:`TransferQueue`.
+
+    Args:
+        source: The source of the EDF (a :obj:`TrackerEDFSource` or
+            :obj:`LocalEDFSource`), or None if it has already been received.
+        dest (str): The final path for the EDF file.
+        tmp_dir (str): The folder in which to keep the received EDF until the
+            copy has been verified.
+
+    """
+    def __init__(self, source, dest, tmp_dir):
+        self.source = source
+        self.dest = dest
+        self.tmp_dir = tmp_dir
+        self.phase = "waiting"
+        self.error = None
+        self.copied = 0
+        self.total = None
+        name = os.path.basename(dest)
+        self._received_path = os.path.join(tmp_dir, name)
+        self._manifest = self._received_path + ".transfer"
+
+    @property
+    def finished(self):
+        """bool: Whether the transfer has either finished or failed."""
+        return self.phase in ("done", "failed")
+
+    @property
+    def received(self):
+        """int: The number of bytes received from the tracker so far."""
+        try:
+            return os.path.getsize(self._received_path)
+        except OSError:
+            # Not received yet, or already removed after copying
+            return 0
+
+    @property
+    def progress(self):
+        """float or None: The proportion of the final copy completed, or None if
+        the EDF is still being received from the tracker.
+
+        """
+        if self.phase in ("waiting", "receiving") or not self.total:
+            return None
+        return min(1.0, self.copied / float(self.total))
+
+    def set_aside(self):
+        """Stops a failed transfer from being retried by later sessions.
+
+        The transfer's manifest is renamed with a '.failed' extension, leaving it
+        and any received EDF data in the temporary folder for manual recovery.
+
+        """
+        if os.path.exists(self._manifest):
+            os.replace(self._manifest, self._manifest + ".failed")
+
+    def _write_manifest(self, received):
+        info = {
+            'dest': self.dest,
+            'tracker_name': self.source.edf_name if self.source else None,
+            'received': received,
+        }
+        tmp = self._manifest + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(info, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._manifest)
+
+    def run(self):
+        """Runs the transfer, recording any error in :attr:`error`."""
+        try:
+            if not os.path.isdir(self.tmp_dir):
+                os.makedirs(self.tmp_dir)
+            manifest = {}
+            if os.path.exists(self._manifest):
+                manifest = _read_manifest(self._manifest)
+            if not manifest.get('received'):
+                if self.source is None:
+                    raise IOError(
+                        "EDF file was never fully received from the tracker."
+                    )
+                self._write_manifest(received=False)
+                self.phase = "receiving"
+                self.source.fetch(self._received_path)
+                self._write_manifest(received=True)
+            self.phase = "copying"
+            self._copy(self._received_path, self.dest)
+            os.remove(self._received_path)
+            os.remove(self._manifest)
+            self.phase = "done"
+        except Exception as e:
+            self.error = e
+            self.phase = "failed"
+
+    def _copy(self, src, dest):
+        # Copies the received EDF next to its destination in chunks (continuing
+        # from a previous partial copy if one exists and matches the source),
+        # then verifies the copy and renames it into place
+        self.total = os.path.getsize(src)
+        if os.path.exists(dest):
+            if _sha256(dest).hexdigest() == _sha256(src).hexdigest():
+                # Already copied & renamed before the transfer was interrupted
+                self.copied = self.total
+                return
+            raise IOError("'{0}' already exists, not overwriting.".format(dest))
+
+        part = dest + ".part"
+        offset = 0
+        src_hash = hashlib.sha256()
+        if os.path.exists(part):
+            offset = os.path.getsize(part)
+            if offset <= self.total:
+                src_hash = _sha256(src, offset)
+                if _sha256(part).hexdigest() != src_hash.hexdigest():
+                    offset, src_hash = (0, hashlib.sha256())
+            else:
+                offset = 0
+        self.copied = offset
+
+        dest_dir = os.path.dirname(dest)
+        if dest_dir and not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+        with open(src, "rb") as fsrc, open(part, "ab" if offset else "wb") as fdst:
+            fsrc.seek(offset)
+            while True:
+                chunk = fsrc.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                fdst.write(chunk)
+                src_hash.update(chunk)
+                self.copied += len(chunk)
+            fdst.flush()
+            os.fsync(fdst.fileno())
+
+        self.phase = "verifying"
+        if _sha256(part).hexdigest() != src_hash.hexdigest():
+            os.remove(part)
+            raise IOError("Checksum mismatch after copying EDF file.")
+        if os.path.exists(dest):
+            raise IOError("'{0}' already exists, not overwriting.".format(dest))
+        os.replace(part, dest)
+
+
+class TransferQueue(object):
+    """Runs a list of EDF transfers one at a time on a background thread.
+
+    Transfers from the tracker all share its single link connection, which isn't
+    thread-safe, so they're never run concurrently.
+
+    Args:
+        transfers (list): The :obj:`EDFTransfer` objects to run, in order.
+
+    """
+    def __init__(self, transfers):
+        self.transfers = transfers
+        self._thread = threading.Thread(target=self._run, name="EDFTransfer")
+        self._thread.daemon = True
+
+    def start(self):
+        """Starts running the transfers in the background."""
+        self._thread.start()
+
+    def is_alive(self):
+        """bool: Whether any transfers are still in progress."""
+        return self._thread.is_alive()
+
+    def join(self, timeout=None):
+        """Waits for all transfers to finish."""
+        self._thread.join(timeout)
+
+    @property
+    def current(self):
+        """:obj:`EDFTransfer`: The transfer currently running, if any."""
+        for transfer in self.transfers:
+            if not transfer.finished:
+                return transfer
+        return None
+
+    def _run(self):
+        for transfer in self.transfers:
+            transfer.run()
+
+
+def skip_shutdown_receive(el, edf_names):
+    """Stops KLibs from receiving EDFs that are already being transferred.
+
+    When the experiment exits, KLibs shuts down the tracker and receives the
+    session's EDF itself (blocking, and writing over any copy made by an
+    :obj:`EDFTransfer`). KLibs has no option for skipping this, so the EyeLink's
+    receive method is wrapped so that it skips (and reports) receives of the
+    given files, while any other file is received as normal. The original method
+    stays available as the wrapper's ``original`` attribute.
+
+    Args:
+        el: The experiment's EyeLink object.
+        edf_names (list): The names (on the tracker) of the EDFs to skip.
+
+    """
+    receive = getattr(el.receiveDataFile, 'original', el.receiveDataFile)
+    skipped = set(edf_names)
+
+    def receive_unless_transferred(src, dest, *args):
+        if src in skipped:
+            print("Skipping receive of '{0}' (already transferred).".format(src))
+            return
+        return receive(src, dest, *args)
+
+    receive_unless_transferred.original = receive
+    el.receiveDataFile = receive_unless_transferred
+
+
+def _read_manifest(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def pending_transfers(tmp_dir, make_source=None):
+    """Finds EDF transfers left unfinished by previous sessions.
+
+    Transfers interrupted after the EDF was received are resumed from the
+    received file. Transfers interrupted while receiving are restarted from the
+    beginning, provided a source for the EDF can be recreated.
+
+    Args:
+        tmp_dir (str): The temporary folder used for EDF transfers.
+        make_source (callable, optional): A function that takes the name of an
+            EDF on the tracker and returns a new source for it.
+
+    Returns:
+        list: An :obj:`EDFTransfer` for each EDF that was never fully copied to
+        its destination.
+
+    """
+    transfers = []
+    if not os.path.isdir(tmp_dir):
+        return transfers
+    for f in sorted(os.listdir(tmp_dir)):
+        if not f.endswith(".transfer"):
+            continue
+        info = _read_manifest(os.path.join(tmp_dir, f))
+        source = None
+        if not info['received'] and info['tracker_name'] and make_source:
+            source = make_source(info['tracker_name'])
+        transfers.append(EDFTransfer(source, info['dest'], tmp_dir))
+    return transfers
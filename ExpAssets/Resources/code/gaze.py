@@ -0,0 +1,126 @@
+import numpy as np
+
+try:
+    from pylink import SAMPLE_TYPE, MISSING_DATA
+except ImportError:
+    SAMPLE_TYPE, MISSING_DATA = (200, -32768)
+
+# Fixation breaks and blinks are detected from every gaze sample received since
+# the last check (rather than only the latest sample, or tracker events one at a
+# time), so that short excursions between polls aren't missed.
+
+
+def _runs(flags, times, since):
+    # Gets the longest duration of consecutive flagged samples, and the start time
+    # of the run of flagged samples still ongoing at the end (if any), continuing
+    # a run that was ongoing at the end of the previous batch
+    if not flags.any():
+        return (None, None)
+    padded = np.concatenate(([0], flags.astype(np.int8), [0]))
+    edges = np.diff(padded)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    start_times = times[starts].astype(np.float64)
+    if since is not None and starts[0] == 0:
+        start_times[0] = since
+    longest = float(np.max(times[ends] - start_times))
+    ongoing = start_times[-1] if ends[-1] == len(flags) - 1 else None
+    return (longest, ongoing)
+
+
+class FixationDetector(object):
+    """Detects fixation breaks and blinks from batches of gaze samples.
+
+    Gaze is considered to have left fixation once it stays outside a circular
+    boundary around the fixation point for at least the dwell time, and a blink
+    is detected once gaze samples are missing for at least the sample loss time.
+    Runs of samples outside the boundary or missing carry over between batches.
+
+    Args:
+        center (tuple): The (x, y) pixel coordinates of the fixation point.
+        radius (float): The radius (in pixels) of the fixation boundary.
+        dwell (float, optional): The min time (in ms) gaze needs to stay outside
+            the boundary to count as leaving fixation. Defaults to 0 (i.e. any
+            sample outside the boundary).
+        blink_loss (float, optional): The min time (in ms) of continuously
+            missing samples to count as a blink. Defaults to 0 (i.e. any missing
+            sample).
+
+    """
+    def __init__(self, center, radius, dwell=0, blink_loss=0):
+        self.center = np.asarray(center, dtype=np.float64)
+        self.radius = float(radius)
+        self.dwell = dwell
+        self.blink_loss = blink_loss
+        self.reset()
+
+    def reset(self):
+        """Clears any runs of outside/missing samples from previous batches."""
+        self._outside_since = None
+        self._missing_since = None
+
+    def check(self, times, xy):
+        """Checks a batch of gaze samples for fixation breaks and blinks.
+
+        Args:
+            times (:obj:`numpy.ndarray`): The timestamps (in ms) of the samples.
+            xy (:obj:`numpy.ndarray`): An (n, 2) array of the gaze coordinates of
+                the samples, with NaN for missing samples.
+
+        Returns:
+            str: 'looked_away' if gaze left fixation, 'blinked' if a blink was
+            detected, or None if neither.
+
+        """
+        if not len(times):
+            return None
+        missing = np.isnan(xy[:, 0])
+        offsets = xy - self.center
+        dist2 = np.einsum('ij,ij->i', offsets, offsets)
+        with np.errstate(invalid='ignore'):
+            outside = dist2 > self.radius ** 2
+        longest, self._outside_since = _runs(outside, times, self._outside_since)
+        if longest is not None and longest >= self.dwell:
+            return "looked_away"
+        longest, self._missing_since = _runs(missing, times, self._missing_since)
+        if longest is not None and longest >= self.blink_loss:
+            return "blinked"
+        return None
+
+
+def _sample_gaze(sample):
+    # Gets the gaze coordinates from a pylink sample, preferring the right eye
+    if sample.isRightSample():
+        x, y = sample.getRightEye().getGaze()
+    else:
+        x, y = sample.getLeftEye().getGaze()
+    if x == MISSING_DATA or y == MISSING_DATA:
+        return (np.nan, np.nan)
+    return (x, y)
+
+
+def drain_link(el):
+    """Reads all queued samples and events from an EyeLink's link data queue.
+
+    Args:
+        el: The connected :obj:`pylink.EyeLink` object.
+
+    Returns:
+        tuple: A list of the queued events, followed by an array of the sample
+        timestamps (in ms) and an (n, 2) array of their gaze coordinates (NaN
+        for missing samples).
+
+    """
+    events, times, gaze = ([], [], [])
+    while True:
+        data_type = el.getNextData()
+        if not data_type:
+            break
+        data = el.getFloatData()
+        if data_type == SAMPLE_TYPE:
+            times.append(data.getTime())
+            gaze.append(_sample_gaze(data))
+        elif data is not None:
+            events.append(data)
+    xy = np.array(gaze, dtype=np.float64).reshape(-1, 2)
+    return (events, np.array(times, dtype=np.float64), xy)
@@ -0,0 +1,117 @@
+import types
+from collections import deque
+from klibs.KLTime import precise_time
+
+
+class IdleJob(object):
+    """A deferred job queued on an :obj:`IdleScheduler`.
+
+    Args:
+        func (callable): The function to run. If it returns a generator, each
+            step of the generator is run as a separate slice of work.
+        cost (float): The expected time (in ms) needed to run the job (or one
+            step of it). Updated from measured run times as the job runs.
+        repeat (bool): Whether to re-queue the job each time it finishes.
+
+    """
+    def __init__(self, func, cost, repeat):
+        self.func = func
+        self.cost = cost
+        self.repeat = repeat
+        self._steps = None
+
+    def step(self):
+        """Runs the job (or its next step), returning True if it's finished."""
+        if self._steps is None:
+            result = self.func()
+            if not isinstance(result, types.GeneratorType):
+                return True
+            self._steps = result
+        try:
+            next(self._steps)
+            return False
+        except StopIteration:
+            self._steps = None
+            return True
+
+
+class IdleScheduler(object):
+    """Runs deferred jobs only during non-critical periods of the task.
+
+    Jobs are queued with :meth:`defer` and run in order by :meth:`run`, which is
+    called from idle periods (e.g. while feedback is on screen) with the amount
+    of time available. A job is only started if its expected run time fits in
+    the time remaining, so idle periods are never stretched by deferred work.
+
+    Args:
+        margin (float, optional): Extra time (in ms) to leave unused at the end
+            of each idle period.
+
+    """
+    def __init__(self, margin=2.0):
+        self.margin = margin
+        self._jobs = deque()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def defer(self, func, cost=1.0, repeat=False):
+        """Queues a job to run during the next available idle period.
+
+        Args:
+            func (callable): The function to run. Long jobs can be written as
+                generator functions, with each step taking at most `cost` ms.
+            cost (float, optional): The expected time (in ms) needed to run the
+                job (or one step of it).
+            repeat (bool, optional): Whether to keep the job in the queue after it
+                finishes, so that it runs during every idle period.
+
+        """
+        self._jobs.append(IdleJob(func, cost, repeat))
+
+    def run(self, available):
+        """Runs queued jobs for up to a given amount of time.
+
+        Jobs are run round-robin, one step at a time, until none of them fit in
+        the time remaining (repeating jobs run at most once per call). Jobs whose
+        expected run time doesn't fit are skipped and moved to the back of the
+        queue, rather than holding up the jobs behind them. Each step is timed,
+        and a job's expected run time is kept as a pessimistic running estimate
+        of its measured step times.
+
+        Args:
+            available (float): The time (in ms) available for running jobs.
+
+        Returns:
+            int: The number of job steps run.
+
+        """
+        deadline = precise_time() + (available - self.margin) / 1000.0
+        ran = 0
+        skipped = 0
+        finished = set()  # repeating jobs that have already run this period
+        while self._jobs and skipped < len(self._jobs):
+            job = self._jobs.popleft()
+            remaining = (deadline - precise_time()) * 1000.0
+            if job in finished or job.cost > remaining:
+                self._jobs.append(job)
+                skipped += 1
+                continue
+            start = precise_time()
+            done = job.step()
+            elapsed = (precise_time() - start) * 1000.0
+            job.cost = max(elapsed, 0.5 * job.cost + 0.5 * elapsed)
+            ran += 1
+            skipped = 0
+            if done and job.repeat:
+                finished.add(job)
+            if not done or job.repeat:
+                self._jobs.append(job)
+        return ran
+
+    def run_all(self):
+        """Runs all queued jobs to completion, regardless of time (e.g. at exit)."""
+        while self._jobs:
+            job = self._jobs.popleft()
+            while not job.step():
+                pass
@@ -1,5 +1,6 @@
 import os
 import random
+import numpy as np
 from klibs.KLStructure import FactorSet
 
 
@@ -14,46 +15,147 @@ class Block(object):
             factors = FactorSet(factors)
         self._factors = factors
         self.trialcount = trials if trials else self._factors.set_length
-    
-    def get_trials(self, full_shuffle=False):
+        self._col_widths = None
+        self._levels = None
+        self._combinations = None
+
+    def get_trials(self, full_shuffle=False, rng=None):
         """Generates a shuffled set of trials from the block.
 
+        Trials are generated as a :obj:`TrialArray`, which only creates the
+        dict of factor levels for a given trial when it is accessed.
+
+        Args:
+            full_shuffle (bool, optional): Whether to shuffle the full set of
+                trials after generating them.
+            rng (:obj:`random.Random`, optional): The random number generator to
+                use for shuffling. Defaults to the global one.
+
+        Returns:
+            :obj:`TrialArray`: The factor levels for each trial in the block.
+
+        """
+        indices = self.get_trial_indices(full_shuffle, rng)
+        return TrialArray(self.factors, self.levels, indices)
+
+    def get_trial_indices(self, full_shuffle=False, rng=None, count=None):
+        """Generates a shuffled set of trials from the block as level indices.
+
+        Trials are filled from shuffled copies of the full set of factor level
+        combinations, so that the ratios of factor levels in the block are
+        preserved exactly (for each full set of combinations).
+
+        Args:
+            full_shuffle (bool, optional): Whether to shuffle the full set of
+                trials after generating them.
+            rng (:obj:`random.Random`, optional): The random number generator to
+                seed the shuffling from. Defaults to the global one.
+            count (int, optional): The number of trials to generate. Defaults to
+                the block's trial count.
+
+        Returns:
+            :obj:`numpy.ndarray`: An array of shape (trials, factors), where each
+            value is the index of the trial's level in :attr:`levels`.
+
         """
-        trials = []
-        while len(trials) < self.trialcount:
-            new = self._factors._get_combinations()
-            remaining = self.trialcount - len(trials)
-            random.shuffle(new)
-            if remaining < len(new):
-                new = new[:remaining]
-            trials += new
+        if rng is None:
+            rng = random
+        count = self.trialcount if count is None else count
+        np_rng = np.random.default_rng(rng.getrandbits(64))
 
+        combinations = self.combinations
+        n = len(combinations)
+        sets = -(-count // n)  # i.e. ceil(count / n)
+        order = np.argsort(np_rng.random((sets, n)), axis=1).ravel()[:count]
         if full_shuffle:
-            random.shuffle(trials)
+            np_rng.shuffle(order)
+        return combinations[order]
+
+    @property
+    def levels(self):
+        """list: The levels (including duplicates) of each trial factor."""
+        if self._levels is None:
+            self._levels = [list(self._factors._factors[f]) for f in self.factors]
+        return self._levels
+
+    @property
+    def combinations(self):
+        """:obj:`numpy.ndarray`: Every combination of factor levels in the block,
+        as an array of level indices.
+
+        """
+        if self._combinations is None:
+            sizes = [len(levels) for levels in self.levels]
+            grid = np.indices(sizes, dtype=np.int32)
+            self._combinations = grid.reshape(len(sizes), -1).T
+        return self._combinations
 
-        return trials
-        
     @property
     def factors(self):
         """list: The names of all trial factors used in the block."""
         return self._factors.names
 
+    @property
+    def col_widths(self):
+        """dict: The max character length of each factor's name and levels."""
+        # Since the same Block is usually reused for many blocks of a session,
+        # only scan the factor levels the first time they're needed
+        if self._col_widths is None:
+            self._col_widths = {}
+            for f in self.factors:
+                levels = [str(level) for level in self._factors._factors[f]]
+                self._col_widths[f] = max([len(f)] + [len(l) for l in levels])
+        return self._col_widths
+
+
+class TrialArray(object):
+    """A sequence of trials stored as an array of factor level indices.
+
+    Trials are returned as dicts of factor levels like regular lists of trials,
+    but each dict is only created when that trial is accessed. Note that the
+    experiment itself compiles every trial of a session up front (see
+    :func:`schedule.compile_block`), so this mainly saves work when generating
+    trials in bulk (e.g. for simulations).
+
+    Args:
+        factors (list): The names of the trial factors.
+        levels (list): The list of levels for each trial factor.
+        indices (:obj:`numpy.ndarray`): An array of shape (trials, factors) of
+            level indices for each trial.
+
+    """
+    def __init__(self, factors, levels, indices):
+        self.factors = factors
+        self.levels = levels
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return TrialArray(self.factors, self.levels, self.indices[i])
+        row = self.indices[i]
+        return {
+            f: self.levels[j][row[j]] for j, f in enumerate(self.factors)
+        }
+
+    def __iter__(self):
+        for i in range(len(self.indices)):
+            yield self[i]
+
+    def tolist(self):
+        """list: The full set of trials as a list of dicts."""
+        return list(self)
+
 
 def block_to_str(block, trials, num):
     # Generates a string describing the structure and factor levels for each
     # trial in a given block
     out = []
-    col_pad = {}
     block_header = "\n=== Block {0} ({1} trials{2}) ===\n"
     factors = block.factors
-
-    # Get max character length for each factor level for sake of alignment
-    for f in factors:
-        if not f in col_pad.keys():
-            col_pad[f] = len(f)
-        for level in block._factors._factors[f]:
-            if len(str(level)) > col_pad[f]:
-                col_pad[f] = len(str(level))
+    col_pad = block.col_widths
 
     # Generate a header for the block
     practice = ", practice" if block.practice else ""
@@ -67,3 +169,56 @@ def block_to_str(block, trials, num):
 
     out.append("")
     return "\n".join(out)
+
+
+class TrialDumpWriter(object):
+    """Writes the trial structure of a session to a file, one block at a time.
+
+    Two formats are supported: 'text', a human-readable table of factor levels
+    for each block (see :func:`block_to_str`), and 'tsv', a tab-separated file
+    with one row per trial for loading into analysis tools. The header of a
+    'tsv' dump gives the name and type of each column (e.g. 'cue_onset:int').
+
+    Args:
+        path (str): The path of the file to write.
+        fmt (str, optional): The format of the dump, either 'text' or 'tsv'.
+
+    """
+    def __init__(self, path, fmt="text"):
+        if not fmt in ("text", "tsv"):
+            raise ValueError("Unsupported trial dump format '{0}'.".format(fmt))
+        self.fmt = fmt
+        self._file = open(path, "w")
+        self._columns = None
+        self._blocks = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write_block(self, block, trials):
+        """Writes the trials for the next block of the session to the file."""
+        self._blocks += 1
+        if self.fmt == "text":
+            self._file.write(block_to_str(block, trials, self._blocks) + "\n")
+            return
+        if self._columns is None:
+            self._write_header(trials[0])
+        for trial in trials:
+            row = [self._blocks, block.label, block.practice]
+            row += [trial[col] for col in self._columns]
+            self._file.write("\t".join([str(val) for val in row]) + "\n")
+
+    def close(self):
+        """Closes the dump file."""
+        self._file.close()
+
+    def _write_header(self, trial):
+        # Uses the first trial of the session to determine column names/types
+        self._columns = list(trial.keys())
+        header = ["block_num:int", "label:str", "practice:bool"]
+        for col in self._columns:
+            header.append("{0}:{1}".format(col, type(trial[col]).__name__))
+        self._file.write("\t".join(header) + "\n")
@@ -0,0 +1,192 @@
+import json
+import time
+import socket
+from collections import deque
+
+
+class _Tally(object):
+    # Running totals of trial outcomes for a block or instruction type
+
+    def __init__(self):
+        self.trials = 0
+        self.recycled = 0
+        self.rt_sum = 0.0
+        self.rt_n = 0
+        self.correct = 0
+        self.responses = 0
+        self.errs = {}
+        self.recycles = {}
+
+    def add_trial(self, rt, accuracy, err):
+        self.trials += 1
+        if accuracy != "NA":
+            self.responses += 1
+            self.correct += int(accuracy)
+            if int(accuracy) == 1 and rt != "NA":
+                self.rt_sum += float(rt)
+                self.rt_n += 1
+        if err != "NA":
+            self.errs[err] = self.errs.get(err, 0) + 1
+
+    def add_recycle(self, reason):
+        self.recycled += 1
+        self.recycles[reason] = self.recycles.get(reason, 0) + 1
+
+    def summary(self):
+        attempts = self.trials + self.recycled
+        return {
+            'trials': self.trials,
+            'recycled': self.recycled,
+            'recycle_rate': _ratio(self.recycled, attempts),
+            'mean_rt': _ratio(self.rt_sum, self.rt_n),
+            'accuracy': _ratio(self.correct, self.responses),
+            'errs': dict(self.errs),
+            'recycles': dict(self.recycles),
+        }
+
+
+def _ratio(a, b):
+    return round(a / float(b), 3) if b else None
+
+
+class SessionMonitor(object):
+    """Collects rolling trial metrics and publishes them for a live viewer.
+
+    Trial outcomes and recycled trials are added with :meth:`add_trial` and
+    :meth:`add_recycle`, which only update running totals. Snapshots of the
+    metrics are then written by :meth:`publish` (meant to be run from idle
+    periods) as single lines of JSON, to an append-only file and/or a local UDP
+    socket. Neither ever blocks: file writes go to the OS buffer without
+    syncing, and UDP packets are dropped if they can't be sent.
+
+    Args:
+        participant_id (int): The database ID of the current participant.
+        path (str, optional): The file to append snapshots to.
+        address (tuple, optional): The (host, port) to send snapshots to.
+        window (int, optional): The number of recent trials to compute rolling
+            metrics over. Defaults to 20.
+
+    """
+    def __init__(self, participant_id, path=None, address=None, window=20):
+        self.participant_id = participant_id
+        self.address = address
+        self._file = open(path, "a") if path else None
+        self._sock = None
+        if address:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.setblocking(False)
+        self._recent = deque(maxlen=window)
+        self._blocks = {}
+        self._instructions = {}
+        self._last = None
+        self._schedule = None
+        self._pending = False
+
+    def _tallies(self, block_num, instructions, practice):
+        key = (block_num, instructions, bool(practice))
+        if not key in self._blocks:
+            self._blocks[key] = _Tally()
+        inst_key = "practice" if practice else instructions
+        if not inst_key in self._instructions:
+            self._instructions[inst_key] = _Tally()
+        return (self._blocks[key], self._instructions[inst_key])
+
+    def add_trial(self, data):
+        """Adds the outcome of a completed trial.
+
+        Args:
+            data (dict): The trial data returned by the experiment's trial().
+
+        """
+        rt, accuracy, err = (data['rt'], data['accuracy'], data['err'])
+        for tally in self._tallies(
+            data['block_num'], data['instructions'], data['practice']
+        ):
+            tally.add_trial(rt, accuracy, err)
+        self._recent.append((rt, accuracy, err, None))
+        self._last = ("trial", data['block_num'], data['trial_num'])
+        self._pending = True
+
+    def add_recycle(self, reason, block_num, trial_num, instructions, practice):
+        """Adds a recycled trial and the reason it was recycled."""
+        for tally in self._tallies(block_num, instructions, practice):
+            tally.add_recycle(reason)
+        self._recent.append(("NA", "NA", "NA", reason))
+        self._last = ("recycle", block_num, trial_num)
+        self._pending = True
+
+    def set_schedule(self, prediction):
+        """Sets the latest prediction of the session's remaining length.
+
+        Args:
+            prediction (dict): A prediction from :meth:`SessionScheduler.predict`.
+
+        """
+        self._schedule = prediction
+        self._pending = True
+
+    def snapshot(self):
+        """dict: The current rolling and cumulative session metrics."""
+        rts = sorted(
+            [float(rt) for rt, acc, _, _ in self._recent if rt != "NA" and acc == 1]
+        )
+        acc = [int(a) for _, a, _, _ in self._recent if a != "NA"]
+        recycles = [r for _, _, _, r in self._recent if r]
+        event, block_num, trial_num = self._last if self._last else (None, 0, 0)
+        blocks = []
+        for (num, instructions, practice), tally in sorted(self._blocks.items()):
+            info = {'block': num, 'instructions': instructions, 'practice': practice}
+            info.update(tally.summary())
+            blocks.append(info)
+        return {
+            'time': time.time(),
+            'participant_id': self.participant_id,
+            'event': event,
+            'block_num': block_num,
+            'trial_num': trial_num,
+            'rolling': {
+                'n': len(self._recent),
+                'mean_rt': _ratio(sum(rts), len(rts)),
+                'median_rt': rts[len(rts) // 2] if rts else None,
+                'accuracy': _ratio(sum(acc), len(acc)),
+                'recycle_rate': _ratio(len(recycles), len(self._recent)),
+                'timeouts': sum(1 for _, _, e, _ in self._recent if e == "timeout"),
+            },
+            'blocks': blocks,
+            'instructions': {
+                k: tally.summary() for k, tally in self._instructions.items()
+            },
+            'schedule': self._schedule,
+        }
+
+    def publish(self, event=None):
+        """Writes a snapshot of the current metrics, if anything has changed.
+
+        Args:
+            event (str, optional): An event label to publish the snapshot under
+                (e.g. 'session_end'), even if nothing has changed.
+
+        """
+        if not (self._pending or event):
+            return
+        snapshot = self.snapshot()
+        if event:
+            snapshot['event'] = event
+        line = json.dumps(snapshot, separators=(",", ":"))
+        if self._file:
+            self._file.write(line + "\n")
+            self._file.flush()
+        if self._sock:
+            try:
+                self._sock.sendto(line.encode('utf-8'), self.address)
+            except OSError:
+                pass
+        self._pending = False
+
+    def close(self):
+        """Publishes a final snapshot and closes the file and socket."""
+        self.publish(event="session_end")
+        if self._file:
+            self._file.close()
+        if self._sock:
+            self._sock.close()
@@ -0,0 +1,100 @@
+import sys
+import time
+from klibs.KLTime import precise_time
+
+# The worst-case oversleep of time.sleep(), which only wakes on the OS scheduler's
+# timer tick (~15.6 ms by default on Windows)
+SLEEP_GRANULARITY = 16.0 if sys.platform == "win32" else 2.0
+
+
+class PollScheduler(object):
+    """Paces a polling loop to a fixed rate.
+
+    Polls are scheduled at absolute due times (so the rate doesn't drift with
+    the time spent doing the work of each poll), and the scheduler sleeps until
+    the next one is due so that loops waiting on an upcoming event don't pin a
+    CPU core. Since a sleep can overshoot by up to the OS timer granularity, it
+    only sleeps if the next poll is due at least that long before the deadline,
+    and otherwise returns immediately so the loop can busy-wait up to the event
+    with full timing precision.
+
+    Args:
+        rate (float, optional): The target number of polls per second. If None,
+            the loop will spin as fast as possible.
+        spin (float, optional): How long (in ms) before a deadline to stop
+            sleeping and busy-wait instead. Should be at least the OS sleep
+            granularity, which is used by default.
+
+    """
+    def __init__(self, rate=1000, spin=None):
+        self.interval = 1.0 / rate if rate else 0
+        self.spin = (SLEEP_GRANULARITY if spin is None else spin) / 1000.0
+        self.reset()
+
+    def reset(self):
+        """Clears the poll statistics for the current trial."""
+        self.polls = 0
+        self.max_gap = 0.0
+        self._paced_gaps = 0
+        self._paced_time = 0.0
+        self.start()
+
+    def start(self):
+        """Marks the start of a new polling loop.
+
+        The time between the last poll of the previous loop and the first poll
+        of this one (e.g. a stimulus flip) isn't counted towards the gaps between
+        polls.
+
+        """
+        self._last = None
+        self._due = None
+        self._slept = False
+
+    def wait(self, remaining):
+        """Records a poll and sleeps until the next poll is due.
+
+        Args:
+            remaining (float): The time (in ms) until the deadline the loop is
+                waiting for.
+
+        """
+        now = precise_time()
+        if self._last is not None:
+            gap = now - self._last
+            self.max_gap = max(self.max_gap, gap)
+            # Only gaps after paced (sleeping) polls count towards the poll rate,
+            # since busy-waiting right before a deadline would inflate it
+            if self._slept:
+                self._paced_time += gap
+                self._paced_gaps += 1
+        self._last = now
+        self.polls += 1
+
+        # Schedule the next poll, skipping any that were missed rather than
+        # trying to catch up on them
+        if self._due is None or self._due + self.interval < now:
+            self._due = now + self.interval
+        else:
+            self._due += self.interval
+
+        # Sleep until the next poll, unless an oversleep could cut into the deadline
+        deadline = now + remaining / 1000.0
+        self._slept = self._due + self.spin < deadline
+        if self._slept:
+            time.sleep(self._due - now)
+
+    @property
+    def rate(self):
+        """float: The achieved number of polls per second while pacing (i.e.
+        excluding polls made while busy-waiting for a deadline).
+
+        """
+        if not self._paced_gaps or self._paced_time <= 0:
+            return 0.0
+        return self._paced_gaps / self._paced_time
+
+    @property
+    def max_gap_ms(self):
+        """float: The longest time (in ms) between any two polls in a loop."""
+        return self.max_gap * 1000.0
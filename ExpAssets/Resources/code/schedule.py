@@ -0,0 +1,115 @@
+import random
+
+# Compiles the full trial schedule for a session ahead of time, so that all
+# randomization (trial order, cue onsets, cue locations, practice targets) is
+# done in one pass before the task starts and can be reproduced offline from
+# the session's random seed.
+
+LOCATIONS = ['TL', 'TR', 'BL', 'BR']
+TARGETS = ['T', 'F']
+CUE_ONSETS = range(1000, 2000, 100)
+
+
+def block_seed(session_seed, block_num):
+    """Derives a reproducible random seed for a block of a given session.
+
+    Args:
+        session_seed (int): The random seed for the session as a whole.
+        block_num (int): The number of the block within the session.
+
+    Returns:
+        int: The random seed for the block.
+
+    """
+    return random.Random("{0}-{1}".format(session_seed, block_num)).getrandbits(32)
+
+
+def compile_trial(trial, rng):
+    """Resolves the randomized, non-factor attributes of a single trial.
+
+    Args:
+        trial (dict): The factor levels for the trial.
+        rng (:obj:`random.Random`): The random number generator to use.
+
+    Returns:
+        dict: A copy of the trial with 'cue_onset', 'cue_loc', and a resolved
+        'target' added.
+
+    """
+    trial = dict(trial)
+    trial['cue_onset'] = rng.choice(CUE_ONSETS)
+    if trial['cue_validity']:
+        # If validly-cued target, cue location is target location
+        trial['cue_loc'] = trial['target_loc']
+    else:
+        # If invalid, choose a random non-target location to cue
+        locs = [loc for loc in LOCATIONS if loc != trial['target_loc']]
+        trial['cue_loc'] = rng.choice(locs)
+    if trial['target'] == 'random':
+        # If practice block, randomly choose the target letter
+        trial['target'] = rng.choice(TARGETS)
+    return trial
+
+
+def compile_block(block, seed, max_trials=None):
+    """Generates the full, shuffled schedule of trials for a block.
+
+    Args:
+        block (:obj:`klibs_wip.Block`): The block to generate trials for.
+        seed (int): The random seed for the block.
+        max_trials (int, optional): The maximum number of trials to keep.
+
+    Returns:
+        list: A dict of attributes for each trial in the block, including the
+        block's seed and the trial's index within the block.
+
+    """
+    rng = random.Random(seed)
+    # The block's trials are generated as a lazy TrialArray, but are built into
+    # dicts here: the compiled session is checkpointed to JSON and dumped in full
+    # at the start of the session, and recycled trials are reinserted into each
+    # block's list of trials, so every trial is needed up front anyway
+    trials = block.get_trials(rng=rng)
+    if max_trials is not None:
+        trials = trials[:max_trials]
+    out = []
+    for i, trial in enumerate(trials):
+        trial = compile_trial(trial, rng)
+        trial['block_seed'] = seed
+        trial['trial_idx'] = i
+        out.append(trial)
+    return out
+
+
+def iter_session(structure, session_seed, practice=True, max_trials=None):
+    """Generates the trial schedule for a session one block at a time.
+
+    Args:
+        structure (list): The sequence of blocks for the session.
+        session_seed (int): The random seed for the session.
+        practice (bool, optional): Whether to include practice blocks.
+        max_trials (int, optional): The maximum number of trials per block.
+
+    Yields:
+        tuple: The block and its list of trials, for each block in the session.
+
+    """
+    block_num = 0
+    for block in structure:
+        if block.practice and not practice:
+            continue
+        block_num += 1
+        seed = block_seed(session_seed, block_num)
+        yield (block, compile_block(block, seed, max_trials))
+
+
+def compile_session(structure, session_seed, practice=True, max_trials=None):
+    """Generates the full trial schedule for a session.
+
+    Takes the same arguments as :func:`iter_session`.
+
+    Returns:
+        list: A (block, trials) tuple for each block in the session.
+
+    """
+    return list(iter_session(structure, session_seed, practice, max_trials))
@@ -0,0 +1,290 @@
+import random
+
+import numpy as np
+from klibs.KLTime import precise_time
+from klibs.KLTrialFactory import TrialIterator
+
+# Recycled trials are placed back into their block so that the block stays
+# balanced as it runs, and the time each trial attempt takes is tracked so the
+# remaining length of the session can be predicted while it's still running.
+
+BALANCE_FACTORS = ('cue_validity', 'target_loc')
+
+
+def _insert_costs(levels, level, done, n_done, p):
+    # Gets the largest imbalance for one factor level over the remaining trials
+    # of a block, for every possible insertion point of a recycled trial of that
+    # level. The imbalance of a run of trials is how far the count of trials
+    # with the level differs from the count expected from the whole block.
+    is_level = np.array([l == level for l in levels], dtype=np.float64)
+    counts = np.concatenate(([0.0], np.cumsum(is_level)))
+    t = np.arange(len(counts), dtype=np.float64)
+    # Imbalance after t remaining trials, before and after the inserted trial
+    before = np.abs(done + counts - (n_done + t) * p)
+    after = np.abs(done + counts + 1 - (n_done + t + 1) * p)
+    before[0] = 0
+    worst_before = np.maximum.accumulate(before)
+    worst_after = np.maximum.accumulate(after[::-1])[::-1]
+    return np.maximum(worst_before, worst_after)
+
+
+class BalancedTrialIterator(TrialIterator):
+    """A TrialIterator that keeps blocks balanced when trials are recycled.
+
+    By default, KLibs appends recycled trials to the end of the block and
+    reshuffles the rest of it, so a block that runs long (or is cut short) can
+    drift away from its intended mix of trial types. Instead, each recycled trial
+    is inserted at the point in the remaining trials where the running counts
+    of its factor levels stay closest to the proportions of the full block
+    (ties are broken randomly), though never right after the failed attempt
+    unless no other trials are left. The order of the remaining trials is otherwise
+    left as scheduled.
+
+    Args:
+        trials (list): The trials of the block, in order.
+        balance (tuple, optional): The trial factors to keep balanced. Defaults to
+            'cue_validity' and 'target_loc'.
+        seed (int, optional): The random seed for breaking ties when placing
+            recycled trials.
+
+    """
+    def __init__(self, trials, balance=BALANCE_FACTORS, seed=None):
+        super(BalancedTrialIterator, self).__init__(trials)
+        self.balance = [f for f in balance if all(f in t for t in trials)]
+        self.recycled = 0
+        self._rng = random.Random(seed)
+        self._props = {}
+        for factor in self.balance:
+            levels = [t[factor] for t in trials]
+            self._props[factor] = {
+                level: levels.count(level) / float(len(levels)) for level in levels
+            }
+        self._completed = []
+        self._current = None
+
+    def __next__(self):
+        if self._current is not None:
+            self._completed.append(self._current)
+            self._current = None
+        trial = super(BalancedTrialIterator, self).__next__()
+        self._current = trial
+        return trial
+
+    def recycle(self):
+        """Re-inserts the current trial into the remaining trials of the block."""
+        trial = self.trials[self.i - 1]
+        self._current = None
+        self.recycled += 1
+        remaining = self.trials[self.i:]
+        costs = np.zeros(len(remaining) + 1)
+        for factor in self.balance:
+            level = trial[factor]
+            done = sum(1 for t in self._completed if t[factor] == level)
+            costs += _insert_costs(
+                [t[factor] for t in remaining], level, done, len(self._completed),
+                self._props[factor][level]
+            )
+        # Never place the trial first (i.e. repeat it right away), unless it's
+        # the only trial left
+        first = 1 if len(remaining) else 0
+        costs = costs[first:]
+        best = np.flatnonzero(costs <= costs.min() + 1e-9) + first
+        pos = self.i + int(self._rng.choice(best))
+        self.trials.insert(pos, trial)
+        self.length += 1
+
+    @property
+    def remaining(self):
+        """int: The number of trials in the block still to be completed."""
+        return len(self.trials) - self.recycled - len(self._completed)
+
+
+class _BlockStats(object):
+    # Attempt counts and timing for a single block
+
+    def __init__(self, block_num, label, practice, start):
+        self.block_num = block_num
+        self.label = label
+        self.practice = practice
+        self.start = start
+        self.overhead = None
+        self.trials = 0
+        self.recycled = 0
+        self.reasons = {}
+        self.trial_time = 0.0
+        self.recycle_time = 0.0
+
+
+class SessionScheduler(object):
+    """Tracks recycle rates and trial timing to predict the length of a session.
+
+    The time taken by each trial attempt (from trial prep to the end of its
+    feedback) is recorded separately for completed and recycled trials, along
+    with the time spent at the start of each block on instructions and breaks.
+    The remaining time in the session is then predicted from the number of
+    trials left and the participant's recycle rate so far (shrunk towards a
+    prior rate early in the session).
+
+    Args:
+        blocks (list): The :obj:`BalancedTrialIterator` for each block of the
+            session.
+        slot_minutes (float, optional): The length (in minutes) of the booked
+            session slot. If provided, sessions predicted to run over are
+            flagged as overrunning.
+        prior_rate (float, optional): The recycle rate to assume before any
+            trials have been run. Defaults to 0.1.
+        prior_weight (int, optional): The number of attempts' worth of weight to
+            give the prior rate. Defaults to 10.
+        min_trials (int, optional): The number of completed trials needed before
+            a session can be flagged as overrunning. Defaults to 20.
+        start (float, optional): The start time of the session. Defaults to now.
+
+    """
+    def __init__(self, blocks, slot_minutes=None, prior_rate=0.1, prior_weight=10,
+                 min_trials=20, start=None):
+        self.blocks = blocks
+        self.slot = slot_minutes * 60.0 if slot_minutes else None
+        self.prior_rate = prior_rate
+        self.prior_weight = prior_weight
+        self.min_trials = min_trials
+        self.block_stats = []
+        self.overrun_flagged = False
+        self._start = precise_time() if start is None else start
+        self._attempt_start = None
+
+    @property
+    def elapsed(self):
+        """float: The time (in seconds) since the start of the session."""
+        return precise_time() - self._start
+
+    @property
+    def current(self):
+        """:obj:`_BlockStats`: The stats for the current block, if any."""
+        return self.block_stats[-1] if self.block_stats else None
+
+    def start_block(self, block_num, label, practice):
+        """Marks the start of a new block."""
+        stats = _BlockStats(block_num, label, practice, precise_time())
+        self.block_stats.append(stats)
+
+    def start_trial(self):
+        """Marks the start of a trial attempt (i.e. the start of trial prep)."""
+        now = precise_time()
+        block = self.current
+        if block.overhead is None:
+            block.overhead = now - block.start
+        self._attempt_start = now
+
+    def trial_done(self):
+        """Marks the current trial attempt as completed."""
+        block = self.current
+        block.trials += 1
+        block.trial_time += precise_time() - self._attempt_start
+
+    def trial_recycled(self, reason):
+        """Marks the current trial attempt as recycled for a given reason."""
+        block = self.current
+        block.recycled += 1
+        block.reasons[reason] = block.reasons.get(reason, 0) + 1
+        block.recycle_time += precise_time() - self._attempt_start
+
+    def recycle_rate(self):
+        """float: The participant's estimated probability of recycling a trial."""
+        attempts = sum(b.trials + b.recycled for b in self.block_stats)
+        recycled = sum(b.recycled for b in self.block_stats)
+        rate = (recycled + self.prior_rate * self.prior_weight) / float(
+            attempts + self.prior_weight
+        )
+        return min(rate, 0.95)
+
+    def predict(self):
+        """Predicts the remaining time of the session from its progress so far.
+
+        Returns:
+            dict: The elapsed time, number of trials left, estimated recycle
+            rate, mean times (in seconds) of completed and recycled attempts and
+            of block starts, predicted remaining and total time (in seconds, or
+            None if no trials have been completed yet), the session slot length,
+            and whether the session is predicted to overrun it.
+
+        """
+        trials = sum(b.trials for b in self.block_stats)
+        recycled = sum(b.recycled for b in self.block_stats)
+        remaining = sum(b.remaining for b in self.blocks)
+        started = len(self.block_stats)
+        rate = self.recycle_rate()
+        trial_time = _mean(sum(b.trial_time for b in self.block_stats), trials)
+        recycle_time = _mean(sum(b.recycle_time for b in self.block_stats), recycled)
+        overheads = [b.overhead for b in self.block_stats if b.overhead is not None]
+        block_time = _mean(sum(overheads), len(overheads)) or 0.0
+        if recycle_time is None:
+            recycle_time = trial_time
+        elapsed = self.elapsed
+        remaining_time, total = (None, None)
+        if trial_time is not None:
+            per_trial = trial_time + rate / (1.0 - rate) * recycle_time
+            remaining_time = remaining * per_trial
+            remaining_time += max(0, len(self.blocks) - started) * block_time
+            total = elapsed + remaining_time
+        overrun = bool(
+            self.slot and total is not None and trials >= self.min_trials
+            and total > self.slot
+        )
+        return {
+            'elapsed': elapsed,
+            'trials_left': remaining,
+            'recycle_rate': rate,
+            'trial_time': trial_time,
+            'recycle_time': recycle_time,
+            'block_time': block_time,
+            'remaining': remaining_time,
+            'total': total,
+            'slot': self.slot,
+            'overrun': overrun,
+        }
+
+    def check_overrun(self, prediction):
+        """Checks whether a prediction is the first to say the session will
+        overrun its slot.
+
+        Args:
+            prediction (dict): A prediction returned by :meth:`predict`.
+
+        Returns:
+            bool: True if the session is newly predicted to overrun, else False.
+
+        """
+        if prediction['overrun'] and not self.overrun_flagged:
+            self.overrun_flagged = True
+            return True
+        return False
+
+    def block_summary(self):
+        """Summarizes the recycles and timing of the current block.
+
+        Returns:
+            dict: The block's number, label, and practice status, its completed
+            and recycled trial counts, recycle rate and reasons, its duration so
+            far (in seconds), and the predicted total length of the session (in
+            seconds) and whether it's predicted to overrun its slot.
+
+        """
+        block = self.current
+        prediction = self.predict()
+        attempts = block.trials + block.recycled
+        return {
+            'block_num': block.block_num,
+            'instructions': block.label,
+            'practice': block.practice,
+            'trials': block.trials,
+            'recycled': block.recycled,
+            'recycle_rate': _mean(block.recycled, attempts),
+            'recycle_reasons': dict(block.reasons),
+            'duration': precise_time() - block.start,
+            'predicted_total': prediction['total'],
+            'overrun': prediction['overrun'],
+        }
+
+
+def _mean(total, n):
+    return total / float(n) if n else None
@@ -0,0 +1,130 @@
+import threading
+
+from klibs.KLTime import precise_time
+
+# Setup is timed phase by phase (including work run on background threads) so
+# that slow launches can be tracked down, along with the time it takes for the
+# participant to see the first screen of the experiment.
+
+
+class BackgroundTask(object):
+    """Runs a function on a background thread, keeping its result or error.
+
+    Args:
+        name (str): The name of the task (used as its phase name when profiled).
+        func (callable): The function to run.
+        *args: The arguments to pass to the function.
+        profiler (:obj:`StartupProfiler`, optional): A profiler to record the
+            task's run time with.
+
+    """
+    def __init__(self, name, func, *args, profiler=None):
+        self.name = name
+        self._func = func
+        self._args = args
+        self._profiler = profiler
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        start = precise_time()
+        try:
+            self._result = self._func(*self._args)
+        except Exception as e:
+            self._error = e
+        if self._profiler:
+            self._profiler.add(self.name, start, precise_time(), thread=self.name)
+
+    def result(self):
+        """Waits for the task to finish, returning its result.
+
+        Raises:
+            Exception: Any error raised by the task's function.
+
+        """
+        self._thread.join()
+        if self._error:
+            raise self._error
+        return self._result
+
+
+class StartupProfiler(object):
+    """Times the phases of the experiment's setup.
+
+    Phases on the main thread are timed back to back: starting a new phase with
+    :meth:`phase` ends the previous one. Work run on other threads is added with
+    :meth:`add` (see :obj:`BackgroundTask`).
+
+    Args:
+        start (float, optional): The start time of setup. Defaults to now.
+
+    """
+    def __init__(self, start=None):
+        self.start = precise_time() if start is None else start
+        self.phases = []
+        self.first_screen = None
+        self._lock = threading.Lock()
+        self._current = None
+
+    def phase(self, name):
+        """Ends the current main-thread phase (if any) and starts a new one."""
+        now = precise_time()
+        self._end_phase(now)
+        self._current = (name, now)
+
+    def _end_phase(self, now):
+        if self._current:
+            name, start = self._current
+            self.add(name, start, now)
+            self._current = None
+
+    def add(self, name, start, end, thread="main"):
+        """Adds a timed phase of setup."""
+        with self._lock:
+            self.phases.append((name, thread, start - self.start, end - start))
+
+    def wait(self, task):
+        """Waits for a background task to finish, timing the wait as a phase.
+
+        Returns:
+            The result of the task.
+
+        """
+        self.phase("wait_" + task.name)
+        result = task.result()
+        self._end_phase(precise_time())
+        return result
+
+    def mark_first_screen(self):
+        """Marks the time the first screen is shown (only the first call counts)."""
+        if self.first_screen is None:
+            self.first_screen = precise_time() - self.start
+
+    def finish(self):
+        """Ends the current phase, returning the full startup report.
+
+        Returns:
+            list: A dict for each phase of setup with its name, thread, and its
+            start time and duration (both in ms, relative to the start of setup),
+            followed by the time to first screen as a phase with no duration.
+
+        """
+        self._end_phase(precise_time())
+        report = []
+        for name, thread, start, duration in sorted(self.phases, key=lambda p: p[2]):
+            report.append({
+                'phase': name,
+                'thread': thread,
+                'start': round(start * 1000, 3),
+                'duration': round(duration * 1000, 3),
+            })
+        if self.first_screen is not None:
+            report.append({
+                'phase': "first_screen",
+                'thread': "main",
+                'start': round(self.first_screen * 1000, 3),
+                'duration': 0.0,
+            })
+        return report
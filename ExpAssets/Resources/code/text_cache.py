@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+from klibs.KLCommunication import message
+
+# A bounded least-recently-used cache of rendered text, so that strings shown
+# repeatedly over the session (feedback, errors, instructions) only need to be
+# rasterized once. Text may also be rendered from the background thread that
+# pre-renders instruction screens, so access to the cache is locked. Rendering
+# happens outside that lock so cache hits never wait on another thread's
+# rendering, but has a lock of its own since SDL_ttf fonts aren't thread-safe.
+
+_lock = threading.Lock()
+_render_lock = threading.Lock()
+_cache = OrderedDict()
+_maxsize = 512
+_hits = 0
+_misses = 0
+
+
+def set_cache_size(maxsize):
+    """Sets the maximum number of rendered strings to keep in the text cache.
+
+    If the cache currently holds more strings than the new limit, the least
+    recently used ones are dropped.
+
+    """
+    global _maxsize
+    with _lock:
+        _maxsize = maxsize
+        _trim()
+
+
+def cached_message(text, style=None, align="left"):
+    """Renders a string of text, reusing the previous rendering if available.
+
+    Takes the same text, style, and alignment arguments as
+    :func:`klibs.KLCommunication.message`, but never draws to the screen.
+
+    Returns:
+        :obj:`~klibs.KLGraphics.NumpySurface`: The rendered text.
+
+    """
+    global _hits, _misses
+    key = (str(text), style, align)
+    with _lock:
+        try:
+            rendered = _cache[key]
+            _cache.move_to_end(key)
+            _hits += 1
+            return rendered
+        except KeyError:
+            _misses += 1
+
+    rendered = _render(text, style, align)
+    with _lock:
+        # If another thread rendered the same text in the meantime, keep theirs
+        rendered = _cache.setdefault(key, rendered)
+        _cache.move_to_end(key)
+        _trim()
+    return rendered
+
+
+def prewarm(texts, style=None, align="left"):
+    """Renders a list of strings into the text cache ahead of time."""
+    for text in texts:
+        key = (str(text), style, align)
+        with _lock:
+            if key in _cache:
+                continue
+        rendered = _render(text, style, align)
+        with _lock:
+            _cache.setdefault(key, rendered)
+            _trim()
+
+
+def _render(text, style, align):
+    with _render_lock:
+        return message(str(text), style=style, align=align)
+
+
+def _trim():
+    # Drops the least recently used strings over the size limit (lock must be held)
+    while len(_cache) > _maxsize:
+        _cache.popitem(last=False)
+
+
+def prewarm_steps(texts, style=None, align="left", chunk=4):
+    """Renders a list of strings into the text cache a chunk at a time.
+
+    Meant to be queued as an idle job (see :class:`IdleScheduler`), with each
+    step rendering at most `chunk` strings.
+
+    """
+    texts = list(texts)
+    for i in range(0, len(texts), chunk):
+        prewarm(texts[i:i + chunk], style=style, align=align)
+        yield
+
+
+def cache_info():
+    """dict: The hit/miss counts and current size of the text cache."""
+    return {
+        'hits': _hits, 'misses': _misses, 'size': len(_cache), 'maxsize': _maxsize
+    }
@@ -3,13 +3,16 @@
 __author__ = "Austin Hurst"
 
 import os
+import json
 import random
+import sqlite3
+import numpy as np
 import klibs
 from klibs import P
 
 from klibs.KLConstants import *
 from klibs.KLExceptions import TrialException
-from klibs.KLTime import CountDown
+from klibs.KLTime import CountDown, precise_time
 from klibs.KLBoundary import CircleBoundary
 from klibs.KLUtilities import deg_to_px, mouse_pos
 from klibs.KLGraphics import NumpySurface, fill, blit, flip
@@ -18,10 +21,26 @@ from klibs.KLText import add_text_style
 from klibs.KLCommunication import message
 from klibs.KLEventQueue import pump
 from klibs.KLUserInterface import any_key, ui_request, smart_sleep, key_pressed
-from klibs.KLResponseListeners import KeypressListener
-from klibs.KLTrialFactory import TrialIterator
 
-from klibs_wip import block_to_str
+from sdl2 import SDL_KEYDOWN, SDL_GetKeyName, SDL_GetTicks
+
+from klibs_wip import TrialDumpWriter
+from polling import PollScheduler
+from text_cache import cached_message, set_cache_size, prewarm_steps
+from schedule import compile_session
+from checkpoint import SessionCheckpoint
+from datalog import BatchWriter, JournaledWriter
+from drift import DriftEstimator
+from idle import IdleScheduler
+from demo_screens import DemoScreen, show_screens
+from monitor import SessionMonitor
+from startup import StartupProfiler, BackgroundTask
+from gaze import FixationDetector, drain_link
+from scheduler import BalancedTrialIterator, SessionScheduler
+from edf_transfer import (
+    EDFTransfer, TrackerEDFSource, LocalEDFSource, TransferQueue,
+    pending_transfers, skip_shutdown_receive
+)
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
@@ -29,33 +48,147 @@ RED = (255, 0, 0)
 GREEN = (0, 255, 0)
 PURPLE = (200, 128, 255)
 
+EYE_EVENT_NAMES = {
+    EL_BLINK_START: "blink_start",
+    EL_BLINK_END: "blink_end",
+    EL_SACCADE_START: "saccade_start",
+    EL_SACCADE_END: "saccade_end",
+    EL_FIXATION_START: "fixation_start",
+    EL_FIXATION_END: "fixation_end",
+    EL_FIXATION_UPDATE: "fixation_update",
+}
+
 
 
 class ExoInstructions(klibs.Experiment):
 
     def setup(self):
 
-        # Define stimulus sizes
+        session_start = precise_time()
+        self.startup = StartupProfiler()
+        self.startup.phase("stimuli")
+
+        # Initialize task stimuli and layout
         box_size = deg_to_px(2.3)
-        box_thickness = deg_to_px(0.06)
+        self._make_stimuli()
+
+        # Pre-composite every stimulus layout that can appear during the task in
+        # the background, using a separate set of shapes so that none are drawn
+        # from two threads at once
+        frames = BackgroundTask(
+            "frames", self._build_frames, self._make_shapes(), profiler=self.startup
+        )
+
+        # Initialize scheduler for running deferred work during idle periods
+        self.idle = IdleScheduler()
+
+        # Pre-render RT feedback text during idle periods a few strings at a time,
+        # so it doesn't need rendering between the response and the feedback flip
+        # (most likely RTs first). The first step is run now to measure its cost.
+        set_cache_size(P.text_cache_size)
+        rts = sorted(range(0, 2001), key=lambda rt: abs(rt - 500))
+        prewarm_rts = prewarm_steps(rts, style='feedback', chunk=4)
+        step_start = precise_time()
+        next(prewarm_rts)
+        step_cost = (precise_time() - step_start) * 1000.0
+        self.idle.defer(lambda: prewarm_rts, cost=step_cost)
+
+        # Add fixation boundary to eye tracker
+        self.startup.phase("tracker")
+        fix_bounds = CircleBoundary('fixation', P.screen_c, box_size)
+        self.el.add_boundary(fix_bounds)
+
+        # Initialize detector for fixation breaks & blinks from batches of gaze
+        # samples, using the same radius as the fixation boundary
+        self.fix_detector = FixationDetector(
+            P.screen_c, box_size, dwell=P.fixation_dwell, blink_loss=P.blink_sample_loss
+        )
+
+        # Initialize running estimate of gaze drift for adaptive drift correction
+        self.drift = DriftEstimator(P.screen_c)
+        self.drift_threshold = deg_to_px(P.drift_threshold)
+
+        # Initialize keymap and timeout (in ms) for target responses
+        self.keymap = {'T': 'T', 'F': 'F'}
+        self.response_timeout = 2000
+
+        # Initialize journaled writer for batching trial data writes, bringing the
+        # checkpoint of a crashed session up to date from its journal if needed
+        self.startup.phase("data")
+        self.checkpoint = None
+        self.checkpoint_dir = os.path.join(P.local_dir, "sessions")
+        journal_path = os.path.join(P.local_dir, "trial_journal.jsonl")
+        self.trial_log = JournaledWriter(P.database_path, journal_path)
+        recovered = self.trial_log.recovered_state
+        if recovered:
+            SessionCheckpoint.restore(self.checkpoint_dir, recovered)
+        if P.trial_commit_mode == "idle":
+            self.idle.defer(self._commit_data, repeat=True)
+
+        # Start background writer for logging eye events & markers to the database
+        self.eye_log = BatchWriter(P.database_path)
+        self.eye_log.start()
+
+        # Initialize scheduler for pacing fixation/response checks before the target
+        self.poller = PollScheduler(P.poll_rate, spin=P.poll_spin_ms)
+
+        # Generate blocks of trials based on custom block structure (in the
+        # background), or resume the remaining trials of a crashed session if the
+        # experimenter chooses to
+        self.startup.phase("structure")
+        self._resume_blocks, self._resume_trials = (0, 0)
+        crashed = SessionCheckpoint.find_incomplete(self.checkpoint_dir, P.condition)
+        resumed = False
+        if crashed and self._confirm_resume(crashed):
+            self.blocks, self.block_labels = self.resume_session(crashed)
+            resumed = True
+        else:
+            structure = BackgroundTask(
+                "generate_trials", self.generate_trials, profiler=self.startup
+            )
+        self.block_type = None
+
+        # Start publishing live session metrics for the experimenter's monitor
+        self.startup.phase("monitor")
+        monitor_path, monitor_addr = (None, None)
+        if P.session_monitor in ("file", "both"):
+            monitor_path = os.path.join(P.local_dir, "session_monitor.jsonl")
+        if P.session_monitor in ("udp", "both"):
+            monitor_addr = ("127.0.0.1", P.monitor_port)
+        self.monitor = SessionMonitor(P.participant_id, monitor_path, monitor_addr)
+        self.idle.defer(self.monitor.publish, cost=0.2, repeat=True)
+
+        self.was_practicing = False
+        if not resumed:
+            self.startup.phase("task_demo")
+            self.task_demo()
+
+        # Wait for any setup still running in the background
+        self.frames = self.startup.wait(frames)
+        if not resumed:
+            self.blocks, self.block_labels = self.startup.wait(structure)
+
+        # Track recycled trials and trial timing to predict the session's length
+        self.scheduler = SessionScheduler(
+            self.blocks, P.session_slot_minutes, start=session_start
+        )
+        self._log_startup()
+
+        if not resumed:
+            self.practice_mapping()
+
+
+    def _make_stimuli(self):
+        # Defines the text styles, stimuli, and stimulus locations for the task
+        # (also used by tools/replay.py to render recorded trials)
         cue_thickness = deg_to_px(0.24)
-        circle_size = deg_to_px(0.82)
-        circle_thickness = deg_to_px(0.1)
         target_size = deg_to_px(1.3)
-        fixation_size = deg_to_px(0.2)
         add_text_style('emph', size='0.52deg', font="Roboto-BoldItalic", color=PURPLE)
         add_text_style('target', size='0.6deg', color=WHITE)
         add_text_style('feedback', size='0.7deg', color=WHITE)
         add_text_style('err', size='0.7deg', color=RED)
 
-        # Initialize task stimuli
-        self.box = kld.Rectangle(box_size)
-        self.box.stroke = [box_thickness, WHITE, STROKE_CENTER]
-        self.cue = kld.Rectangle(box_size)
-        self.cue.stroke = [cue_thickness, RED, STROKE_CENTER]
-        self.circle = kld.Ellipse(circle_size)
-        self.circle.stroke = [circle_thickness, WHITE, STROKE_INNER]
-        self.fixation = kld.Ellipse(fixation_size, fill=WHITE)
+        self.box, self.cue, self.circle, self.fixation = self._make_shapes()
         self.targets = {
             'T': NumpySurface(message("T", style='target')).trim(),
             'F': NumpySurface(message("F", style='target')).trim(),
@@ -65,7 +198,6 @@ class ExoInstructions(klibs.Experiment):
             1: kld.Ellipse(target_size, fill=GREEN),
         }
 
-        # Stimulus Layout
         locs = {
             'TL': (-1, -1), 'TR': (1, -1), 'BL': (-1, 1), 'BR': (1, 1),
         }
@@ -77,24 +209,25 @@ class ExoInstructions(klibs.Experiment):
                 P.screen_c[1] + int(box_offset * offsets[1])
             )
 
-        # Add fixation boundary to eye tracker
-        fix_bounds = CircleBoundary('fixation', P.screen_c, box_size)
-        self.el.add_boundary(fix_bounds)
 
-        # Initialize keypress response listener
-        self.key_listener = KeypressListener(
-            keymap={'T': 'T', 'F': 'F'},
-            timeout=2.0,
-            loop_callback=self.response_callback,
-        )
+    def _make_shapes(self):
+        # Creates the box, cue, circle, and fixation shapes for the task stimuli
+        box_size = deg_to_px(2.3)
+        box = kld.Rectangle(box_size)
+        box.stroke = [deg_to_px(0.06), WHITE, STROKE_CENTER]
+        cue = kld.Rectangle(box_size)
+        cue.stroke = [deg_to_px(0.24), RED, STROKE_CENTER]
+        circle = kld.Ellipse(deg_to_px(0.82))
+        circle.stroke = [deg_to_px(0.1), WHITE, STROKE_INNER]
+        fixation = kld.Ellipse(deg_to_px(0.2), fill=WHITE)
+        return (box, cue, circle, fixation)
 
-        # Generate blocks of trials based on custom block structure
-        self.blocks, self.block_labels = self.generate_trials()
-        self.block_type = None
 
-        self.was_practicing = False
-        self.task_demo()
-        self.practice_mapping()
+    def _log_startup(self):
+        # Queues the timing of each phase of setup for writing to the database
+        for row in self.startup.finish():
+            row[P.id_field_name] = P.participant_id
+            self.trial_log.add('startup_timing', row)
 
 
     def practice_mapping(self):
@@ -123,37 +256,110 @@ class ExoInstructions(klibs.Experiment):
         # blocks/trials for the experiment.
         from exp_structure import structure
 
+        # All randomization for the session (trial order, cue onsets, cue locations,
+        # and practice targets) is done here using a seed for each block derived
+        # from the session's random seed, so that the session can be regenerated
+        session = compile_session(
+            structure, P.random_seed,
+            practice=P.run_practice_blocks, max_trials=P.max_trials_per_block
+        )
+
+        # Save the compiled structure so the session can be resumed after a crash
+        self.checkpoint = SessionCheckpoint(self.checkpoint_dir, P.participant_id)
+        self.checkpoint.save_structure(
+            P.condition, P.random_seed,
+            [(block.label, block.practice, tmp) for block, tmp in session]
+        )
+
         block_set = []
         block_labels = []
-        block_strs = [] # Text dump of factors for each trial of each block (for debug)
-
-        for block in structure:
-            if block.practice and not P.run_practice_blocks:
-                continue
 
-            block_labels.append(block.label)
-            tmp = block.get_trials()
-            if P.max_trials_per_block != None:
-                tmp = tmp[:P.max_trials_per_block]
+        # Dump current trial/block structure to a file (for debug)
+        ext = ".tsv" if P.trial_dump_format == "tsv" else ".txt"
+        dump_path = os.path.join(P.local_dir, "trial_dump" + ext)
+        with TrialDumpWriter(dump_path, P.trial_dump_format) as dump:
+            for block, tmp in session:
+                block_labels.append(block.label)
+                block_set.append(self._make_block(tmp, block.practice))
+                dump.write_block(block, tmp)
 
-            trials = TrialIterator(tmp)
-            trials.practice = block.practice
-            block_set.append(trials)
+        P.blocks_per_experiment = len(block_set)
+        return block_set, block_labels
 
-            block_strs.append(block_to_str(block, tmp, len(block_set)))
 
-        # Dump current trial/block structure to a file
-        with open(os.path.join(P.local_dir, "trial_dump.txt"), "w") as f:
-            f.write("\n".join(block_strs))
+    def resume_session(self, checkpoint):
+        # Rebuilds the remaining blocks/trials of a crashed session from its saved
+        # checkpoint, continuing the session under the original participant ID
+        self._drop_participant(P.participant_id)
+        P.participant_id = checkpoint.participant_id
+        P.random_seed = checkpoint.structure['random_seed']
+        self.checkpoint = checkpoint
 
-        P.blocks_per_experiment = len(block_set)
+        done_blocks, done_trials, remaining = checkpoint.remaining()
+        block_set = []
+        for _, practice, tmp in remaining:
+            block_set.append(self._make_block(tmp, practice))
+
+        # Block and trial numbers are offset at the start of the first resumed
+        # block/trial so they continue on from where the crashed session stopped
+        self._resume_blocks, self._resume_trials = (done_blocks, done_trials)
+        block_labels = [b['label'] for b in checkpoint.structure['blocks']]
+        P.blocks_per_experiment = len(block_labels)
         return block_set, block_labels
 
 
+    def _make_block(self, trials, practice):
+        # Wraps a block's trials in an iterator that keeps the block balanced when
+        # trials are recycled
+        seed = trials[0]['block_seed'] if trials else None
+        block = BalancedTrialIterator(trials, seed=seed)
+        block.practice = practice
+        return block
+
+
+    def _confirm_resume(self, checkpoint):
+        # Asks the experimenter whether to resume a crashed session
+        txt = (
+            "An incomplete session was found for participant {0} in this condition."
+            "\n\nPress 'R' to resume it, or 'N' to start a new session."
+        ).format(checkpoint.participant_id)
+        fill()
+        message(txt, location=P.screen_c, align='center')
+        flip()
+        self.startup.mark_first_screen()
+        while True:
+            q = pump()
+            if key_pressed('R', queue=q):
+                return True
+            elif key_pressed('N', queue=q):
+                checkpoint.abandon()
+                return False
+
+
+    def _drop_participant(self, participant_id):
+        # Removes the empty participant record created for a resumed session
+        db = sqlite3.connect(P.database_path)
+        with db:
+            db.execute("DELETE FROM participants WHERE id = ?", (participant_id,))
+        db.close()
+
+
     def block(self):
 
+        # Continue block numbering from where a resumed session left off
+        if self._resume_blocks:
+            P.block_number += self._resume_blocks
+            self._resume_blocks = 0
+
+        # Record recycles & timing for the previous block, then commit any queued
+        # trial data from it
+        if self.scheduler.current:
+            self._log_block_summary()
+        self._commit_data()
+
         # Get block type (accuracy emphasis or RT emphasis)
         self.block_type = self.block_labels[P.block_number - 1]
+        self.scheduler.start_block(P.block_number, self.block_type, P.practicing)
 
         # Tell participant when practice block is complete
         if self.was_practicing:
@@ -175,8 +381,8 @@ class ExoInstructions(klibs.Experiment):
             elif self.block_type == "rt":
                 self.show_rt_instructions()
             # Show block start message
-            msg = message(txt1 if P.block_number == 1 else txt2, align='center')
-            start_msg = message("Press any key to start.")
+            msg = cached_message(txt1 if P.block_number == 1 else txt2, align='center')
+            start_msg = cached_message("Press any key to start.")
             fill()
             blit(msg, 8, (P.screen_c[0], P.screen_y * 0.35))
             flip()
@@ -190,19 +396,15 @@ class ExoInstructions(klibs.Experiment):
 
     def trial_prep(self):
 
-        # Generate trial factors
-        self.cue_onset = random.randrange(1000, 2000, 100)
-        if self.cue_validity:
-            # If validly-cued target, cue location is target location
-            self.cue_loc = self.target_loc
-        else:
-            # If invalid, choose a random non-target location to cue
-            locs = list(self.stim_locs.keys())
-            locs.remove(self.target_loc)
-            self.cue_loc = random.choice(locs)
-        if self.target == 'random':
-            # If practice block, randomly choose the target letter
-            self.target = random.choice(['T', 'F'])
+        # Continue trial numbering from where a resumed session left off
+        if self._resume_trials:
+            P.trial_number += self._resume_trials
+            self._resume_trials = 0
+
+        self.scheduler.start_trial()
+
+        # NOTE: Cue onset, cue location, and target are precomputed for each trial
+        # in generate_trials, so no randomization needs to happen here
         self.target_off = False
 
         # Add timecourse of events to EventManager
@@ -210,12 +412,51 @@ class ExoInstructions(klibs.Experiment):
         self.evm.add_event('target_on', 300, after='cue_on')
         self.evm.add_event('target_off', 50, after='target_on')
 
+        # Keep track of scheduled onsets (in ms) for checking actual frame timing
+        self.frame_schedule = {
+            'cue_on': self.cue_onset,
+            'target_on': self.cue_onset + 300,
+            'target_off': self.cue_onset + 350,
+        }
+        self.frame_log = []
+        self.poller.reset()
+
         # Reset trial variables
         self.looked_away = False
         self.blinked = False
 
-        # Perform drift correct before each trial
-        self.el.drift_correct(target=self.fixation)
+        # Run any deferred work that fits in the gap before the drift correct
+        self.idle.run(P.iti_idle_time)
+
+        # Perform drift correct before the trial, either every trial or only when
+        # the estimated gaze drift or time since the last correction is too large
+        self.drift.update()
+        self.drift_est = self.drift.distance
+        if P.adaptive_drift_correct:
+            reason = self.drift.check(self.drift_threshold, P.drift_max_interval)
+        else:
+            reason = "always"
+        if reason:
+            self.el.drift_correct(target=self.fixation)
+            self._clear_gaze()
+            self.drift.reset()
+        else:
+            self.wait_for_start()
+        self.drift_correct = reason if reason else "skipped"
+
+
+    def wait_for_start(self):
+        # If skipping drift correction, show the fixation dot and wait for the
+        # participant to press the space bar to start the trial
+        fill()
+        blit(self.fixation, 5, P.screen_c)
+        flip()
+        while True:
+            q = pump()
+            ui_request(queue=q)
+            if key_pressed('space', queue=q):
+                break
+            self.idle.run(5)
 
 
     def trial(self):
@@ -223,49 +464,62 @@ class ExoInstructions(klibs.Experiment):
         err = "NA"
         edf_markup_suffix = " b{0} t{1}".format(P.block_number, P.trial_number)
 
-        # Draw the initial set of trial stimuli
-        self.draw_screen()
-        self.el.write("trial_start" + edf_markup_suffix)
+        # Discard any gaze samples from before the trial (e.g. blinks or looking
+        # at the keyboard while waiting to start), then draw the initial set of
+        # trial stimuli
+        self._clear_gaze()
+        self.draw_screen(label='trial_start')
+        self._mark("trial_start" + edf_markup_suffix)
+        self.poller.start()
         while self.evm.before('cue_on'):
             self.check_fixation()
             self.check_anticipatory()
+            self.drift.add_sample(self.el.gaze())
+            self.poller.wait(self.frame_schedule['cue_on'] - self.evm.trial_time_ms)
 
         # Present the cue
-        self.draw_screen(cue_loc=self.cue_loc)
-        self.el.write("cue_on" + edf_markup_suffix)
+        self.draw_screen(cue_loc=self.cue_loc, label='cue_on')
+        self._mark("cue_on" + edf_markup_suffix)
+        self.poller.start()
         while self.evm.before('target_on'):
             self.check_fixation()
             self.check_anticipatory()
+            self.poller.wait(self.frame_schedule['target_on'] - self.evm.trial_time_ms)
 
         # Present the target and collect a response
         self.draw_screen(
-            cue_loc=self.cue_loc, target_loc=self.target_loc, target=self.target
+            cue_loc=self.cue_loc, target_loc=self.target_loc, target=self.target,
+            label='target_on'
         )
-        self.el.write("target_on" + edf_markup_suffix)
-        resp, rt = self.key_listener.collect()
+        self._mark("target_on" + edf_markup_suffix)
+        resp, rt, rt_poll = self.collect_response()
 
         # Display feedback after response
-        self.el.write("feedback" + edf_markup_suffix)
+        self._mark("feedback" + edf_markup_suffix)
         if resp:
             accuracy = int(resp == self.target)
             if self.block_type == 'acc':
                 feedback = self.feedback[accuracy]
             else:
                 style = "feedback"# if accuracy == 1 else "err"
-                feedback = message(int(rt), style=style)
+                feedback = cached_message(str(int(rt)), style=style)
             self.show_feedback(feedback, duration=1.0)
         else:
             if self.blinked:
-                feedback = message("Blinked!", style="err")
+                feedback = cached_message("Blinked!", style="err")
                 err = "blinked"
             elif self.looked_away:
-                feedback = message("Looked away!", style="err")
+                feedback = cached_message("Looked away!", style="err")
                 err = "looked_away"
             else:
-                feedback = message("Too slow!", style="err")
+                feedback = cached_message("Too slow!", style="err")
                 err = "timeout"
             self.show_feedback(feedback, duration=2.0)
-            resp, rt, accuracy = ("NA", "NA", "NA")
+            resp, rt, rt_poll, accuracy = ("NA", "NA", "NA", "NA")
+
+        # Log actual frame timing for the trial & check the target duration
+        target_refreshes, target_timing = self._target_timing()
+        self._write_frame_timing(recycled=False)
 
         return {
             "block_num": P.block_number,
@@ -277,14 +531,43 @@ class ExoInstructions(klibs.Experiment):
             "target_loc": self.target_loc,
             "cue_loc": self.cue_loc,
             "cue_validity": self.cue_validity,
+            "cue_onset": self.cue_onset,
+            "block_seed": self.block_seed,
             "rt": rt,
+            "rt_poll": rt_poll,
             "response": resp,
             "accuracy": accuracy,
             "err": err,
+            "target_refreshes": target_refreshes,
+            "target_timing": target_timing,
+            "poll_rate": round(self.poller.rate, 1),
+            "poll_max_gap": round(self.poller.max_gap_ms, 3),
+            "drift_est": "NA" if self.drift_est is None else round(self.drift_est, 1),
+            "drift_correct": self.drift_correct,
         }
 
 
     def clean_up(self):
+        # Mark the session as finished so it isn't offered for resuming
+        self.checkpoint.session_done()
+
+        # Record recycles & timing for the final block
+        if self.scheduler.current:
+            self._log_block_summary()
+
+        # Finish any deferred work and write any remaining trial data and eye
+        # events to the database
+        self.idle.run_all()
+        self.monitor.close()
+        self.trial_log.close()
+        self.eye_log.close()
+
+        # If doing eye tracking, start transferring the EDF data in the background
+        # while the end message is on screen (can be slow)
+        edf_queue = None
+        if not "TryLink" in self.el.version:
+            edf_queue = self.start_edf_transfer()
+
         # Show end message so task doesn't just exit abruptly when done
         txt = "You're all done!\n\nPress any key to exit the experiment."
         fill()
@@ -293,170 +576,483 @@ class ExoInstructions(klibs.Experiment):
         smart_sleep(200)
         any_key()
 
-        # If doing eye tracking, show message when transferring EDF data (can be slow)
-        if not "TryLink" in self.el.version:
+        # If the EDF transfer is still going, show its progress until it's done
+        if edf_queue:
+            self.show_transfer_progress(edf_queue)
+
+
+    def start_edf_transfer(self):
+        # Starts copying the session's EDF (followed by any EDFs left over from
+        # previously interrupted transfers) into the EDF folder in the background,
+        # and stops KLibs from receiving the session's EDF again on exit
+        tmp_dir = os.path.join(P.local_dir, "edf_tmp")
+        tracker_name, dest = self._edf_names()
+        transfers = [EDFTransfer(self._edf_source(tracker_name), dest, tmp_dir)]
+        transfers += pending_transfers(tmp_dir, self._edf_source)
+        skip_shutdown_receive(self.el, [tracker_name])
+        queue = TransferQueue(transfers)
+        queue.start()
+        return queue
+
+
+    def _edf_names(self):
+        # Gets the name of the session's EDF on the tracker (8 characters max) and
+        # the local path KLibs would normally receive it to
+        edf_name = self.el.edf_filename
+        if isinstance(edf_name, (list, tuple)):
+            return tuple(edf_name)
+        return (edf_name, os.path.join(P.edf_dir, edf_name))
+
+
+    def _edf_source(self, tracker_name):
+        # Gets a source for receiving an EDF from the tracker (or a stand-in)
+        if P.edf_stand_in:
+            return LocalEDFSource(P.edf_stand_in, rate=P.edf_stand_in_rate)
+        return TrackerEDFSource(self.el, tracker_name)
+
+
+    def show_transfer_progress(self, queue):
+        # Shows a progress bar for the EDF transfer(s) until they're finished
+        bar_w, bar_h = (int(P.screen_x * 0.4), deg_to_px(0.5))
+        bar_left = (P.screen_c[0] - bar_w // 2, P.screen_c[1])
+        txt_loc = (P.screen_c[0], P.screen_c[1] - bar_h * 2)
+        outline = kld.Rectangle(bar_w, bar_h, stroke=[2, WHITE, STROKE_INNER])
+        while queue.is_alive():
+            transfer = queue.current
+            if transfer is None:
+                break
+            progress = transfer.progress
+            if progress is None:
+                txt = "Receiving EyeLink data from tracker ({0:.1f} MB), please wait..."
+                txt = txt.format(transfer.received / 1e6)
+            else:
+                txt = "Transferring EyeLink data ({0}%), please wait..."
+                txt = txt.format(int(progress * 100))
+            fill()
+            message(txt, location=txt_loc)
+            blit(outline, 5, P.screen_c)
+            if progress:
+                bar = kld.Rectangle(max(1, int(bar_w * progress)), bar_h, fill=WHITE)
+                blit(bar, 4, bar_left)
+            flip()
+            smart_sleep(100)
+
+        # If any transfers failed, let the experimenter know. The session's own
+        # (first) transfer is retried at the end of the next session, but ones
+        # that were already being retried are set aside (in the 'edf_tmp' folder)
+        # so that they're only reported once
+        transfers = queue.transfers
+        failed = [t for t in transfers if t.error]
+        for t in failed:
+            if t is not transfers[0]:
+                t.set_aside()
+        if failed:
+            errs = "\n".join([str(t.error) for t in failed])
+            txt = "Error transferring EyeLink data:\n{0}\n\nPress any key to exit."
             fill()
-            message("Transferring EyeLink data, please wait...", location=P.screen_c)
+            message(txt.format(errs), location=P.screen_c, align='center')
             flip()
+            any_key()
 
 
-    def draw_screen(self, cue_loc=None, target_loc=None, target='T'):
-        fill()
-        blit(self.fixation, 5, P.screen_c)
+    def _build_frames(self, shapes):
+        # Composites each possible combination of cue and target into a single
+        # surface, so that every change to the trial display is one blit + flip.
+        # Only the region spanned by the boxes is cached (full-screen surfaces
+        # for all 45 layouts would take up hundreds of MB), since the background
+        # is cleared by fill() anyway.
+        box, cue, circle, fixation = shapes
+        box_w = max(box.surface_width, cue.surface_width)
+        box_h = max(box.surface_height, cue.surface_height)
+        offsets = [
+            (x - P.screen_c[0], y - P.screen_c[1]) for x, y in self.stim_locs.values()
+        ]
+        width = max(abs(x) for x, y in offsets) * 2 + box_w + 2
+        height = max(abs(y) for x, y in offsets) * 2 + box_h + 2
+        center = (width // 2, height // 2)
+
+        layouts = [(None, None, None)]
         for loc in self.stim_locs.keys():
-            if cue_loc and loc == cue_loc:
-                blit(self.cue, 5, self.stim_locs[loc])
-            else:
-                blit(self.box, 5, self.stim_locs[loc])
-            if target_loc and loc == target_loc:
-                blit(self.targets[target], 5, self.stim_locs[loc])
-            else:
-                blit(self.circle, 5, self.stim_locs[loc])
+            layouts.append((loc, None, None))
+            for target in self.targets.keys():
+                layouts.append((None, loc, target))
+                for cue_loc in self.stim_locs.keys():
+                    layouts.append((cue_loc, loc, target))
+
+        frames = {}
+        for cue_loc, target_loc, target in layouts:
+            frame = NumpySurface(width=width, height=height)
+            frame.blit(fixation, 5, center)
+            for loc, (x, y) in self.stim_locs.items():
+                pos = (center[0] + x - P.screen_c[0], center[1] + y - P.screen_c[1])
+                frame.blit(cue if loc == cue_loc else box, 5, pos)
+                if loc == target_loc:
+                    frame.blit(self.targets[target], 5, pos)
+                else:
+                    frame.blit(circle, 5, pos)
+            frame.render()
+            frames[(cue_loc, target_loc, target)] = frame
+
+        return frames
+
+
+    def draw_screen(self, cue_loc=None, target_loc=None, target='T', label=None):
+        if not target_loc:
+            target = None
+        fill()
+        blit(self.frames[(cue_loc, target_loc, target)], 5, P.screen_c)
         flip()
+        self._log_flip(label)
 
 
     def show_feedback(self, msg, duration=1.0):
         fill()
         blit(msg, 5, P.screen_c)
         flip()
+        self._log_flip('feedback')
         feedback_time = CountDown(duration)
+        if P.trial_commit_mode == "feedback":
+            # Commit queued trial data while the feedback is on screen
+            self._commit_data()
         while feedback_time.counting():
             ui_request()
+            # Use the time while feedback is on screen to run any deferred work
+            self.idle.run(feedback_time.remaining() * 1000)
+
+
+    def _log_flip(self, label):
+        # Records when a labelled frame actually reached the screen during a trial
+        if not (label and P.in_trial):
+            return
+        flip_time = self.evm.trial_time_ms
+        self.frame_log.append((label, self.frame_schedule.get(label), flip_time))
+        if label == 'target_on':
+            # Also get the SDL time of the flip to compare keypress times against
+            self.target_onset = (flip_time, SDL_GetTicks())
+
+
+    def _target_timing(self):
+        # Counts the number of refreshes the target was on screen for, flagging
+        # the trial if the target was shown for longer or shorter than intended.
+        # If the target was never removed (e.g. the response came first), its
+        # duration wasn't under the experiment's control so it isn't counted.
+        flips = {label: t for label, sched, t in self.frame_log}
+        if not ('target_on' in flips and 'target_off' in flips):
+            return ("NA", "NA")
+        expected = int(round(50 / P.refresh_time))
+        duration = flips['target_off'] - flips['target_on']
+        refreshes = int(round(duration / P.refresh_time))
+        if refreshes > expected:
+            timing = "stretched"
+        elif refreshes < expected:
+            timing = "dropped"
+        else:
+            timing = "ok"
+        return (refreshes, timing)
+
+
+    def _write_frame_timing(self, recycled):
+        # Writes the scheduled and actual flip times for each frame to the database
+        for label, scheduled, flipped in self.frame_log:
+            row = {
+                P.id_field_name: P.participant_id,
+                'block_num': P.block_number,
+                'trial_num': P.trial_number,
+                'recycled': recycled,
+                'frame': label,
+                'scheduled': "NA" if scheduled is None else scheduled,
+                'flipped': round(flipped, 3),
+                'lag': "NA" if scheduled is None else round(flipped - scheduled, 3),
+            }
+            self.trial_log.add('frame_timing', row)
+        self.frame_log = []
+
+
+    def __log_trial__(self, trial_data):
+        # Queues trial data in the journaled writer instead of committing it to the
+        # database immediately. The trial's data (including its frame timing) and
+        # the updated session checkpoint are written to the journal in one go
+        # here, and committed to the database later on (during the next idle
+        # period, by default).
+        row = {P.id_field_name: P.participant_id}
+        row.update(trial_data)
+        self.trial_log.add(P.primary_table, row)
+        self.checkpoint.trial_done(P.block_number, self.trial_idx)
+        self.trial_log.sync(self.checkpoint.state())
+        self.monitor.add_trial(trial_data)
+        self.scheduler.trial_done()
+        self._update_prediction()
+
+
+    def _commit_data(self):
+        # Commits queued trial data to the database, saving the session's progress
+        # first so it's never behind the data cleared from the journal
+        if self.checkpoint:
+            self.checkpoint.save()
+        self.trial_log.commit()
+
+
+    def _update_prediction(self):
+        # Updates the predicted length of the session, marking the first time
+        # it's predicted to run over its booked slot
+        prediction = self.scheduler.predict()
+        self.monitor.set_schedule(prediction)
+        if self.scheduler.check_overrun(prediction):
+            self._mark("predicted overrun ({0:.1f} min)".format(
+                (prediction['total'] - prediction['slot']) / 60.0
+            ))
+
+
+    def _log_block_summary(self):
+        # Queues the recycle counts & timing of the current block for the database
+        summary = self.scheduler.block_summary()
+        rate, total = (summary['recycle_rate'], summary['predicted_total'])
+        row = {P.id_field_name: P.participant_id}
+        row.update(summary)
+        row['recycle_rate'] = "NA" if rate is None else round(rate, 3)
+        row['recycle_reasons'] = json.dumps(summary['recycle_reasons'])
+        row['duration'] = round(summary['duration'], 3)
+        row['predicted_total'] = "NA" if total is None else round(total, 1)
+        self.trial_log.add('block_summary', row)
+
+
+    def _mark(self, msg):
+        # Writes a marker to the EDF and queues it for writing to the database
+        self.el.write(msg)
+        self._log_eye_event("marker", self.el.now(), msg)
+
+
+    def _get_eye_data(self):
+        # Fetches new events and gaze samples from the eye tracker, queueing the
+        # events for the database. When using mouse simulation, the current gaze
+        # position is used as the only new sample.
+        if "TryLink" in self.el.version:
+            eye_q = self.el.get_event_queue()
+            times = np.array([self.el.now()], dtype=np.float64)
+            xy = np.array([self.el.gaze()], dtype=np.float64)
+        else:
+            eye_q, times, xy = drain_link(self.el)
+        blinked = False
+        for e in eye_q:
+            e_type = self.el.get_event_type(e)
+            e_name = EYE_EVENT_NAMES.get(e_type, str(e_type))
+            self._log_eye_event(e_name, self.el.get_event_timestamp(e))
+            if e_type in (EL_BLINK_START, EL_BLINK_END):
+                blinked = True
+        return (blinked, times, xy)
+
+
+    def _log_eye_event(self, event, tracker_time, label="NA"):
+        self.eye_log.put('eye_events', {
+            P.id_field_name: P.participant_id,
+            'block_num': P.block_number,
+            'trial_num': P.trial_number,
+            'trial_time': round(self.evm.trial_time_ms, 3),
+            'tracker_time': tracker_time,
+            'event': event,
+            'label': label,
+        })
+
+
+    def _recycle(self, reason, msg):
+        # Shows an error message and recycles the current trial
+        self._mark("recycled ({0})".format(reason))
+        self.monitor.add_recycle(
+            reason, P.block_number, P.trial_number, self.block_type, P.practicing
+        )
+        self.show_feedback(cached_message(msg, style='err'), duration=2.0)
+        self._write_frame_timing(recycled=True)
+        self.drift.discard()
+        self.scheduler.trial_recycled(reason)
+        self._update_prediction()
+        raise TrialException(reason)
 
 
-    def _left_fixation(self, queue):
-        # Use gaze pos to check fixation when doing mouse simulation, since saccade
-        # simulation is currently wonky with trackpads & high-res displays
-        if "TryLink" in self.el.version:
-            return not self.el.within_boundary('fixation', EL_GAZE_POS)
-        return self.el.saccade_from_boundary('fixation', event_queue=queue)
+    def _clear_gaze(self):
+        # Discards any queued gaze samples & tracker events so fixation checks
+        # only see data from the current trial
+        self._get_eye_data()
+        self.fix_detector.reset()
+
+
+    def _check_gaze(self):
+        # Checks all gaze samples since the last check for fixation breaks or
+        # blinks, returning 'looked_away', 'blinked', or None
+        blink_event, times, xy = self._get_eye_data()
+        gaze_err = self.fix_detector.check(times, xy)
+        if not gaze_err and blink_event:
+            gaze_err = "blinked"
+        return gaze_err
 
 
     def check_fixation(self):
-        # Recycles the trial if the participant looks away from fixation pre-target
-        eye_q = self.el.get_event_queue()
-        if self._left_fixation(eye_q):
-            self.el.write("recycled (looked away)")
-            msg = message("Looked away!", style='err')
-            self.show_feedback(msg, duration=2.0)
-            raise TrialException("looked away")
-        # Recycles the trial if the participant blinks pre-target
-        for e in eye_q:
-            if self.el.get_event_type(e) in (EL_BLINK_START, EL_BLINK_END):
-                self.el.write("recycled (blinked)")
-                msg = message("Blinked!", style='err')
-                self.show_feedback(msg, duration=2.0)
-                raise TrialException("blinked")
+        # Recycles the trial if the participant looks away from fixation or
+        # blinks pre-target
+        gaze_err = self._check_gaze()
+        if gaze_err == "looked_away":
+            self._recycle("looked away", "Looked away!")
+        elif gaze_err == "blinked":
+            self._recycle("blinked", "Blinked!")
 
 
     def check_anticipatory(self):
         # Recycles the trial if the participant responds before target appears
         q = pump()
         if key_pressed('T', queue=q) or key_pressed('F', queue=q):
-            self.el.write("recycled (anticipatory response)")
-            msg = message("Responded too soon!", style='err')
-            self.show_feedback(msg, duration=2.0)
-            raise TrialException("anticipatory response")
+            self._recycle("anticipatory response", "Responded too soon!")
+
+
+    def collect_response(self):
+        # Waits for a response to the target. RTs are taken from the keypress
+        # event timestamps relative to the target onset flip. Note that SDL
+        # stamps events when they're pumped (not when the key is pressed), so
+        # these are only as precise as the input loop: the queue is pumped at
+        # the start of every loop, none of which block apart from the target-off
+        # flip, so keypresses during that flip can be stamped up to one refresh
+        # late. The RT based on when the keypress was detected is returned too,
+        # for comparison.
+        while True:
+            response = self._check_response()
+            if response:
+                return response
+            if self.evm.trial_time_ms - self.target_onset[0] >= self.response_timeout:
+                return (None, -1, -1)
+            # Removing the target blocks until the next refresh, so check for
+            # keypresses right before the flip and again right after it
+            if not self.target_off and self.evm.after('target_off'):
+                response = self._check_response()
+                if response:
+                    return response
+                self.update_target()
+                continue
+            if self.check_response_gaze():
+                return (None, -1, -1)
 
 
-    def response_callback(self):
+    def _check_response(self):
+        # Checks the input queue for a response key, returning the response with
+        # its event- and poll-based RTs (if any). Keypresses timestamped before
+        # the target onset flip are treated as anticipatory.
+        onset_ms, onset_ticks = self.target_onset
+        q = pump()
+        ui_request(queue=q)
+        for key, timestamp in keypresses(q):
+            if key in self.keymap:
+                if timestamp < onset_ticks:
+                    self._recycle("anticipatory response", "Responded too soon!")
+                rt_poll = self.evm.trial_time_ms - onset_ms
+                return (self.keymap[key], timestamp - onset_ticks, rt_poll)
+        return None
+
+
+    def update_target(self):
         # Once it's time, remove the target from the screen
         if not self.target_off and self.evm.after('target_off'):
-            self.draw_screen(cue_loc=self.cue_loc)
+            self.draw_screen(cue_loc=self.cue_loc, label='target_off')
             self.target_off = True
-        # Stop trial and show error if gaze leaves fixation before response
-        eye_q = self.el.get_event_queue()
-        if self._left_fixation(eye_q):
-            self.looked_away = True
             return True
-        # Stop trial and show error if participant blinks
-        for e in eye_q:
-            if self.el.get_event_type(e) in (EL_BLINK_START, EL_BLINK_END):
-                self.blinked = True
-                return True
+        return False
+
+
+    def check_response_gaze(self):
+        # Stop trial and show error if gaze leaves fixation or the participant
+        # blinks before responding
+        gaze_err = self._check_gaze()
+        if gaze_err == "looked_away":
+            self.looked_away = True
+        elif gaze_err == "blinked":
+            self.blinked = True
+        return gaze_err is not None
+
+
+    def demo_layout(self, cue_loc=None, target_loc=None, target='T'):
+        # Gets the list of stimuli and locations for an example trial display
+        layout = []
+        for loc in self.stim_locs.keys():
+            outer = self.cue if (cue_loc and loc == cue_loc) else self.box
+            inner = self.circle
+            if target_loc and loc == target_loc:
+                inner = self.targets[target]
+            layout.append((outer, self.stim_locs[loc]))
+            layout.append((inner, self.stim_locs[loc]))
+        return layout
 
 
     def task_demo(self):
 
         fixation = [(self.fixation, P.screen_c)]
-        def generate_stimuli(cue_loc=None, target_loc=None, target='T'):
-            layout = []
-            for loc in self.stim_locs.keys():
-                outer = self.cue if (cue_loc and loc == cue_loc) else self.box
-                inner = self.circle
-                if target_loc and loc == target_loc:
-                    inner = self.targets[target]
-                layout.append((outer, self.stim_locs[loc]))
-                layout.append((inner, self.stim_locs[loc]))
-            return layout
-
-        show_demo_text(
-            "Welcome to the experiment! This tutorial will help explain the task."
-        )
-        show_demo_text(
-            "Each trial of the task begins with 4 squares on the screen.",
-            generate_stimuli(),
-        )
-        show_demo_text(
-            "After a brief delay, one of the squares will be highlighted in red.",
-            generate_stimuli(cue_loc='TR'),
-        )
-        show_demo_text(
-            ("Shortly after, a letter (T or F) will flash briefly in one of the squares."
-             "\nPress any key to see an example."),
-            generate_stimuli(cue_loc='TR'),
-        )
-        show_demo_text(
-            [], generate_stimuli(cue_loc='TR') + fixation,
-            duration=0.3, wait=False
-        )
-        show_demo_text(
-            [], generate_stimuli(cue_loc='TR', target_loc='TR', target='F') + fixation,
-            duration=0.05, wait=False
-        )
-        show_demo_text(
-            [], generate_stimuli(cue_loc='TR') + fixation,
-            duration=0.5, wait=False
-        )
-        show_demo_text(
-            ("Your job will be to report the target letter (T or F) by pressing the "
-             "\ncorresponding key on the keyboard."),
-            generate_stimuli(cue_loc='TR'),
-        )
-        show_demo_text(
-            ("Please note that the target letter can appear in any of the 4 squares,\n"
-             "not just the one that was highlighted!"),
-            generate_stimuli(cue_loc='TR', target_loc='BL', target='F'),
-        )
-        show_demo_text(
-            ["Before each trial, a dot will appear in the middle of the screen.",
-             ("To start a trial, please look directly at the dot and press the "
-              "space bar.")],
-            fixation, msg_y = int(P.screen_y * 0.32)
-        )
-        show_demo_text(
-            ("During the task, please do your best to keep your eyes fixed on the dot\n"
-             "and use your peripheral vision to detect the target letters."),
-            fixation, msg_y = int(P.screen_y * 0.35)
-        )
-        show_demo_text(
-            ("The task is self-paced, so feel free to take a break between trials if "
-             "you need one!"),
-            fixation, msg_y = int(P.screen_y * 0.35)
-        )
-        show_demo_text(
-            ("Additionally, please try to avoid blinking during trials as it "
-             "interferes\nwith eye tracking. Blinking *between* trials is encouraged."),
-            fixation, msg_y = int(P.screen_y * 0.35)
-        )
-        show_demo_text(
-            ("You will now practice responding to targets by pressing the "
-             "corresponding key.\n\nPress any key to begin.")
-        )
+        layout = self.demo_layout
+
+        show_screens([
+            DemoScreen(
+                "Welcome to the experiment! This tutorial will help explain the task."
+            ),
+            DemoScreen(
+                "Each trial of the task begins with 4 squares on the screen.",
+                layout(),
+            ),
+            DemoScreen(
+                "After a brief delay, one of the squares will be highlighted in red.",
+                layout(cue_loc='TR'),
+            ),
+            DemoScreen(
+                ("Shortly after, a letter (T or F) will flash briefly in one of the "
+                 "squares.\nPress any key to see an example."),
+                layout(cue_loc='TR'),
+            ),
+            DemoScreen(
+                [], layout(cue_loc='TR') + fixation,
+                duration=0.3, wait=False
+            ),
+            DemoScreen(
+                [], layout(cue_loc='TR', target_loc='TR', target='F') + fixation,
+                duration=0.05, wait=False
+            ),
+            DemoScreen(
+                [], layout(cue_loc='TR') + fixation,
+                duration=0.5, wait=False
+            ),
+            DemoScreen(
+                ("Your job will be to report the target letter (T or F) by pressing "
+                 "the \ncorresponding key on the keyboard."),
+                layout(cue_loc='TR'),
+            ),
+            DemoScreen(
+                ("Please note that the target letter can appear in any of the 4 "
+                 "squares,\nnot just the one that was highlighted!"),
+                layout(cue_loc='TR', target_loc='BL', target='F'),
+            ),
+            DemoScreen(
+                ["Before each trial, a dot will appear in the middle of the screen.",
+                 ("To start a trial, please look directly at the dot and press the "
+                  "space bar.")],
+                fixation, msg_y = int(P.screen_y * 0.32)
+            ),
+            DemoScreen(
+                ("During the task, please do your best to keep your eyes fixed on the "
+                 "dot\nand use your peripheral vision to detect the target letters."),
+                fixation, msg_y = int(P.screen_y * 0.35)
+            ),
+            DemoScreen(
+                ("The task is self-paced, so feel free to take a break between trials "
+                 "if you need one!"),
+                fixation, msg_y = int(P.screen_y * 0.35)
+            ),
+            DemoScreen(
+                ("Additionally, please try to avoid blinking during trials as it "
+                 "interferes\nwith eye tracking. Blinking *between* trials is "
+                 "encouraged."),
+                fixation, msg_y = int(P.screen_y * 0.35)
+            ),
+            DemoScreen(
+                ("You will now practice responding to targets by pressing the "
+                 "corresponding key.\n\nPress any key to begin.")
+            ),
+        ], on_first_flip=self.startup.mark_first_screen)
 
 
     def show_acc_instructions(self):
-        inst = message(
+        inst = cached_message(
             "Please try to respond as accurately as possible!", style="emph"
         )
         loc = (P.screen_c[0], int(P.screen_y * 0.32 + inst.height * 2))
@@ -464,74 +1060,69 @@ class ExoInstructions(klibs.Experiment):
             P.screen_c[0] - int(inst.width / 2) + int(inst.width * 0.625),
             loc[1] + int(inst.height / 2)
         )
-        show_demo_text(
-            ("For the next set of trials you will be given feedback on the accuracy of "
-             "your responses."),
-            [(self.fixation, P.screen_c), (inst, loc)],
-            msg_y = int(P.screen_y * 0.32), duration=2.0
-        )
-        show_demo_text(
-            ("When you respond correctly, you will be shown a green circle."),
-            [(self.feedback[1], P.screen_c)], msg_y = int(P.screen_y * 0.35)
-        )
-        show_demo_text(
-            ("When you respond *incorrectly*, you will be shown a red X."),
-            [(self.feedback[0], P.screen_c)], msg_y = int(P.screen_y * 0.35)
-        )
+        show_screens([
+            DemoScreen(
+                ("For the next set of trials you will be given feedback on the "
+                 "accuracy of your responses."),
+                [(self.fixation, P.screen_c), (inst, loc)],
+                msg_y = int(P.screen_y * 0.32), duration=2.0
+            ),
+            DemoScreen(
+                ("When you respond correctly, you will be shown a green circle."),
+                [(self.feedback[1], P.screen_c)], msg_y = int(P.screen_y * 0.35)
+            ),
+            DemoScreen(
+                ("When you respond *incorrectly*, you will be shown a red X."),
+                [(self.feedback[0], P.screen_c)], msg_y = int(P.screen_y * 0.35)
+            ),
+        ])
 
 
     def show_rt_instructions(self):
-        inst = message(
+        inst = cached_message(
             "Please try to respond as quickly as possible (without guessing)!",
             style="emph"
         )
         loc = (P.screen_c[0], int(P.screen_y * 0.32 + inst.height * 2))
-        rt_feedback = [(message("374", style="feedback"), P.screen_c)]
-        rt_err_feedback = [(message("259", style="err"), P.screen_c)]
-        show_demo_text(
-            ("For the next set of trials you will be given feedback on the speed of "
-             "your responses."),
-            [(self.fixation, P.screen_c), (inst, loc)],
-            msg_y = int(P.screen_y * 0.32), duration=2.0
-        )
-        show_demo_text(
-            ("When you make a response, you will be shown your reaction time (in "
-             "milliseconds)."),
-            rt_feedback, msg_y = int(P.screen_y * 0.35)
-        )
-        #show_demo_text(
-        #    "If you make an incorrect response, the reaction time will appear in red.",
-        #    rt_err_feedback, msg_y = int(P.screen_y * 0.35)
-        #)
+        rt_feedback = [(cached_message("374", style="feedback"), P.screen_c)]
+        rt_err_feedback = [(cached_message("259", style="err"), P.screen_c)]
+        show_screens([
+            DemoScreen(
+                ("For the next set of trials you will be given feedback on the speed "
+                 "of your responses."),
+                [(self.fixation, P.screen_c), (inst, loc)],
+                msg_y = int(P.screen_y * 0.32), duration=2.0
+            ),
+            DemoScreen(
+                ("When you make a response, you will be shown your reaction time (in "
+                 "milliseconds)."),
+                rt_feedback, msg_y = int(P.screen_y * 0.35)
+            ),
+            #DemoScreen(
+            #    ("If you make an incorrect response, the reaction time will appear "
+            #     "in red."),
+            #    rt_err_feedback, msg_y = int(P.screen_y * 0.35)
+            #),
+        ])
 
 
 
 def show_demo_text(msgs, stim_set=[], duration=1.0, wait=True, msg_y=None):
     """Draws text and stimuli onto the screen for task instructions."""
+    show_screens([DemoScreen(msgs, stim_set, duration, wait, msg_y)])
 
-    msg_x = int(P.screen_x / 2)
-    msg_y = int(P.screen_y * 0.5) if msg_y is None else msg_y
-    half_space = deg_to_px(0.5)
-
-    # First, render and draw the instruction text to the screen
-    fill()
-    if not isinstance(msgs, list):
-        msgs = [msgs]
-    for msg in msgs:
-        txt = message(msg, align="center")
-        blit(txt, 5, (msg_x, msg_y))
-        msg_y += txt.height + half_space
-
-    # Then, draw any example stimuli to the screen
-    for stim, locs in stim_set:
-        if not isinstance(locs, list):
-            locs = [locs]
-        for loc in locs:
-            blit(stim, 5, loc)
-    flip()
-
-    # Keep stimuli on screen for the requested duration, then either continue or
-    # wait for a keypress to continue (if wait = True)
-    smart_sleep(duration * 1000)
-    if wait:
-        any_key()
+
+def keypresses(queue):
+    """Gets the key name and SDL timestamp (in ms) of each keypress in a queue.
+
+    SDL timestamps events when they're pumped into the queue, so a timestamp
+    marks when the keypress was first seen by the program rather than when the
+    key was actually pressed.
+
+    """
+    presses = []
+    for e in queue:
+        if e.type == SDL_KEYDOWN and not e.key.repeat:
+            key = SDL_GetKeyName(e.key.keysym.sym).decode('utf-8')
+            presses.append((key.upper(), e.key.timestamp))
+    return presses
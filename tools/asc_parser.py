@@ -0,0 +1,308 @@
+"""Indexes EyeLink ASC files (EDFs converted to text with edf2asc) by trial.
+
+The file is read once, streaming, to find the byte offsets of each trial's
+markers (written by the experiment as 'trial_start b{n} t{m}', 'cue_on ...',
+'target_on ...', 'feedback ...' and 'recycled (...)'). Gaze samples and
+fixation/saccade/blink events are then only parsed into NumPy arrays for the
+trials that are asked for, so whole files never need to be loaded into memory.
+
+Example:
+
+    from asc_parser import ASCIndex, join_trials
+
+    with ASCIndex("ExpAssets/EDF/p1_2024-01-01.asc") as asc:
+        for row, seg in join_trials(asc, "ExpAssets/ExoInstructions.db", 1):
+            samples = asc.samples(seg, start='target_on', end='feedback')
+
+Or, to print the marker times for each trial in a file:
+
+    python tools/asc_parser.py ExpAssets/EDF/p1_2024-01-01.asc
+
+"""
+import re
+import sqlite3
+import argparse
+
+import numpy as np
+
+MARKERS = ["trial_start", "cue_on", "target_on", "feedback", "recycled"]
+MARKER_RE = re.compile(
+    br"^MSG\s+(\d+)\s+(?:-?\d+\s+)?(\w+)(?: \((.*)\))?(?: b(\d+) t(\d+))?\s*$"
+)
+
+FIXATION_DTYPE = [
+    ('start', 'i8'), ('end', 'i8'), ('dur', 'i8'), ('x', 'f8'), ('y', 'f8'),
+    ('pupil', 'f8'),
+]
+SACCADE_DTYPE = [
+    ('start', 'i8'), ('end', 'i8'), ('dur', 'i8'), ('start_x', 'f8'),
+    ('start_y', 'f8'), ('end_x', 'f8'), ('end_y', 'f8'), ('ampl', 'f8'),
+    ('peak_vel', 'f8'),
+]
+BLINK_DTYPE = [('start', 'i8'), ('end', 'i8'), ('dur', 'i8')]
+
+
+class TrialSegment(object):
+    """The span of an ASC file covering a single attempt at a trial.
+
+    Segments run from a trial's 'trial_start' marker up to the next one (or the
+    end of the file), so they include the feedback and inter-trial interval.
+    Recycled trials are run again with the same block and trial numbers, so each
+    attempt at a trial gets its own segment.
+
+    Attributes:
+        block (int): The block number of the trial.
+        trial (int): The trial number of the trial within the block.
+        attempt (int): The attempt number for the trial (starting from 0).
+        markers (dict): The tracker timestamp of each trial marker, by label.
+        recycled (str): The reason the trial was recycled, or None if the trial
+            was completed.
+        start (int): The byte offset of the segment within the file.
+        end (int): The byte offset of the end of the segment.
+
+    """
+    __slots__ = ['block', 'trial', 'attempt', 'markers', 'recycled', 'start', 'end']
+
+    def __init__(self, block, trial, attempt, start):
+        self.block = block
+        self.trial = trial
+        self.attempt = attempt
+        self.markers = {}
+        self.recycled = None
+        self.start = start
+        self.end = None
+
+    def __repr__(self):
+        s = "TrialSegment(block={0}, trial={1}, attempt={2}, recycled={3})"
+        return s.format(self.block, self.trial, self.attempt, repr(self.recycled))
+
+    @property
+    def completed(self):
+        return self.recycled is None
+
+
+class ASCIndex(object):
+    """A per-trial index of an EyeLink ASC file, built in a single pass.
+
+    Args:
+        path (str): The path of the ASC file to index.
+
+    Attributes:
+        segments (list): The :obj:`TrialSegment` for each trial attempt in the
+            file, in the order they were recorded.
+        eyes (list): The eyes recorded in the file (e.g. ['LEFT']), taken from
+            the first 'SAMPLES' line.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.segments = []
+        self.eyes = []
+        self._trials = {}
+        self._file = open(path, "rb")
+        self._build()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.segments)
+
+    def _build(self):
+        current = None
+        offset = 0
+        for line in self._file:
+            if line.startswith(b"MSG"):
+                m = MARKER_RE.match(line)
+                if m and m.group(2).decode('utf-8') in MARKERS:
+                    timestamp, label, reason, block, trial = m.groups()
+                    label = label.decode('utf-8')
+                    if label == 'trial_start' and block:
+                        if current:
+                            current.end = offset
+                        key = (int(block), int(trial))
+                        attempts = self._trials.setdefault(key, [])
+                        current = TrialSegment(key[0], key[1], len(attempts), offset)
+                        attempts.append(current)
+                        self.segments.append(current)
+                    if current:
+                        current.markers[label] = int(timestamp)
+                        if label == 'recycled':
+                            current.recycled = reason.decode('utf-8')
+            elif line.startswith(b"SAMPLES") and not self.eyes:
+                fields = line.split()
+                self.eyes = [e.decode() for e in (b"LEFT", b"RIGHT") if e in fields]
+            offset += len(line)
+        if current:
+            current.end = offset
+
+    def close(self):
+        self._file.close()
+
+    def get(self, block, trial, attempt=None):
+        """Gets the segment for a given trial.
+
+        Args:
+            block (int): The block number of the trial.
+            trial (int): The trial number of the trial.
+            attempt (int, optional): The attempt to get. Defaults to the last
+                attempt (i.e. the one that was completed, if any).
+
+        Returns:
+            :obj:`TrialSegment`: The segment for the trial, or None if the trial
+            isn't in the file.
+
+        """
+        attempts = self._trials.get((block, trial))
+        if not attempts:
+            return None
+        return attempts[-1 if attempt is None else attempt]
+
+    def _lines(self, segment):
+        self._file.seek(segment.start)
+        return self._file.read(segment.end - segment.start).split(b"\n")
+
+    def _window(self, segment, start, end):
+        # Converts marker labels to timestamps for limiting data to a window
+        t1 = segment.markers.get(start, -np.inf) if start else -np.inf
+        t2 = segment.markers.get(end, np.inf) if end else np.inf
+        return (t1, t2)
+
+    def samples(self, segment, start=None, end=None):
+        """Loads the gaze samples for a trial into a NumPy array.
+
+        Missing values (e.g. during blinks) are NaN. For monocular recordings
+        the fields are 'time', 'x', 'y' and 'pupil'; for binocular recordings
+        they are 'time', 'lx', 'ly', 'lpupil', 'rx', 'ry' and 'rpupil'.
+
+        Args:
+            segment (:obj:`TrialSegment`): The trial to load samples for.
+            start (str, optional): The label of the marker to start loading
+                samples from. Defaults to the start of the segment.
+            end (str, optional): The label of the marker to stop loading samples
+                at (exclusive). Defaults to the end of the segment.
+
+        Returns:
+            :obj:`numpy.ndarray`: A structured array of samples.
+
+        """
+        if len(self.eyes) == 2:
+            names = ['time', 'lx', 'ly', 'lpupil', 'rx', 'ry', 'rpupil']
+        else:
+            names = ['time', 'x', 'y', 'pupil']
+        ncol = len(names)
+        t1, t2 = self._window(segment, start, end)
+        rows = []
+        for line in self._lines(segment):
+            if not line[:1].isdigit():
+                continue
+            fields = line.split(None, ncol)[:ncol]
+            t = int(fields[0])
+            if t < t1 or t >= t2:
+                continue
+            rows.append(tuple(
+                [t] + [np.nan if f == b"." else float(f) for f in fields[1:]]
+            ))
+        dtype = [('time', 'i8')] + [(name, 'f8') for name in names[1:]]
+        return np.array(rows, dtype=dtype)
+
+    def events(self, segment, start=None, end=None):
+        """Loads the fixation, saccade, and blink events for a trial into NumPy
+        arrays.
+
+        Events are taken from their end lines (e.g. 'EFIX'), and are included if
+        they started within the requested window.
+
+        Args:
+            segment (:obj:`TrialSegment`): The trial to load events for.
+            start (str, optional): The label of the marker to start loading
+                events from. Defaults to the start of the segment.
+            end (str, optional): The label of the marker to stop loading events
+                at (exclusive). Defaults to the end of the segment.
+
+        Returns:
+            dict: Structured arrays of 'fixations', 'saccades', and 'blinks'. If
+            both eyes were recorded, each event includes an 'eye' field.
+
+        """
+        layouts = {
+            b"EFIX": ('fixations', FIXATION_DTYPE),
+            b"ESACC": ('saccades', SACCADE_DTYPE),
+            b"EBLINK": ('blinks', BLINK_DTYPE),
+        }
+        binocular = len(self.eyes) == 2
+        t1, t2 = self._window(segment, start, end)
+        rows = {name: [] for name, _ in layouts.values()}
+        for line in self._lines(segment):
+            if not line.startswith(b"E"):
+                continue
+            fields = line.split()
+            if fields[0] not in layouts:
+                continue
+            name, dtype = layouts[fields[0]]
+            t = int(fields[2])
+            if t < t1 or t >= t2:
+                continue
+            values = [np.nan if f == b"." else float(f) for f in fields[2:]]
+            values = values[:len(dtype)]
+            if binocular:
+                values.append(fields[1].decode('utf-8'))
+            rows[name].append(tuple(values))
+        out = {}
+        for name, dtype in layouts.values():
+            if binocular:
+                dtype = dtype + [('eye', 'U1')]
+            out[name] = np.array(rows[name], dtype=dtype)
+        return out
+
+
+def join_trials(index, db_path, participant_id, table="trials"):
+    """Pairs the rows of a participant's trial data with their ASC segments.
+
+    Args:
+        index (:obj:`ASCIndex`): The index of the participant's ASC file.
+        db_path (str): The path of the experiment database.
+        participant_id (int): The database ID of the participant.
+        table (str, optional): The table of trial data to join. Defaults to
+            'trials'.
+
+    Returns:
+        list: A (row, segment) tuple for each trial in the table, where row is a
+        dict of column values and segment is the trial's completed
+        :obj:`TrialSegment` (or None if it isn't in the file).
+
+    """
+    db = sqlite3.connect(db_path)
+    db.row_factory = sqlite3.Row
+    try:
+        q = "SELECT * FROM {0} WHERE participant_id = ? ORDER BY id".format(table)
+        rows = [dict(row) for row in db.execute(q, (participant_id,))]
+    finally:
+        db.close()
+    joined = []
+    for row in rows:
+        seg = index.get(int(row['block_num']), int(row['trial_num']))
+        joined.append((row, seg if seg and seg.completed else None))
+    return joined
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("path", help="the ASC file to index")
+    opts = parser.parse_args()
+
+    with ASCIndex(opts.path) as asc:
+        cols = ["block", "trial", "attempt"] + MARKERS
+        print("\t".join(cols))
+        for seg in asc.segments:
+            line = [seg.block, seg.trial, seg.attempt]
+            line += [seg.markers.get(label, "NA") for label in MARKERS[:-1]]
+            line.append(seg.recycled if seg.recycled else "NA")
+            print("\t".join([str(x) for x in line]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Micro-benchmarks for the per-trial hot paths of ExoInstructions.
+
+Each benchmark runs a single piece of the experiment's trial loop in isolation
+using the headless stand-in backends (see headless.py), so results reflect the
+experiment's own per-trial overhead rather than the speed of the display or
+eye tracker. Stimuli and text are rendered offscreen by KLibs as they are in a
+real session (only drawing to the screen and input are stubbed out), unless
+--no-render is given. Results are saved as JSON so runs can be compared over time
+(e.g. across KLibs versions).
+
+Example:
+
+    python tools/bench.py
+    python tools/bench.py --compare ExpAssets/Local/benchmarks/<previous>.json
+
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+
+import numpy as np
+
+import klibs
+from klibs import P
+
+from headless import (
+    ROOT, SimClock, SimParticipant, SimEyeTracker, HeadlessBackend,
+    HeadlessExperiment, install, init_text, load_params, init_database,
+    add_participant,
+)
+from klibs_wip import block_to_str
+from text_cache import cached_message, cache_info
+
+CONDITIONS = ["I-A", "I-B", "NI-A", "NI-B"]
+RESULTS_DIR = os.path.join(ROOT, "ExpAssets", "Local", "benchmarks")
+
+
+def bench(name, func, n, warmup=None):
+    """Times repeated calls of a function, returning throughput and latencies.
+
+    Args:
+        name (str): The name of the benchmark.
+        func (callable): The function to benchmark.
+        n (int): The number of timed calls to make.
+        warmup (int, optional): The number of untimed calls to make first.
+            Defaults to 10% of n.
+
+    Returns:
+        dict: The number of calls, calls per second, and p50/p99/max latency
+        (in microseconds).
+
+    """
+    warmup = max(1, n // 10) if warmup is None else warmup
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    total = sum(times)
+    return {
+        'name': name,
+        'n': n,
+        'per_sec': n / total if total > 0 else float('inf'),
+        'p50_us': times[int(0.50 * (n - 1))] * 1e6,
+        'p99_us': times[int(0.99 * (n - 1))] * 1e6,
+        'max_us': times[-1] * 1e6,
+    }
+
+
+def _init_experiment(workdir, condition, render=True):
+    # Sets up a headless experiment with a tracker that never breaks fixation
+    load_params(workdir)
+    if render:
+        init_text()
+    init_database(P.database_path)
+    clock = SimClock()
+    rng = random.Random(0)
+    tracker = SimEyeTracker(clock, rng, break_rate=0, blink_rate=0)
+    backend = HeadlessBackend(clock, SimParticipant(rng, anticipation=0), tracker)
+    install(backend, render=render)
+
+    P.condition = condition
+    P.random_seed = 0
+    P.participant_id = add_participant(P.database_path, "bench")
+    sys.modules.pop('exp_structure', None)
+    exp = HeadlessExperiment(tracker, backend.evm)
+    exp.setup()
+    return exp
+
+
+def _start_trial(exp, trial):
+    # Puts the experiment into the state it's in at the start of trial()
+    for factor, value in trial.items():
+        setattr(exp, factor, value)
+    P.block_number, P.trial_number, P.practicing = (1, 1, False)
+    exp.block_type = "rt"
+    exp.scheduler.start_block(1, exp.block_type, False)
+    exp.trial_prep()
+    exp.evm.start_clock()
+    P.in_trial = True
+
+
+def _startup_results(report):
+    # Gets the time to first screen and the time taken by each phase of the
+    # experiment's setup (from a single run), in the same format as the other
+    # benchmark results so they can be compared across runs
+    results = []
+    for phase in report:
+        if phase['phase'] == "first_screen":
+            name, us = ("startup[time_to_first_screen]", phase['start'] * 1000.0)
+        else:
+            name, us = ("startup[{0}]".format(phase['phase']), phase['duration'] * 1000.0)
+        results.append({
+            'name': name, 'n': 1, 'per_sec': 1e6 / us if us > 0 else float('inf'),
+            'p50_us': us, 'p99_us': us, 'max_us': us,
+        })
+    return results
+
+
+def run_benchmarks(n, condition="NI-A", render=True):
+    """Runs the full benchmark suite, returning a list of results."""
+    workdir = tempfile.mkdtemp(prefix="exo_bench_")
+    exp = _init_experiment(workdir, condition, render)
+    results = _startup_results(exp.startup.finish())
+
+    # Finish any deferred setup work (e.g. pre-rendering RT feedback text), as
+    # happens during the first few trials of a session
+    exp.idle.run_all()
+
+    # Drawing the trial display for each cached layout
+    for (cue_loc, target_loc, target) in sorted(exp.frames.keys(), key=str):
+        target_str = "{0}@{1}".format(target, target_loc) if target_loc else None
+        name = "draw_screen[cue={0},target={1}]".format(cue_loc, target_str)
+        layout = (cue_loc, target_loc, target)
+        results.append(bench(name, lambda l=layout: exp.draw_screen(*l), n // 10))
+
+    # Rendering feedback text (from the text cache)
+    rts = [str(rt) for rt in range(200, 1200)]
+    i = [0]
+    def rt_feedback():
+        i[0] = (i[0] + 1) % len(rts)
+        cached_message(rts[i[0]], style='feedback')
+    results.append(bench("message[rt feedback]", rt_feedback, n))
+    for msg in ("Too slow!", "Blinked!", "Looked away!"):
+        results.append(bench(
+            "message[{0}]".format(msg), lambda m=msg: cached_message(m, style='err'), n
+        ))
+
+    # One iteration of the pre-target fixation/anticipation check loop, and of
+    # the checks in the response loop (aside from keypresses)
+    trial = exp.checkpoint.structure['blocks'][-1]['trials'][0]
+    _start_trial(exp, trial)
+    def check_loop():
+        exp.check_fixation()
+        exp.check_anticipatory()
+        exp.drift.add_sample(exp.el.gaze())
+    results.append(bench("check_fixation+check_anticipatory", check_loop, n))
+    exp.target_off = True
+    def response_checks():
+        exp.update_target()
+        exp.check_response_gaze()
+    results.append(bench("update_target+check_response_gaze", response_checks, n))
+    P.in_trial = False
+
+    # Checking a batch of gaze samples for fixation breaks & blinks, for a single
+    # sample (as with mouse simulation) and a frame's worth of 1000 Hz samples
+    for size in (1, 17):
+        times = np.arange(size, dtype=np.float64)
+        xy = np.random.default_rng(0).normal(P.screen_c, 3, (size, 2))
+        results.append(bench(
+            "FixationDetector.check[{0} samples]".format(size),
+            lambda t=times, g=xy: exp.fix_detector.check(t, g), n
+        ))
+    exp.evm.stop_clock()
+    exp.trial_log.commit()
+
+    # Generating trials for each condition
+    for cond in CONDITIONS:
+        P.condition = cond
+        sys.modules.pop('exp_structure', None)
+        from exp_structure import structure
+        block = structure[-1]
+        results.append(bench(
+            "Block.get_trials[{0}]".format(cond), block.get_trials, n // 10
+        ))
+        results.append(bench(
+            "generate_trials[{0}]".format(cond), exp.generate_trials,
+            max(10, n // 1000)
+        ))
+    trials = block.get_trials().tolist()
+    results.append(bench(
+        "block_to_str", lambda: block_to_str(block, trials, 1), n // 10
+    ))
+
+    exp.trial_log.close()
+    exp.eye_log.close()
+    return results
+
+
+def _print_results(results, previous=None):
+    prev = {r['name']: r for r in previous} if previous else {}
+    header = "{0:<46} {1:>12} {2:>10} {3:>10}".format(
+        "benchmark", "calls/s", "p50 (us)", "p99 (us)"
+    )
+    if prev:
+        header += " {0:>9}".format("p50 chg")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        line = "{0:<46} {1:>12.0f} {2:>10.2f} {3:>10.2f}".format(
+            r['name'], r['per_sec'], r['p50_us'], r['p99_us']
+        )
+        if r['name'] in prev and prev[r['name']]['p50_us'] > 0:
+            change = r['p50_us'] / prev[r['name']]['p50_us'] - 1
+            line += " {0:>+8.1%}".format(change)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-n", type=int, default=10000,
+                        help="number of timed calls for the fast benchmarks")
+    parser.add_argument("--compare", default=None,
+                        help="a previous results file to compare against")
+    parser.add_argument("--no-render", action="store_true",
+                        help="stub out rendering of stimuli and text as well")
+    parser.add_argument("--no-save", action="store_true")
+    opts = parser.parse_args()
+
+    results = run_benchmarks(opts.n, render=not opts.no_render)
+    previous = None
+    if opts.compare:
+        with open(opts.compare, "r") as f:
+            previous = json.load(f)['results']
+    _print_results(results, previous)
+
+    if not opts.no_save:
+        if not os.path.isdir(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+        stamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+        out_path = os.path.join(RESULTS_DIR, "bench_{0}.json".format(stamp))
+        with open(out_path, "w") as f:
+            json.dump({
+                'created': stamp,
+                'klibs_version': getattr(klibs, '__version__', "unknown"),
+                'python_version': platform.python_version(),
+                'rendered': not opts.no_render,
+                'platform': platform.platform(),
+                'text_cache': cache_info(),
+                'results': results,
+            }, f, indent=2)
+        print("\nResults saved to {0}".format(out_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""Exports trial data for all participants in one pass, with condition summaries.
+
+An alternative to 'klibs export' for large numbers of participants: the trials
+table is read from the database once and split by participant, and a
+tab-separated file is written for each participant. In the same pass, all
+trials are written to a single typed columnar file (a NumPy .npz archive with
+one array per column) and summary tables of RT, accuracy, and error rates by
+condition, instructions, and cue validity are computed with vectorized
+group-bys (no re-parsing of the exported files).
+
+The per-participant files use the same columns as 'klibs export' (participant
+info, then trial data, then any 'append_info_cols'), but aren't guaranteed to
+match its file names and layout exactly, so they're written to their own
+folder (ExpAssets/Data/export by default) rather than alongside its output.
+
+Example:
+
+    python tools/export.py
+
+"""
+import os
+import time
+import socket
+import sqlite3
+import argparse
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DIR = os.path.join(ROOT, "ExpAssets", "Config")
+
+SUMMARY_FACTORS = ["condition", "instructions", "cue_validity"]
+ERR_TYPES = ["timeout", "looked_away", "blinked"]
+
+
+def load_params():
+    """Loads the data export settings from the project's params file."""
+    params = {}
+    with open(os.path.join(CONFIG_DIR, "ExoInstructions_params.py"), "r") as f:
+        exec(f.read(), params)
+    return params
+
+
+def read_table(db, table, order_by="id"):
+    """Reads a database table, returning its column names and rows."""
+    cursor = db.execute("SELECT * FROM {0} ORDER BY {1}".format(table, order_by))
+    cols = [d[0] for d in cursor.description]
+    return (cols, cursor.fetchall())
+
+
+def to_column(values):
+    """Converts a list of database values to a typed NumPy array.
+
+    Columns where every value is an integer become int64 arrays, columns where
+    every value is a number or 'NA' become float64 arrays (with NaN for 'NA'),
+    and all other columns become arrays of strings.
+
+    """
+    values = ["NA" if v is None else v for v in values]
+    try:
+        if all(isinstance(v, int) or (isinstance(v, str) and v.lstrip("-").isdigit())
+               for v in values):
+            return np.array([int(v) for v in values], dtype=np.int64)
+        return np.array(
+            [np.nan if v == "NA" else float(v) for v in values], dtype=np.float64
+        )
+    except ValueError:
+        return np.array([str(v) for v in values])
+
+
+def _write_participant(path, header, rows):
+    # Writes a single participant's data to a tab-separated file
+    with open(path, "w") as f:
+        f.write("\t".join(header) + "\n")
+        for row in rows:
+            f.write("\t".join(["NA" if v is None else str(v) for v in row]) + "\n")
+    return path
+
+
+def _info_columns(db, cols, p_cols):
+    # Gets the values of the extra info columns to append to each participant's
+    # data, from the participants table or else KLibs' session_info table (from
+    # the participant's first session). Columns in neither (e.g. in databases
+    # from tools/simulate.py, which have no session_info) are exported as NA.
+    info = {}
+    tables = [r[0] for r in db.execute("SELECT name FROM sqlite_master")]
+    s_cols, s_rows = ([], [])
+    if "session_info" in tables:
+        s_cols, s_rows = read_table(db, "session_info")
+    for col in cols:
+        if col in p_cols:
+            continue
+        info[col] = {}
+        if col in s_cols:
+            pid_col, val_col = (s_cols.index("participant_id"), s_cols.index(col))
+            for row in s_rows:
+                info[col].setdefault(row[pid_col], row[val_col])
+    return info
+
+
+def group_by(columns, keys, mask=None):
+    """Groups rows by the unique combinations of values in a set of columns.
+
+    Args:
+        columns (dict): The data to group, as a dict of equal-length arrays.
+        keys (list): The names of the columns to group by.
+        mask (:obj:`numpy.ndarray`, optional): A boolean array of the rows to
+            include. Defaults to all rows.
+
+    Returns:
+        tuple: A dict of the key column values for each group, an array of the
+        group index for each included row, and the mask of included rows.
+
+    """
+    n = len(columns[keys[0]])
+    mask = np.ones(n, dtype=bool) if mask is None else mask
+    codes = []
+    levels = {}
+    for key in keys:
+        uniq, inverse = np.unique(columns[key][mask], return_inverse=True)
+        levels[key] = uniq
+        codes.append(inverse)
+    combined = np.ravel_multi_index(codes, [len(levels[k]) for k in keys])
+    uniq_groups, group_idx = np.unique(combined, return_inverse=True)
+    unraveled = np.unravel_index(uniq_groups, [len(levels[k]) for k in keys])
+    group_vals = {k: levels[k][idx] for k, idx in zip(keys, unraveled)}
+    return (group_vals, group_idx, mask)
+
+
+def _group_mean(values, group_idx, n_groups):
+    # Gets the mean of the non-NaN values in each group
+    valid = ~np.isnan(values)
+    sums = np.bincount(group_idx[valid], values[valid], minlength=n_groups)
+    counts = np.bincount(group_idx[valid], minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def summarize(columns, id_col):
+    """Computes participant- and condition-level summaries of the trial data.
+
+    Practice trials are excluded. Mean RTs are for correct responses only, and
+    accuracy is the proportion correct of trials with a response. Error rates
+    are the proportion of all trials ending with each type of error.
+
+    Args:
+        columns (dict): The trial data, as a dict of typed column arrays.
+        id_col (str): The name of the participant ID column.
+
+    Returns:
+        tuple: The participant-level and condition-level summaries, each as a
+        (header, rows) tuple.
+
+    """
+    keep = columns['practice'] == 0
+    keys = [id_col] + SUMMARY_FACTORS
+    groups, idx, mask = group_by(columns, keys, keep)
+    n_groups = len(groups[id_col])
+
+    rt = columns['rt'][mask].astype(np.float64)
+    acc = columns['accuracy'][mask].astype(np.float64)
+    err = columns['err'][mask].astype(str)
+    correct_rt = np.where(acc == 1, rt, np.nan)
+    stats = {
+        'n_trials': np.bincount(idx, minlength=n_groups),
+        'mean_rt': _group_mean(correct_rt, idx, n_groups),
+        'accuracy': _group_mean(acc, idx, n_groups),
+    }
+    for e in ERR_TYPES:
+        stats[e + '_rate'] = _group_mean((err == e).astype(float), idx, n_groups)
+    stat_names = list(stats.keys())
+
+    p_header = keys + stat_names
+    p_rows = list(zip(*([groups[k] for k in keys] + [stats[s] for s in stat_names])))
+
+    # Average the participant-level summaries within each condition cell
+    p_cols = {k: groups[k] for k in keys}
+    p_cols.update(stats)
+    cells, cell_idx, _ = group_by(p_cols, SUMMARY_FACTORS)
+    n_cells = len(cells[SUMMARY_FACTORS[0]])
+    cell_stats = [np.bincount(cell_idx, minlength=n_cells)]
+    for s in stat_names:
+        cell_stats.append(_group_mean(stats[s].astype(np.float64), cell_idx, n_cells))
+    c_header = SUMMARY_FACTORS + ['n_participants'] + stat_names
+    c_rows = list(zip(*([cells[k] for k in SUMMARY_FACTORS] + cell_stats)))
+    return ((p_header, p_rows), (c_header, c_rows))
+
+
+def _write_summary(path, header, rows):
+    with open(path, "w") as f:
+        f.write("\t".join(header) + "\n")
+        for row in rows:
+            vals = []
+            for v in row:
+                if isinstance(v, (float, np.floating)):
+                    vals.append("NA" if np.isnan(v) else "{0:.4f}".format(v))
+                else:
+                    vals.append(str(v))
+            f.write("\t".join(vals) + "\n")
+
+
+def export(db_path, outdir):
+    """Exports the trial data for all participants in a database.
+
+    Args:
+        db_path (str): The path of the experiment database.
+        outdir (str): The folder to write the exported files to.
+
+    Returns:
+        dict: The paths of the files written.
+
+    """
+    params = load_params()
+    table = params.get('primary_table', "trials")
+    id_field = params.get('unique_identifier', "userhash")
+    exclude = params.get('exclude_data_cols', [])
+    ext = params.get('datafile_ext', ".txt")
+    append_cols = params.get('append_info_cols', [])
+    hostname = "_" + socket.gethostname() if params.get('append_hostname') else ""
+
+    db = sqlite3.connect(db_path)
+    try:
+        p_cols, p_rows = read_table(db, "participants")
+        t_cols, t_rows = read_table(db, table, order_by="participant_id, id")
+        extra_info = _info_columns(db, append_cols, p_cols)
+    finally:
+        db.close()
+
+    # Build the header for the exported files, with participant info first
+    p_info = [c for c in p_cols if c != "id" and c not in exclude]
+    p_info.remove(id_field)
+    p_info.insert(0, id_field)
+    p_index = [p_cols.index(c) for c in p_info]
+    t_info = [c for c in t_cols if c not in ("id", "participant_id") + tuple(exclude)]
+    t_index = [t_cols.index(c) for c in t_info]
+    header = p_info + t_info + append_cols
+
+    # Split the trials by participant and write each participant's file
+    participants = {row[0]: row for row in p_rows}
+    pid_col = t_cols.index("participant_id")
+    by_participant = {}
+    for row in t_rows:
+        by_participant.setdefault(row[pid_col], []).append(row)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    paths = []
+    for pid, rows in by_participant.items():
+        info = [participants[pid][i] for i in p_index]
+        appended = [
+            extra_info[c].get(pid) if c in extra_info
+            else participants[pid][p_cols.index(c)] for c in append_cols
+        ]
+        created = str(participants[pid][p_cols.index("created")])[:10]
+        fname = "p{0}_{1}{2}{3}".format(pid, created, hostname, ext)
+        out_rows = [info + [row[i] for i in t_index] + appended for row in rows]
+        paths.append(_write_participant(os.path.join(outdir, fname), header, out_rows))
+
+    # Write all trials to a single typed columnar file
+    columns = {}
+    id_values = {pid: participants[pid][p_cols.index(id_field)] for pid in participants}
+    columns[id_field] = np.array([str(id_values[row[pid_col]]) for row in t_rows])
+    for i, col in zip(t_index, t_info):
+        columns[col] = to_column([row[i] for row in t_rows])
+    npz_path = os.path.join(outdir, "{0}.npz".format(table))
+    np.savez_compressed(npz_path, **columns)
+
+    # Compute and write the summary tables
+    written = {'participants': paths, 'columnar': npz_path}
+    if t_rows:
+        p_summary, c_summary = summarize(columns, id_field)
+        for name, (s_header, s_rows) in [("participants", p_summary),
+                                         ("conditions", c_summary)]:
+            path = os.path.join(outdir, "summary_{0}{1}".format(name, ext))
+            _write_summary(path, s_header, s_rows)
+            written['summary_' + name] = path
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--db", default=None,
+                        help="the database to export (default: the project database)")
+    parser.add_argument("--outdir", default=None,
+                        help="the folder to export to (default: ExpAssets/Data/export)")
+    opts = parser.parse_args()
+
+    db_path = opts.db or os.path.join(ROOT, "ExpAssets", "ExoInstructions.db")
+    outdir = opts.outdir or os.path.join(ROOT, "ExpAssets", "Data", "export")
+    start = time.time()
+    written = export(db_path, outdir)
+    print("Exported data for {0} participants in {1:.1f} s".format(
+        len(written['participants']), time.time() - start
+    ))
+    print("Files written to: {0}".format(outdir))
+
+
+if __name__ == "__main__":
+    main()
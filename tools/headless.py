@@ -0,0 +1,564 @@
+"""Null graphics, input, and eye tracker backends for running ExoInstructions
+headlessly on a simulated clock.
+
+These replace the display, keyboard, and tracker functions used by the
+experiment (as imported into experiment.py and its helper modules) with
+stand-ins driven by a synthetic participant and eye tracker, so that the full
+trial loop can be run much faster than real time on machines with no display
+or hardware attached. KLibs itself still needs to be installed.
+
+"""
+import os
+import sys
+import math
+import time
+import sqlite3
+from types import SimpleNamespace
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CODE_DIR = os.path.join(ROOT, "ExpAssets", "Resources", "code")
+CONFIG_DIR = os.path.join(ROOT, "ExpAssets", "Config")
+for _path in (ROOT, CODE_DIR):
+    if not _path in sys.path:
+        sys.path.insert(0, _path)
+
+import klibs
+from sdl2 import sdlttf
+from klibs import P, env
+from klibs import KLCommunication
+from klibs.KLText import TextManager
+from klibs.KLConstants import EL_BLINK_START, EL_BLINK_END, EL_SACCADE_START
+from klibs.KLExceptions import TrialException
+
+import experiment
+import polling
+import drift
+import idle
+import text_cache
+import demo_screens
+import scheduler
+
+
+# Simulated time
+
+class SimClock(object):
+    """A simulated clock that only moves forward when told to.
+
+    Every read of the clock advances it by a small tick, so that busy-wait loops
+    polling the clock always make progress.
+
+    """
+    def __init__(self, tick=0.00001):
+        self.now = 0.0
+        self.tick = tick
+
+    def time(self):
+        self.now += self.tick
+        return self.now
+
+    def sleep(self, secs):
+        if secs > 0:
+            self.now += secs
+
+    def wait_for_refresh(self, refresh_time):
+        # Advances the clock to the start of the next simulated screen refresh
+        refresh = refresh_time / 1000.0
+        self.now = (math.floor(self.now / refresh) + 1) * refresh
+
+
+class SimCountDown(object):
+
+    clock = None
+
+    def __init__(self, duration):
+        self.duration = duration
+        self._start = self.clock.time()
+
+    def remaining(self):
+        return max(0.0, self.duration - (self.clock.time() - self._start))
+
+    def counting(self):
+        return self.remaining() > 0
+
+
+class SimEventManager(object):
+    """Stand-in for the KLibs EventManager using a simulated clock."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.events = {}
+        self._start = None
+
+    def add_event(self, label, onset, after=None):
+        if after:
+            onset += self.events[after]
+        self.events[label] = onset
+
+    def start_clock(self):
+        self._start = self.clock.time()
+
+    def stop_clock(self):
+        self._start = None
+        self.events = {}
+
+    @property
+    def trial_time_ms(self):
+        if self._start is None:
+            return 0.0
+        return (self.clock.time() - self._start) * 1000.0
+
+    def before(self, label):
+        return self.trial_time_ms < self.events[label]
+
+    def after(self, label):
+        return self.trial_time_ms >= self.events[label]
+
+
+# Null graphics
+
+class NullSurface(object):
+    """Stand-in for rendered text, shapes, and NumpySurfaces."""
+
+    def __init__(self, content=None, width=None, height=None, fill=None, **kwargs):
+        self.width = width if width else getattr(content, 'width', 1)
+        self.height = height if height else getattr(content, 'height', 1)
+        self.stroke = None
+
+    @property
+    def surface_width(self):
+        return self.width
+
+    @property
+    def surface_height(self):
+        return self.height
+
+    def blit(self, *args, **kwargs):
+        pass
+
+    def render(self):
+        return None
+
+    def trim(self):
+        return self
+
+
+def null_shape(size, *args, **kwargs):
+    width, height = size if isinstance(size, (list, tuple)) else (size, size)
+    return NullSurface(width=width, height=height)
+
+
+def null_message(text, style=None, location=None, **kwargs):
+    return NullSurface(width=max(1, 10 * len(str(text))), height=20)
+
+
+# Synthetic participant and input
+
+class SimKeyEvent(object):
+    """A simulated keypress event, with its SDL-style timestamp in ms."""
+
+    def __init__(self, key, timestamp):
+        self.key = key
+        self.timestamp = timestamp
+
+
+class SimParticipant(object):
+    """A synthetic participant with configurable RT and accuracy distributions.
+
+    Args:
+        rng (:obj:`random.Random`): The random number generator to use.
+        rt_mean (dict, optional): The mean RT (in ms) for each instruction type.
+        rt_sd (float, optional): The standard deviation of RTs (in ms).
+        accuracy (dict, optional): The proportion of correct responses for each
+            instruction type.
+        anticipation (float, optional): The proportion of trials on which the
+            participant responds before the target appears.
+
+    """
+    def __init__(self, rng, rt_mean=None, rt_sd=120.0, accuracy=None,
+                 anticipation=0.01):
+        self.rng = rng
+        self.rt_mean = rt_mean if rt_mean else {'acc': 650.0, 'rt': 480.0}
+        self.rt_sd = rt_sd
+        self.accuracy = accuracy if accuracy else {'acc': 0.95, 'rt': 0.85}
+        self.anticipation = anticipation
+        self.anticipate_at = None
+        self.response = None
+
+    def plan_trial(self, instructions, target, cue_onset):
+        """Decides how the participant will respond on the upcoming trial."""
+        self.anticipate_at = None
+        if self.rng.random() < self.anticipation:
+            self.anticipate_at = self.rng.uniform(200, cue_onset + 300)
+        correct = self.rng.random() < self.accuracy[instructions]
+        key = target if correct else ('F' if target == 'T' else 'T')
+        rt = max(120.0, self.rng.gauss(self.rt_mean[instructions], self.rt_sd))
+        self.response = (key, rt)
+
+
+# Synthetic eye tracker
+
+class SimEyeTracker(object):
+    """A synthetic eye tracker that emits fixation breaks and blinks.
+
+    Args:
+        clock (:obj:`SimClock`): The simulated clock.
+        rng (:obj:`random.Random`): The random number generator to use.
+        break_rate (float, optional): Fixation breaks per second of trial time.
+        blink_rate (float, optional): Blinks per second of trial time.
+        drift_rate (float, optional): How quickly gaze drifts away from the
+            fixation point between drift corrections (in px per trial).
+
+    """
+    version = "SimTracker 1.0"
+
+    def __init__(self, clock, rng, break_rate=0.05, blink_rate=0.1, drift_rate=2.0):
+        self.clock = clock
+        self.rng = rng
+        self.break_rate = break_rate
+        self.blink_rate = blink_rate
+        self.drift_rate = drift_rate
+        self.drift = [0.0, 0.0]
+        self.drift_corrections = 0
+        self.markers = []
+        self._np_rng = np.random.default_rng(rng.getrandbits(32))
+        self._breaks = []
+        self._blinks = []
+        self._last_poll = None
+
+    @property
+    def edf_filename(self):
+        return "p{0}_sim.EDF".format(P.participant_id)
+
+    def add_boundary(self, boundary):
+        pass
+
+    def setOfflineMode(self):
+        pass
+
+    def closeDataFile(self):
+        pass
+
+    def receiveDataFile(self, src, dest):
+        # Writes the simulated markers as a stand-in for a real EDF
+        with open(dest, "w") as f:
+            for timestamp, msg in self.markers:
+                f.write("MSG\t{0} {1}\n".format(timestamp, msg))
+
+    def write(self, msg):
+        self.markers.append((self.now(), msg))
+
+    def now(self):
+        return int(self.clock.now * 1000)
+
+    def drift_correct(self, *args, **kwargs):
+        # Simulates the participant fixating and pressing space to start the trial
+        self.clock.sleep(self.rng.uniform(0.4, 1.2))
+        self.drift = [0.0, 0.0]
+        self.drift_corrections += 1
+
+    def gaze(self):
+        return (
+            P.screen_c[0] + self.drift[0] + self.rng.gauss(0, 3),
+            P.screen_c[1] + self.drift[1] + self.rng.gauss(0, 3),
+        )
+
+    def drain_link(self, el=None):
+        # Generates the 1000 Hz gaze samples and the events since the last poll.
+        # Fixation breaks move gaze outside the fixation boundary for a while,
+        # and blinks drop samples.
+        now = self.now()
+        events = []
+        times = np.zeros(0)
+        if P.in_trial and self._last_poll is not None:
+            times = np.arange(self._last_poll + 1, now + 1, dtype=np.float64)
+            dt = (now - self._last_poll) / 1000.0
+            if self.rng.random() < 1 - math.exp(-self.break_rate * dt):
+                start = self.rng.uniform(self._last_poll, now)
+                self._breaks.append((start, start + self.rng.uniform(150, 400)))
+                events.append((EL_SACCADE_START, start / 1000.0))
+            if self.rng.random() < 1 - math.exp(-self.blink_rate * dt):
+                start = self.rng.uniform(self._last_poll, now)
+                end = start + self.rng.uniform(80, 200)
+                self._blinks.append((start, end))
+                events.append((EL_BLINK_START, start / 1000.0))
+                events.append((EL_BLINK_END, end / 1000.0))
+        else:
+            self._breaks, self._blinks = ([], [])
+        self._last_poll = now if P.in_trial else None
+        xy = self._np_rng.normal(0, 3, (len(times), 2))
+        xy += (P.screen_c[0] + self.drift[0], P.screen_c[1] + self.drift[1])
+        for start, end in self._breaks:
+            xy[(times >= start) & (times < end)] += 3 * P.ppd
+        for start, end in self._blinks:
+            xy[(times >= start) & (times < end)] = np.nan
+        self._breaks = [(s, e) for s, e in self._breaks if e > now]
+        self._blinks = [(s, e) for s, e in self._blinks if e > now]
+        return (events, times, xy)
+
+    def get_event_type(self, e):
+        return e[0]
+
+    def get_event_timestamp(self, e, *args):
+        return int(e[1] * 1000)
+
+    def new_trial(self):
+        # Gaze drifts a little further from fixation every trial
+        angle = self.rng.uniform(0, 2 * math.pi)
+        self.drift[0] += self.drift_rate * math.cos(angle)
+        self.drift[1] += self.drift_rate * math.sin(angle)
+
+
+# Headless backend setup
+
+class HeadlessBackend(object):
+    """The simulated clock, participant, and tracker for a headless session."""
+
+    def __init__(self, clock, participant, tracker):
+        self.clock = clock
+        self.participant = participant
+        self.tracker = tracker
+        self.evm = SimEventManager(clock)
+
+    def pump(self):
+        # Outside of trials, the participant presses the keys needed to get
+        # through instructions and mapping practice (and declines resuming old
+        # sessions). During trials, they press keys too early if planned, and
+        # otherwise respond once their RT has elapsed after the target onset.
+        t = self.ticks()
+        if not P.in_trial:
+            return [SimKeyEvent(key, t) for key in ('space', 'T', 'F', 'N')]
+        trial_time = self.evm.trial_time_ms
+        anticipate_at = self.participant.anticipate_at
+        if anticipate_at is not None:
+            if trial_time >= anticipate_at:
+                self.participant.anticipate_at = None
+                return [SimKeyEvent(self.participant.response[0], t)]
+        if 'target_on' in self.evm.events and self.participant.response:
+            key, rt = self.participant.response
+            if trial_time >= self.evm.events['target_on'] + rt:
+                # Timestamp the keypress when it happened, not when it was pumped
+                self.participant.response = None
+                pressed_at = t - int(trial_time - self.evm.events['target_on'] - rt)
+                return [SimKeyEvent(key, pressed_at)]
+        return []
+
+    def ticks(self):
+        return int(self.clock.now * 1000)
+
+    def keypresses(self, queue):
+        return [(e.key.upper(), e.timestamp) for e in queue]
+
+    def key_pressed(self, key, queue=None):
+        return any(e.key == key for e in (queue if queue is not None else []))
+
+    def flip(self):
+        self.clock.wait_for_refresh(P.refresh_time)
+
+    def smart_sleep(self, ms):
+        self.clock.sleep(ms / 1000.0)
+
+    def ui_request(self, *args, **kwargs):
+        # Stands in for the time taken to check for quit/calibration requests
+        self.clock.sleep(0.001)
+
+
+def install(backend, render=False):
+    """Replaces the display, input, and timing functions used by the experiment
+    with headless stand-ins driven by the given backend.
+
+    Args:
+        backend (:obj:`HeadlessBackend`): The backend to drive the experiment.
+        render (bool, optional): If True, stimuli and text are still rendered
+            offscreen by KLibs (as NumpySurfaces) and only drawing them to the
+            screen is stubbed out. Requires KLibs' text renderer to be set up
+            first (see :func:`init_text`). Defaults to False.
+
+    """
+    clock = backend.clock
+    SimCountDown.clock = clock
+    kld = SimpleNamespace(
+        Rectangle=null_shape, Ellipse=null_shape, FixationCross=null_shape
+    )
+    replacements = {
+        'fill': lambda *args, **kwargs: None,
+        'blit': lambda *args, **kwargs: None,
+        'flip': backend.flip,
+        'pump': backend.pump,
+        'key_pressed': backend.key_pressed,
+        'any_key': lambda *args, **kwargs: None,
+        'ui_request': backend.ui_request,
+        'smart_sleep': backend.smart_sleep,
+        'CountDown': SimCountDown,
+        'keypresses': backend.keypresses,
+        'SDL_GetTicks': backend.ticks,
+        'deg_to_px': lambda deg: int(round(deg * P.ppd)),
+        'drain_link': backend.tracker.drain_link,
+    }
+    modules = [experiment, demo_screens]
+    if render:
+        # KLibs draws text passed a location to the screen itself
+        modules.append(KLCommunication)
+    else:
+        replacements.update({
+            'NumpySurface': NullSurface,
+            'kld': kld,
+            'add_text_style': lambda *args, **kwargs: None,
+            'message': null_message,
+        })
+        text_cache.message = null_message
+    for module in modules:
+        for name, value in replacements.items():
+            if hasattr(module, name):
+                setattr(module, name, value)
+    polling.time = clock
+    polling.precise_time = clock.time
+    drift.precise_time = clock.time
+    idle.precise_time = clock.time
+    demo_screens.time = clock
+    demo_screens.precise_time = clock.time
+    scheduler.precise_time = clock.time
+    experiment.precise_time = clock.time
+
+
+def init_text():
+    """Sets up KLibs' text renderer without opening a window, so that text can
+    be rendered offscreen. Must be called after :func:`load_params`.
+
+    """
+    sdlttf.TTF_Init()
+    P.font_dirs = [
+        os.path.join(ROOT, "ExpAssets", "Resources", "font"),
+        os.path.join(os.path.dirname(klibs.__file__), "resources", "font"),
+    ]
+    env.txtm = TextManager()
+
+
+class HeadlessExperiment(experiment.ExoInstructions):
+    """ExoInstructions with the eye tracker and event manager supplied directly,
+    instead of from a KLibs runtime environment.
+
+    """
+    el = None
+    evm = None
+
+    def __init__(self, el, evm):
+        self.el = el
+        self.evm = evm
+
+
+def load_params(workdir, screen=(1920, 1080), ppd=40.0, refresh_rate=60.0):
+    """Loads the project's params file into P, along with simulated display
+    settings and paths within a given working folder.
+
+    """
+    params = {}
+    params_path = os.path.join(CONFIG_DIR, "ExoInstructions_params.py")
+    with open(params_path, "r") as f:
+        exec(f.read(), params)
+    for name, value in params.items():
+        if not name.startswith("__"):
+            setattr(P, name, value)
+    P.screen_x, P.screen_y = screen
+    P.screen_c = (screen[0] // 2, screen[1] // 2)
+    P.ppd = ppd
+    P.refresh_rate = refresh_rate
+    P.refresh_time = 1000.0 / refresh_rate
+    P.local_dir = workdir
+    P.database_path = os.path.join(workdir, "sim.db")
+    P.edf_dir = os.path.join(workdir, "EDF")
+    P.id_field_name = "participant_id"
+    P.in_trial = False
+
+
+def init_database(db_path):
+    """Creates the project database from the schema, if it doesn't exist."""
+    if os.path.exists(db_path):
+        return
+    with open(os.path.join(CONFIG_DIR, "ExoInstructions_schema.sql"), "r") as f:
+        schema = f.read()
+    db = sqlite3.connect(db_path)
+    db.executescript(schema)
+    db.close()
+
+
+def add_participant(db_path, label):
+    """Adds a simulated participant to the database, returning their ID."""
+    db = sqlite3.connect(db_path)
+    with db:
+        cursor = db.execute(
+            "INSERT INTO participants (userhash, gender, age, handedness, created) "
+            "VALUES (?, 'n', -1, 'a', ?)", (label, time.strftime("%Y-%m-%d %H:%M:%S"))
+        )
+    db.close()
+    return cursor.lastrowid
+
+
+def run_session(backend, condition, seed, practice=True, max_trials=None):
+    """Runs a full ExoInstructions session headlessly.
+
+    Mirrors the order in which KLibs runs the experiment: setup(), then block()
+    and trial_prep()/trial() for each trial, with recycled trials going back
+    into the block, then clean_up().
+
+    Returns:
+        dict: A summary of the session.
+
+    """
+    wall_start = time.time()
+    sim_start = backend.clock.now
+
+    P.condition = condition
+    P.random_seed = seed
+    P.run_practice_blocks = practice
+    P.max_trials_per_block = max_trials
+    P.participant_id = add_participant(P.database_path, "sim-{0}".format(seed))
+    # Make sure the block structure is rebuilt for this session's condition
+    sys.modules.pop('exp_structure', None)
+
+    exp = HeadlessExperiment(backend.tracker, backend.evm)
+    exp.setup()
+
+    completed = 0
+    recycled = {}
+    P.block_number = 0
+    for block in exp.blocks:
+        P.block_number += 1
+        P.practicing = block.practice
+        exp.block()
+        P.trial_number = 1
+        for trial in block:
+            for factor, value in trial.items():
+                setattr(exp, factor, value)
+            backend.tracker.new_trial()
+            backend.participant.plan_trial(exp.block_type, exp.target, exp.cue_onset)
+            exp.trial_prep()
+            exp.evm.start_clock()
+            P.in_trial = True
+            try:
+                data = exp.trial()
+                P.in_trial = False
+                exp.__log_trial__(data)
+                P.trial_number += 1
+                completed += 1
+            except TrialException as e:
+                P.in_trial = False
+                block.recycle()
+                recycled[str(e)] = recycled.get(str(e), 0) + 1
+            exp.evm.stop_clock()
+    exp.clean_up()
+
+    sim_time = backend.clock.now - sim_start
+    wall_time = time.time() - wall_start
+    return {
+        'participant_id': P.participant_id,
+        'condition': condition,
+        'seed': seed,
+        'trials': completed,
+        'recycled': recycled,
+        'drift_corrections': backend.tracker.drift_corrections,
+        'sim_time': sim_time,
+        'wall_time': wall_time,
+        'speedup': sim_time / wall_time if wall_time > 0 else float('inf'),
+    }
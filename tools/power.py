@@ -0,0 +1,343 @@
+"""Estimates power for the cue validity x instruction interaction by simulation.
+
+Trials for each virtual participant are generated in batches from the task's
+actual block structures (the klibs_wip Blocks defined in exp_structure.py, with
+optional overrides for the number of blocks per instruction type and the cue
+validity ratio), and RTs and accuracy are drawn from simple parametric models
+with cueing effects that differ by instruction type. Each simulated experiment
+tests the interaction with a paired t-test on the participants' cueing effects
+(RT: invalid minus valid mean correct RT; accuracy: valid minus invalid
+proportion correct) under speed vs. accuracy instructions, which is equivalent
+to the F-test for the interaction in a 2 x 2 within-subjects ANOVA.
+
+Grids of design and effect parameters (comma-separated lists) are run in
+parallel across a process pool. For example, to compare 6 and 8 blocks per
+instruction type at 25% and 66% cue validity with 20-40 participants:
+
+    python tools/power.py --blocks 6,8 --validity 1:3,2:1 --participants 20,30,40
+
+"""
+import os
+import sys
+import math
+import time
+import random
+import argparse
+import itertools
+import multiprocessing
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CODE_DIR = os.path.join(ROOT, "ExpAssets", "Resources", "code")
+for _path in (ROOT, CODE_DIR):
+    if not _path in sys.path:
+        sys.path.insert(0, _path)
+
+from klibs import P
+from klibs_wip import Block
+
+CONDITIONS = ["I-A", "I-B", "NI-A", "NI-B"]
+INSTRUCTIONS = ["acc", "rt"]
+CHUNK_SIZE = 100  # number of simulated experiments to generate at once
+
+
+def load_blocks(condition, blocks=None, validity=None):
+    """Gets the non-practice blocks of the task structure for a condition.
+
+    Args:
+        condition (str): The condition code (e.g. 'NI-A') to load the structure
+            for.
+        blocks (int, optional): The number of blocks per instruction type to use
+            instead of the condition's.
+        validity (tuple, optional): The ratio of valid to invalid cues to use
+            instead of the condition's, as a (valid, invalid) tuple.
+
+    Returns:
+        list: A (instructions, :obj:`Block`, count) tuple for each type of block,
+        where count is the number of blocks of that type in the session.
+
+    """
+    P.condition = condition
+    sys.modules.pop('exp_structure', None)
+    import exp_structure
+
+    factors = exp_structure.exp_factors
+    if validity:
+        valid, invalid = validity
+        factors = factors.override(
+            {'cue_validity': [True] * valid + [False] * invalid}
+        )
+    counts = {}
+    block_types = {}
+    for block in exp_structure.structure:
+        if block.practice:
+            continue
+        counts[block.label] = counts.get(block.label, 0) + 1
+        if validity:
+            block_types[block.label] = Block(factors, label=block.label)
+        else:
+            block_types[block.label] = block
+    return [
+        (label, block_types[label], blocks if blocks else counts[label])
+        for label in INSTRUCTIONS
+    ]
+
+
+def t_test_p(t, df):
+    """Gets the two-tailed p-value for a t statistic.
+
+    Uses the regularized incomplete beta function, so that SciPy isn't needed.
+    Undefined t statistics (NaN, e.g. from too few or identical values) or
+    degrees of freedom give a p-value of 1.0, and infinite ones give 0.0.
+
+    """
+    if np.isnan(t) or not df > 0:
+        return 1.0
+    if np.isinf(t):
+        return 0.0
+    x = df / (df + t * t)
+    return _betai(df / 2.0, 0.5, x)
+
+
+def _betai(a, b, x):
+    # The regularized incomplete beta function I_x(a, b), via its continued
+    # fraction (see Numerical Recipes, 6.4)
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    ln_front = (
+        math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+        + a * math.log(x) + b * math.log(1.0 - x)
+    )
+    if x < (a + 1.0) / (a + b + 2.0):
+        return math.exp(ln_front) * _betacf(a, b, x) / a
+    return 1.0 - math.exp(ln_front) * _betacf(b, a, 1.0 - x) / b
+
+
+def _betacf(a, b, x, max_iter=200, eps=3e-14):
+    tiny = 1e-300
+    c, d = (1.0, 1.0 - (a + b) * x / (a + 1.0))
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, max_iter + 1):
+        m2 = 2 * m
+        for num in (m * (b - m) * x / ((a + m2 - 1) * (a + m2)),
+                    -(a + m) * (a + b + m) * x / ((a + m2) * (a + m2 + 1))):
+            d = 1.0 + num * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + num / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1.0) < eps:
+            break
+    return h
+
+
+def _generate_validity(block_types, n, rng):
+    # Generates the cue validity of every trial for n participants from the
+    # block structure, returning an (n, trials) bool array for each instruction
+    # type. Since each block's trial count is a full set of factor combinations,
+    # generating all participants' blocks at once keeps each block balanced.
+    trials = {}
+    for label, block, count in block_types:
+        col = block.factors.index('cue_validity')
+        levels = np.array(block.levels[col], dtype=bool)
+        per_participant = block.trialcount * count
+        idx = block.get_trial_indices(rng=rng, count=per_participant * n)
+        trials[label] = levels[idx[:, col]].reshape(n, per_participant)
+    return trials
+
+
+def simulate(params, n_sims, seed):
+    """Runs a set of simulated experiments for a single set of parameters.
+
+    Args:
+        params (dict): The design and effect parameters to simulate.
+        n_sims (int): The number of simulated experiments to run.
+        seed (int): The random seed to use.
+
+    Returns:
+        dict: The parameters, along with the power for the RT and accuracy
+        interactions and the mean observed effects.
+
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(rng.getrandbits(64))
+    block_types = load_blocks(
+        params['condition'], params['blocks'], params['validity']
+    )
+    n = params['participants']
+    alpha = params['alpha']
+
+    rt_cueing = {'acc': params['cueing_acc'], 'rt': params['cueing_rt']}
+    acc_cueing = {'acc': params['acc_cueing_acc'], 'rt': params['acc_cueing_rt']}
+    sig_rt, sig_acc, rt_effects, acc_effects = ([], [], [], [])
+    done = 0
+    while done < n_sims:
+        chunk = min(CHUNK_SIZE, n_sims - done)
+        validity = _generate_validity(block_types, chunk * n, rng)
+        rt_fx, acc_fx = ({}, {})
+        for label in INSTRUCTIONS:
+            invalid = ~validity[label].reshape(chunk, n, -1)
+            shape = invalid.shape
+            # RT: participant intercept & cueing effect + ex-Gaussian trial noise
+            intercept = np_rng.normal(0, params['subject_sd'], (chunk, n, 1))
+            slope = np_rng.normal(0, params['cueing_sd'], (chunk, n, 1))
+            rt = (
+                params['rt_' + label] + intercept
+                + invalid * (rt_cueing[label] + slope)
+                + np_rng.normal(0, params['rt_sd'], shape)
+                + np_rng.exponential(params['rt_tau'], shape)
+            )
+            p_correct = params['accuracy_' + label] - invalid * acc_cueing[label]
+            correct = np_rng.random(shape) < p_correct
+            # Get each participant's cueing effects for the instruction type
+            n_valid = (~invalid & correct).sum(axis=2)
+            n_invalid = (invalid & correct).sum(axis=2)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                rt_valid = (rt * (~invalid & correct)).sum(axis=2) / n_valid
+                rt_invalid = (rt * (invalid & correct)).sum(axis=2) / n_invalid
+                acc_valid = (~invalid & correct).sum(axis=2) / (~invalid).sum(axis=2)
+                acc_invalid = (invalid & correct).sum(axis=2) / invalid.sum(axis=2)
+            rt_fx[label] = rt_invalid - rt_valid
+            acc_fx[label] = acc_valid - acc_invalid
+
+        # Test the interaction for each simulated experiment
+        for diffs, sig, effects in ((rt_fx['rt'] - rt_fx['acc'], sig_rt, rt_effects),
+                                    (acc_fx['rt'] - acc_fx['acc'], sig_acc,
+                                     acc_effects)):
+            mean = np.nanmean(diffs, axis=1)
+            sd = np.nanstd(diffs, axis=1, ddof=1)
+            n_ok = np.sum(~np.isnan(diffs), axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                t = mean / (sd / np.sqrt(n_ok))
+            sig += [t_test_p(ti, ni - 1) < alpha for ti, ni in zip(t, n_ok)]
+            effects += list(mean)
+        done += chunk
+
+    results = dict(params)
+    results['blocks'] = block_types[0][2]
+    results['validity'] = "{0}:{1}".format(*params['validity'])
+    results['trials'] = sum(b.trialcount * c for _, b, c in block_types)
+    results['power_rt'] = float(np.mean(sig_rt))
+    results['power_acc'] = float(np.mean(sig_acc))
+    results['mean_rt_interaction'] = float(np.nanmean(rt_effects))
+    results['mean_acc_interaction'] = float(np.nanmean(acc_effects))
+    return results
+
+
+def _run_task(args):
+    return simulate(*args)
+
+
+def _parse_list(s, func=float):
+    return [func(x) for x in s.split(",")]
+
+
+def _parse_ratio(s):
+    valid, invalid = s.split(":")
+    return (int(valid), int(invalid))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--condition", default="NI-A", choices=CONDITIONS,
+                        help="the condition to take the default design from")
+    parser.add_argument("--blocks", default=None,
+                        help="blocks per instruction type (default: condition's)")
+    parser.add_argument("--validity", default=None,
+                        help="valid:invalid cue ratios, e.g. 1:3,2:1 "
+                             "(default: condition's)")
+    parser.add_argument("--participants", default="30")
+    parser.add_argument("--sims", type=int, default=1000,
+                        help="simulated experiments per set of parameters")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--rt-acc", default="650",
+                        help="mean valid-cue RT (ms) under accuracy instructions")
+    parser.add_argument("--rt-rt", default="480",
+                        help="mean valid-cue RT (ms) under speed instructions")
+    parser.add_argument("--cueing-acc", default="30",
+                        help="RT cueing effect (ms) under accuracy instructions")
+    parser.add_argument("--cueing-rt", default="15",
+                        help="RT cueing effect (ms) under speed instructions")
+    parser.add_argument("--accuracy-acc", default="0.95")
+    parser.add_argument("--accuracy-rt", default="0.85")
+    parser.add_argument("--acc-cueing-acc", default="0.01",
+                        help="accuracy cueing effect under accuracy instructions")
+    parser.add_argument("--acc-cueing-rt", default="0.04",
+                        help="accuracy cueing effect under speed instructions")
+    parser.add_argument("--rt-sd", type=float, default=80.0,
+                        help="SD of the normal part of trial RT noise")
+    parser.add_argument("--rt-tau", type=float, default=100.0,
+                        help="mean of the exponential part of trial RT noise")
+    parser.add_argument("--subject-sd", type=float, default=100.0,
+                        help="SD of participants' mean RTs")
+    parser.add_argument("--cueing-sd", type=float, default=15.0,
+                        help="SD of participants' RT cueing effects")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--out", default=None,
+                        help="a file to write the results to (tab-separated)")
+    opts = parser.parse_args()
+
+    default_validity = {"NI": (1, 3), "I": (2, 1)}[opts.condition.split("-")[0]]
+    grid = {
+        'blocks': _parse_list(opts.blocks, int) if opts.blocks else [None],
+        'validity': [_parse_ratio(s) for s in opts.validity.split(",")]
+            if opts.validity else [default_validity],
+        'participants': _parse_list(opts.participants, int),
+        'rt_acc': _parse_list(opts.rt_acc),
+        'rt_rt': _parse_list(opts.rt_rt),
+        'cueing_acc': _parse_list(opts.cueing_acc),
+        'cueing_rt': _parse_list(opts.cueing_rt),
+        'accuracy_acc': _parse_list(opts.accuracy_acc),
+        'accuracy_rt': _parse_list(opts.accuracy_rt),
+        'acc_cueing_acc': _parse_list(opts.acc_cueing_acc),
+        'acc_cueing_rt': _parse_list(opts.acc_cueing_rt),
+    }
+    fixed = {
+        'condition': opts.condition, 'alpha': opts.alpha, 'rt_sd': opts.rt_sd,
+        'rt_tau': opts.rt_tau, 'subject_sd': opts.subject_sd,
+        'cueing_sd': opts.cueing_sd,
+    }
+    seed = opts.seed if opts.seed is not None else random.randrange(2 ** 31)
+    rng = random.Random(seed)
+    tasks = []
+    for values in itertools.product(*grid.values()):
+        params = dict(zip(grid.keys(), values))
+        params.update(fixed)
+        tasks.append((params, opts.sims, rng.randrange(2 ** 31)))
+
+    start = time.time()
+    jobs = max(1, min(opts.jobs or multiprocessing.cpu_count(), len(tasks)))
+    if jobs == 1:
+        results = [_run_task(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.map(_run_task, tasks)
+
+    # Only show the parameters that vary across the grid, plus the results
+    varying = [k for k, v in grid.items() if len(v) > 1]
+    cols = ['blocks', 'validity', 'participants', 'trials'] + [
+        k for k in varying if k not in ('blocks', 'validity', 'participants')
+    ]
+    cols += ['mean_rt_interaction', 'power_rt', 'mean_acc_interaction', 'power_acc']
+    lines = ["\t".join(cols)]
+    for r in results:
+        vals = [r[c] for c in cols]
+        lines.append("\t".join([
+            "{0:.3f}".format(v) if isinstance(v, float) else str(v) for v in vals
+        ]))
+    print("\n".join(lines))
+    print("\n{0} simulated experiments per row (seed {1}), {2:.1f} s".format(
+        opts.sims, seed, time.time() - start
+    ))
+    if opts.out:
+        with open(opts.out, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+    main()
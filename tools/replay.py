@@ -0,0 +1,313 @@
+"""Replays recorded ExoInstructions sessions as offscreen-rendered frames.
+
+Each completed trial in the database is rebuilt from its recorded target,
+target location, cue location, cue onset, RT, and error into the sequence of
+frames draw_screen() and show_feedback() would have shown (fixation & boxes,
+cue, target, target removed, and feedback), with the time each stayed on
+screen. Frames are rendered offscreen by the experiment's own stimulus and
+layout code (no display or tracker needed) across a pool of worker processes.
+The output is either a numbered PNG sequence (with a frames.tsv index of each
+frame's trial, label, and duration) or an animated GIF.
+
+Example:
+
+    python tools/replay.py 1 --out ExpAssets/Local/replay/p1
+    python tools/replay.py 1 --gif p1_block3.gif --block 3 --scale 0.4
+
+"""
+import os
+import io
+import time
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+
+import numpy as np
+from PIL import Image
+
+from klibs import P
+
+from headless import ROOT, HeadlessExperiment, load_params, init_text
+from text_cache import cached_message
+
+DEFAULT_DB = os.path.join(ROOT, "ExpAssets", "ExoInstructions.db")
+
+CUE_TARGET_SOA = 300
+TARGET_DURATION = 50
+RESPONSE_TIMEOUT = 2000
+ERR_MESSAGES = {
+    'timeout': "Too slow!", 'blinked': "Blinked!", 'looked_away': "Looked away!"
+}
+
+
+def _to_image(surface):
+    # Converts a rendered KLibs surface or shape to a Pillow image
+    return Image.fromarray(np.asarray(surface.render(), dtype=np.uint8), "RGBA")
+
+
+class FrameRenderer(object):
+    """Renders the experiment's trial and feedback displays offscreen.
+
+    The stimuli and pre-composited trial layouts are created by the experiment
+    itself (see ``ExoInstructions._make_stimuli`` and ``_build_frames``), so
+    replayed frames always match what was shown during the task.
+
+    Args:
+        screen (tuple): The (width, height) of the screen in pixels.
+        ppd (float): The pixels per degree of visual angle of the display.
+        scale (float, optional): A factor to scale the output images by.
+
+    """
+    def __init__(self, screen, ppd, scale=1.0):
+        load_params(tempfile.gettempdir(), screen=screen, ppd=ppd)
+        init_text()
+        self.screen = screen
+        self.scale = scale
+        self.background = tuple(P.default_fill_color)
+        self._cache = {}
+        self.exp = HeadlessExperiment(None, None)
+        self.exp._make_stimuli()
+        self.frames = self.exp._build_frames(self.exp._make_shapes())
+
+    def _screen(self, surface):
+        # Draws a surface in the middle of the screen, as blit(x, 5, screen_c)
+        img = Image.new("RGBA", self.screen, self.background)
+        layer = _to_image(surface)
+        pos = (
+            P.screen_c[0] - layer.width // 2, P.screen_c[1] - layer.height // 2
+        )
+        img.alpha_composite(layer, pos)
+        return img.convert("RGB")
+
+    def trial_frame(self, cue_loc=None, target_loc=None, target=None):
+        """Renders the trial display for a given cue and target."""
+        return self._screen(self.frames[(cue_loc, target_loc, target)])
+
+    def feedback_frame(self, kind, value=None):
+        """Renders a feedback display.
+
+        Args:
+            kind (str): 'correct' or 'incorrect' for accuracy feedback, 'rt' for
+                RT feedback, or 'err' for an error message.
+            value (str, optional): The RT or error message to show.
+
+        """
+        if kind == 'correct':
+            return self._screen(self.exp.feedback[1])
+        elif kind == 'incorrect':
+            return self._screen(self.exp.feedback[0])
+        style = 'feedback' if kind == 'rt' else 'err'
+        return self._screen(cached_message(value, style=style))
+
+    def render(self, key):
+        """Renders (and caches) a frame from its description."""
+        if not key in self._cache:
+            kind, args = key
+            if kind == 'trial':
+                img = self.trial_frame(*args)
+            else:
+                img = self.feedback_frame(*args)
+            if self.scale != 1.0:
+                size = (int(img.width * self.scale), int(img.height * self.scale))
+                img = img.resize(size, Image.LANCZOS)
+            self._cache[key] = img
+        return self._cache[key]
+
+
+def trial_frames(row, feedback_time=None):
+    """Gets the sequence of frames shown on a trial from its data.
+
+    Args:
+        row (dict): The trial's row in the trials table.
+        feedback_time (float, optional): The recorded trial time (in ms) of the
+            feedback flip, if available, for trials that ended in an error.
+
+    Returns:
+        list: A (label, frame description, duration in ms) tuple for each frame.
+
+    """
+    cue_loc, target_loc, target = (row['cue_loc'], row['target_loc'], row['target'])
+    frames = [
+        ('trial_start', ('trial', (None, None, None)), int(row['cue_onset'])),
+        ('cue_on', ('trial', (cue_loc, None, None)), CUE_TARGET_SOA),
+        ('target_on', ('trial', (cue_loc, target_loc, target)), TARGET_DURATION),
+    ]
+    if row['err'] == "NA":
+        response_time = float(row['rt'])
+    elif feedback_time is not None:
+        response_time = feedback_time - int(row['cue_onset']) - CUE_TARGET_SOA
+    else:
+        response_time = RESPONSE_TIMEOUT
+    if response_time > TARGET_DURATION:
+        frames.append((
+            'target_off', ('trial', (cue_loc, None, None)),
+            int(round(response_time - TARGET_DURATION))
+        ))
+    else:
+        # If the response came before the target was removed, cut the target short
+        label, frame, _ = frames[-1]
+        frames[-1] = (label, frame, max(0, int(round(response_time))))
+
+    if row['err'] != "NA":
+        msg = ERR_MESSAGES.get(row['err'], row['err'])
+        frames.append(('feedback', ('feedback', ('err', msg)), 2000))
+    elif row['instructions'] == "acc":
+        kind = 'correct' if int(row['accuracy']) == 1 else 'incorrect'
+        frames.append(('feedback', ('feedback', (kind,)), 1000))
+    else:
+        value = str(int(float(row['rt'])))
+        frames.append(('feedback', ('feedback', ('rt', value)), 1000))
+    return frames
+
+
+def load_trials(db_path, participant_id, block=None):
+    """Loads a participant's trials, along with their recorded feedback times."""
+    db = sqlite3.connect(db_path)
+    db.row_factory = sqlite3.Row
+    try:
+        q = "SELECT * FROM trials WHERE participant_id = ?"
+        args = [participant_id]
+        if block is not None:
+            q += " AND block_num = ?"
+            args.append(block)
+        rows = [dict(r) for r in db.execute(q + " ORDER BY id", args)]
+        feedback = {}
+        q = (
+            "SELECT block_num, trial_num, flipped FROM frame_timing "
+            "WHERE participant_id = ? AND recycled = 0 AND frame = 'feedback'"
+        )
+        try:
+            for b, t, flipped in db.execute(q, (participant_id,)):
+                feedback[(b, t)] = flipped
+        except sqlite3.OperationalError:
+            pass  # older databases without frame timing
+    finally:
+        db.close()
+    return [(row, feedback.get((row['block_num'], row['trial_num']))) for row in rows]
+
+
+def _render_chunk(args):
+    # Renders the frames for a chunk of trials, either writing them as PNGs or
+    # (for a GIF) returning each distinct frame once, as a palette image
+    screen, ppd, scale, trials, outdir, start_index = args
+    renderer = FrameRenderer(screen, ppd, scale)
+    encoded = {}
+    distinct = {}
+    index = []
+    i = start_index
+    for row, feedback_time in trials:
+        for label, key, duration in trial_frames(row, feedback_time):
+            if outdir:
+                # Encode each distinct frame once, then write the bytes for reuse
+                if not key in encoded:
+                    buf = io.BytesIO()
+                    renderer.render(key).save(buf, "PNG", compress_level=1)
+                    encoded[key] = buf.getvalue()
+                fname = "frame_{0:06d}.png".format(i)
+                with open(os.path.join(outdir, fname), "wb") as f:
+                    f.write(encoded[key])
+            else:
+                fname = None
+                if not key in distinct:
+                    img = renderer.render(key)
+                    distinct[key] = img.convert("P", palette=Image.ADAPTIVE)
+            index.append(
+                (fname, row['block_num'], row['trial_num'], label, duration, key)
+            )
+            i += 1
+    return (index, distinct)
+
+
+def replay(db_path, participant_id, screen, ppd, outdir=None, gif=None,
+           block=None, scale=1.0, jobs=None):
+    """Renders a participant's recorded session as PNG frames or a GIF.
+
+    Args:
+        db_path (str): The path of the experiment database.
+        participant_id (int): The database ID of the participant to replay.
+        screen (tuple): The (width, height) of the screen in pixels.
+        ppd (float): The pixels per degree of visual angle of the display.
+        outdir (str, optional): The folder to write a PNG sequence to.
+        gif (str, optional): The path to write an animated GIF to.
+        block (int, optional): The block number to replay. Defaults to all.
+        scale (float, optional): A factor to scale the output images by.
+        jobs (int, optional): The number of worker processes to render with.
+
+    Returns:
+        list: The (file, block, trial, label, duration) of each frame rendered.
+
+    """
+    trials = load_trials(db_path, participant_id, block)
+    if not trials:
+        raise ValueError("No trials found for participant {0}.".format(participant_id))
+    if outdir and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    jobs = max(1, min(jobs or multiprocessing.cpu_count(), len(trials)))
+    chunk_size = -(-len(trials) // jobs)
+    tasks = []
+    start_index = 0
+    for i in range(0, len(trials), chunk_size):
+        chunk = trials[i:i + chunk_size]
+        tasks.append((screen, ppd, scale, chunk, outdir, start_index))
+        start_index += sum(len(trial_frames(*t)) for t in chunk)
+    if jobs == 1:
+        results = [_render_chunk(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.map(_render_chunk, tasks)
+
+    index = [frame for chunk_index, _ in results for frame in chunk_index]
+    if gif:
+        # Frames with no duration (e.g. a target cut short by a response) can't
+        # be shown in a GIF, so they're dropped. Only the distinct frames are
+        # kept in memory, with the GIF's frames generated from them as it's saved
+        distinct = {}
+        for _, chunk_frames in results:
+            distinct.update(chunk_frames)
+        shown = [(f[5], f[4]) for f in index if f[4] > 0]
+        images = (distinct[key] for key, _ in shown[1:])
+        distinct[shown[0][0]].save(
+            gif, save_all=True, append_images=images,
+            duration=[d for _, d in shown], loop=0, optimize=False
+        )
+    index = [frame[:5] for frame in index]
+    if outdir:
+        with open(os.path.join(outdir, "frames.tsv"), "w") as f:
+            f.write("file\tblock_num\ttrial_num\tframe\tduration\n")
+            for frame in index:
+                f.write("\t".join([str(x) for x in frame]) + "\n")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("participant_id", type=int)
+    parser.add_argument("--db", default=DEFAULT_DB)
+    parser.add_argument("--out", default=None, help="folder to write PNG frames to")
+    parser.add_argument("--gif", default=None, help="path to write a GIF to")
+    parser.add_argument("--block", type=int, default=None)
+    parser.add_argument("--screen", default="1920x1080",
+                        help="the resolution of the experiment display")
+    parser.add_argument("--ppd", type=float, default=40.0,
+                        help="the pixels per degree of the experiment display")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--jobs", type=int, default=None)
+    opts = parser.parse_args()
+    if not (opts.out or opts.gif):
+        parser.error("one of --out or --gif is required")
+
+    screen = tuple(int(x) for x in opts.screen.split("x"))
+    start = time.time()
+    index = replay(
+        opts.db, opts.participant_id, screen, opts.ppd, opts.out, opts.gif,
+        opts.block, opts.scale, opts.jobs
+    )
+    trials = len(set((f[1], f[2]) for f in index))
+    print("Rendered {0} frames for {1} trials in {2:.1f} s".format(
+        len(index), trials, time.time() - start
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Runs simulated ExoInstructions sessions headlessly, much faster than real time.
+
+Each session drives the real experiment code (setup, block, trial_prep, trial,
+trial recycling, and clean_up) using null graphics, a simulated clock, a
+synthetic participant, and a synthetic eye tracker (see headless.py), writing
+data to a scratch copy of the project database.
+
+Example:
+
+    python tools/simulate.py --sessions 1000 --condition all --jobs 4
+
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+
+from headless import (
+    SimClock, SimParticipant, SimEyeTracker, HeadlessBackend, install,
+    load_params, init_database, run_session,
+)
+
+CONDITIONS = ["I-A", "I-B", "NI-A", "NI-B"]
+
+
+def _run_worker(args):
+    # Runs a set of sessions in a single process, each worker with its own DB
+    opts, sessions, workdir = args
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    load_params(workdir)
+    init_database(os.path.join(workdir, "sim.db"))
+
+    clock = SimClock()
+    results = []
+    for condition, seed in sessions:
+        rng = random.Random(seed)
+        participant = SimParticipant(
+            rng, rt_sd=opts.rt_sd, anticipation=opts.anticipation,
+            rt_mean={'acc': opts.rt_acc, 'rt': opts.rt_rt},
+            accuracy={'acc': opts.accuracy_acc, 'rt': opts.accuracy_rt},
+        )
+        tracker = SimEyeTracker(
+            clock, rng, break_rate=opts.break_rate, blink_rate=opts.blink_rate
+        )
+        backend = HeadlessBackend(clock, participant, tracker)
+        install(backend)
+        results.append(run_session(
+            backend, condition, seed,
+            practice=not opts.no_practice, max_trials=opts.max_trials
+        ))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sessions", type=int, default=1)
+    parser.add_argument("--condition", default="NI-A", choices=CONDITIONS + ["all"])
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--max-trials", type=int, default=None)
+    parser.add_argument("--no-practice", action="store_true")
+    parser.add_argument("--rt-acc", type=float, default=650.0,
+                        help="mean RT (ms) under accuracy instructions")
+    parser.add_argument("--rt-rt", type=float, default=480.0,
+                        help="mean RT (ms) under speed instructions")
+    parser.add_argument("--rt-sd", type=float, default=120.0)
+    parser.add_argument("--accuracy-acc", type=float, default=0.95)
+    parser.add_argument("--accuracy-rt", type=float, default=0.85)
+    parser.add_argument("--anticipation", type=float, default=0.01,
+                        help="proportion of trials with an anticipatory response")
+    parser.add_argument("--break-rate", type=float, default=0.05,
+                        help="fixation breaks per second of trial time")
+    parser.add_argument("--blink-rate", type=float, default=0.1,
+                        help="blinks per second of trial time")
+    parser.add_argument("--outdir", default=None,
+                        help="folder for the simulated databases (default: temp)")
+    opts = parser.parse_args()
+
+    seed = opts.seed if opts.seed is not None else random.randrange(2 ** 31)
+    rng = random.Random(seed)
+    sessions = []
+    for i in range(opts.sessions):
+        condition = CONDITIONS[i % 4] if opts.condition == "all" else opts.condition
+        sessions.append((condition, rng.randrange(2 ** 31)))
+
+    outdir = opts.outdir if opts.outdir else tempfile.mkdtemp(prefix="exo_sim_")
+    jobs = max(1, min(opts.jobs, len(sessions)))
+    tasks = [
+        (opts, sessions[i::jobs], os.path.join(outdir, "worker{0}".format(i)))
+        for i in range(jobs)
+    ]
+
+    start = time.time()
+    if jobs == 1:
+        results = _run_worker(tasks[0])
+    else:
+        with multiprocessing.Pool(jobs) as pool:
+            results = [r for batch in pool.map(_run_worker, tasks) for r in batch]
+    elapsed = time.time() - start
+
+    recycled = {}
+    for r in results:
+        for reason, n in r['recycled'].items():
+            recycled[reason] = recycled.get(reason, 0) + n
+    trials = sum(r['trials'] for r in results)
+    sim_time = sum(r['sim_time'] for r in results)
+
+    print("Sessions: {0} (seed {1})".format(len(results), seed))
+    print("Trials completed: {0}".format(trials))
+    print("Trials recycled: {0}".format(sum(recycled.values())))
+    for reason, n in sorted(recycled.items()):
+        print("  {0}: {1}".format(reason, n))
+    print("Simulated time: {0:.1f} h".format(sim_time / 3600.0))
+    print("Wall time: {0:.1f} s ({1:.0f}x real time)".format(
+        elapsed, sim_time / elapsed if elapsed else float('inf')
+    ))
+    print("Databases written to: {0}".format(outdir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Shows the live metrics published by a running ExoInstructions session.
+
+Run this in a separate terminal (e.g. on the experimenter's monitor) while the
+experiment is running. It follows the session monitor file in ExpAssets/Local
+(or listens on the monitor's UDP port, if 'session_monitor' is set to 'udp' in
+the params file) and shows rolling RT, accuracy, error counts, and recycle
+rates, with warnings for signs of a tracker losing calibration or a participant
+guessing.
+
+Example:
+
+    python tools/watch_session.py
+    python tools/watch_session.py --udp 47470
+
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FILE = os.path.join(ROOT, "ExpAssets", "Local", "session_monitor.jsonl")
+
+
+def _fmt(value, spec="{0:.0f}"):
+    return "NA" if value is None else spec.format(value)
+
+
+def warnings(snapshot, opts):
+    """Gets a list of warnings for the experimenter from a metrics snapshot."""
+    warn = []
+    rolling = snapshot['rolling']
+    if rolling['n'] < opts.min_trials:
+        return warn
+    if rolling['recycle_rate'] and rolling['recycle_rate'] >= opts.max_recycle:
+        warn.append(
+            "High recycle rate ({0:.0%}): check the tracker calibration".format(
+                rolling['recycle_rate']
+            )
+        )
+    if rolling['accuracy'] is not None and rolling['accuracy'] <= opts.min_accuracy:
+        warn.append(
+            "Low accuracy ({0:.0%}): participant may be guessing".format(
+                rolling['accuracy']
+            )
+        )
+    if rolling['median_rt'] is not None and rolling['median_rt'] < opts.min_rt:
+        warn.append(
+            "Very fast RTs (median {0:.0f} ms): participant may be guessing".format(
+                rolling['median_rt']
+            )
+        )
+    schedule = snapshot.get('schedule')
+    if schedule and schedule['overrun']:
+        warn.append(
+            "Session predicted to run {0:.0f} min over its {1:.0f} min slot".format(
+                (schedule['total'] - schedule['slot']) / 60.0, schedule['slot'] / 60.0
+            )
+        )
+    if rolling['timeouts'] >= rolling['n'] // 4:
+        warn.append("Many timeouts ({0} of last {1} trials)".format(
+            rolling['timeouts'], rolling['n']
+        ))
+    return warn
+
+
+def render(snapshot, opts):
+    """Formats a metrics snapshot as text for the terminal."""
+    rolling = snapshot['rolling']
+    age = time.time() - snapshot['time']
+    lines = [
+        "Participant {0} | block {1}, trial {2} | last update {3:.0f} s ago".format(
+            snapshot['participant_id'], snapshot['block_num'], snapshot['trial_num'],
+            age
+        ),
+    ]
+    if snapshot['event'] == "session_end":
+        lines.append("Session finished.")
+    lines += [
+        "",
+        "Last {0} trials: mean RT {1} ms, median RT {2} ms, accuracy {3}, "
+        "recycled {4}".format(
+            rolling['n'], _fmt(rolling['mean_rt']), _fmt(rolling['median_rt']),
+            _fmt(rolling['accuracy'], "{0:.0%}"),
+            _fmt(rolling['recycle_rate'], "{0:.0%}"),
+        ),
+        "",
+        "{0:>5}  {1:<12} {2:>6} {3:>8} {4:>8} {5:>8} {6:>8}  {7}".format(
+            "block", "type", "trials", "recycled", "mean_rt", "accuracy",
+            "timeouts", "recycle reasons"
+        ),
+    ]
+    for b in snapshot['blocks']:
+        block_type = b['instructions'] + (" (prac)" if b['practice'] else "")
+        reasons = ", ".join(
+            "{0}: {1}".format(k, v) for k, v in sorted(b['recycles'].items())
+        )
+        lines.append(
+            "{0:>5}  {1:<12} {2:>6} {3:>8} {4:>8} {5:>8} {6:>8}  {7}".format(
+                b['block'], block_type, b['trials'],
+                _fmt(b['recycle_rate'], "{0:.0%}"), _fmt(b['mean_rt']),
+                _fmt(b['accuracy'], "{0:.0%}"), b['errs'].get("timeout", 0), reasons
+            )
+        )
+    schedule = snapshot.get('schedule')
+    if schedule and schedule['remaining'] is not None:
+        slot = ""
+        if schedule['slot']:
+            slot = " of {0:.0f} min slot".format(schedule['slot'] / 60.0)
+        lines += ["", (
+            "Predicted: {0:.0f} min left ({1} trials, {2:.0%} recycled), "
+            "{3:.0f} min total{4}".format(
+                schedule['remaining'] / 60.0, schedule['trials_left'],
+                schedule['recycle_rate'], schedule['total'] / 60.0, slot
+            )
+        )]
+    lines.append("")
+    for name, tally in sorted(snapshot['instructions'].items()):
+        lines.append("{0:<10} mean RT {1} ms, accuracy {2}, recycled {3}".format(
+            name + ":", _fmt(tally['mean_rt']), _fmt(tally['accuracy'], "{0:.0%}"),
+            _fmt(tally['recycle_rate'], "{0:.0%}")
+        ))
+    warn = warnings(snapshot, opts)
+    if warn:
+        lines.append("")
+        lines += ["WARNING: " + w for w in warn]
+    return "\n".join(lines)
+
+
+def _show(snapshot, opts):
+    if not opts.once:
+        sys.stdout.write("\033[2J\033[H")  # clear the terminal
+    print(render(snapshot, opts))
+    sys.stdout.flush()
+
+
+def follow_file(path, opts):
+    # Waits for the monitor file to exist, then shows each new snapshot
+    while not os.path.exists(path):
+        time.sleep(opts.interval)
+    with open(path, "r") as f:
+        latest = None
+        for line in f:
+            latest = line
+        if latest:
+            _show(json.loads(latest), opts)
+        if opts.once:
+            return
+        partial = ""
+        while True:
+            partial += f.readline()
+            if partial.endswith("\n"):
+                _show(json.loads(partial), opts)
+                partial = ""
+            else:
+                time.sleep(opts.interval)
+
+
+def follow_udp(port, opts):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", port))
+    while True:
+        data, _ = sock.recvfrom(65536)
+        _show(json.loads(data.decode('utf-8')), opts)
+        if opts.once:
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--file", default=DEFAULT_FILE,
+                        help="the session monitor file to follow")
+    parser.add_argument("--udp", type=int, default=None, metavar="PORT",
+                        help="listen for metrics on a UDP port instead of a file")
+    parser.add_argument("--interval", type=float, default=0.25,
+                        help="how often (in seconds) to check for new metrics")
+    parser.add_argument("--once", action="store_true",
+                        help="show the latest metrics and exit")
+    parser.add_argument("--min-trials", type=int, default=10,
+                        help="recent trials needed before showing warnings")
+    parser.add_argument("--max-recycle", type=float, default=0.3)
+    parser.add_argument("--min-accuracy", type=float, default=0.65)
+    parser.add_argument("--min-rt", type=float, default=200.0)
+    opts = parser.parse_args()
+
+    try:
+        if opts.udp:
+            follow_udp(opts.udp, opts)
+        else:
+            follow_file(opts.file, opts)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()